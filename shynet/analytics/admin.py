@@ -1,12 +1,14 @@
 from django.contrib import admin
 
-from .models import Hit, Session
+from .dimensions import DIMENSIONS
+from .models import Dimension, Hit, Session, Sketch, Url
 
 
 class HitInline(admin.TabularInline):
     model = Hit
     fk_name = "session"
     extra = 0
+    raw_id_fields = ("location_url", "referrer_url")
 
 
 class SessionAdmin(admin.ModelAdmin):
@@ -23,14 +25,15 @@ class SessionAdmin(admin.ModelAdmin):
     list_display_links = ("uuid",)
     search_fields = (
         "ip",
-        "user_agent",
-        "device",
+        "user_agent_dimension__value",
+        "device_dimension__value",
         "device_type",
         "identifier",
-        "asn",
-        "time_zone",
+        "asn_dimension__value",
+        "time_zone_dimension__value",
     )
     list_filter = ("device_type",)
+    raw_id_fields = [f"{kind}_dimension" for kind in DIMENSIONS]
     inlines = [HitInline]
 
 
@@ -48,8 +51,35 @@ class HitAdmin(admin.ModelAdmin):
         "location",
     )
     list_display_links = ("session",)
-    search_fields = ("initial", "tracker", "location", "referrer")
+    search_fields = ("initial", "tracker", "location_url__url", "referrer_url__url")
     list_filter = ("initial", "tracker")
+    raw_id_fields = ("location_url", "referrer_url")
 
 
 admin.site.register(Hit, HitAdmin)
+
+
+class DimensionAdmin(admin.ModelAdmin):
+    list_display = ("kind", "value")
+    search_fields = ("value",)
+    list_filter = ("kind",)
+
+
+admin.site.register(Dimension, DimensionAdmin)
+
+
+class UrlAdmin(admin.ModelAdmin):
+    list_display = ("url", "host")
+    search_fields = ("url",)
+
+
+admin.site.register(Url, UrlAdmin)
+
+
+class SketchAdmin(admin.ModelAdmin):
+    list_display = ("service", "kind", "hour")
+    list_filter = ("kind",)
+    readonly_fields = ("data",)
+
+
+admin.site.register(Sketch, SketchAdmin)
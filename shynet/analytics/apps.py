@@ -3,3 +3,19 @@ from django.apps import AppConfig
 
 class AnalyticsConfig(AppConfig):
     name = "analytics"
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_migrate, post_save
+        from health_check.plugins import plugin_dir
+
+        from .dimensions import clear_dimension_cache
+        from .filtering import clear_ingress_config
+
+        from .health_checks import IngressLagHealthCheck
+
+        plugin_dir.register(IngressLagHealthCheck)
+        # Flushing or migrating the database can invalidate cached dimension IDs
+        post_migrate.connect(clear_dimension_cache, sender=self)
+        # Services' ingress configs are cached, so they're cleared when they change
+        post_save.connect(clear_ingress_config, sender="core.Service")
+        post_delete.connect(clear_ingress_config, sender="core.Service")
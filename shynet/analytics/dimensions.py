@@ -0,0 +1,223 @@
+import threading
+from collections import OrderedDict
+from hashlib import blake2b
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.apps import apps
+from django.db import transaction
+
+# The session fields whose values repeat across sessions, so sessions store them
+# as references to dimensions
+DIMENSIONS = ("user_agent", "browser", "device", "os", "asn", "country", "time_zone")
+
+# Longer values are cut off, which keeps them small enough for PostgreSQL to index
+# even when every character takes four bytes
+MAX_VALUE_LENGTH = 512
+
+# How many dimensions and URLs each process remembers
+MAX_CACHED_DIMENSIONS = 20000
+MAX_CACHED_URLS = 50000
+
+
+class DimensionCache:
+    """Process-local cache of dimension IDs by value and values by ID, evicting the
+    least recently used entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._ids = OrderedDict()  # (kind, value) -> pk
+        self._values = OrderedDict()  # pk -> value
+        self._lock = threading.Lock()
+
+    def get_id(self, kind, value):
+        with self._lock:
+            pk = self._ids.get((kind, value))
+            if pk is not None:
+                self._ids.move_to_end((kind, value))
+            return pk
+
+    def get_value(self, pk):
+        with self._lock:
+            value = self._values.get(pk)
+            if value is not None:
+                self._values.move_to_end(pk)
+            return value
+
+    def add(self, kind, value, pk):
+        with self._lock:
+            self._ids[(kind, value)] = pk
+            self._ids.move_to_end((kind, value))
+            self._values[pk] = value
+            self._values.move_to_end(pk)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._values.clear()
+
+
+_cache = DimensionCache(MAX_CACHED_DIMENSIONS)
+_url_cache = DimensionCache(MAX_CACHED_URLS)
+
+
+def clear_dimension_cache(**kwargs):
+    _cache.clear()
+    _url_cache.clear()
+
+
+def _remember(cache, kind, value, pk):
+    # A dimension that was created or found in a transaction that is rolled back
+    # might not exist, so it's only cached once the transaction commits
+    transaction.on_commit(lambda: cache.add(kind, value, pk))
+
+
+def _get_values(cache, load, pks):
+    """Looks up values by ID in a cache, and loads the missing ones with `load`,
+    which returns `(pk, kind, value)` for each of the IDs it's given."""
+    values = {}
+    missing = set()
+    for pk in pks:
+        if pk is None or pk in values:
+            continue
+        value = cache.get_value(pk)
+        if value is None:
+            missing.add(pk)
+        else:
+            values[pk] = value
+    if missing:
+        for pk, kind, value in load(missing):
+            values[pk] = value
+            _remember(cache, kind, value, pk)
+    return values
+
+
+def get_dimension_id(kind, value):
+    """Returns the ID of a dimension value, creating the dimension if it's new.
+    Empty values have no dimension."""
+    value = (value or "")[:MAX_VALUE_LENGTH]
+    if not value:
+        return None
+    pk = _cache.get_id(kind, value)
+    if pk is None:
+        Dimension = apps.get_model("analytics", "Dimension")
+        pk = Dimension.objects.get_or_create(kind=kind, value=value)[0].pk
+        _remember(_cache, kind, value, pk)
+    return pk
+
+
+def get_dimension_values(pks):
+    """Returns a dict of dimension IDs to values, looking up the ones that aren't
+    cached with a single query."""
+    Dimension = apps.get_model("analytics", "Dimension")
+    return _get_values(
+        _cache,
+        lambda missing: Dimension.objects.filter(pk__in=missing).values_list(
+            "pk", "kind", "value"
+        ),
+        pks,
+    )
+
+
+def get_dimension_value(pk):
+    if pk is None:
+        return ""
+    return get_dimension_values([pk]).get(pk, "")
+
+
+def encode_dimensions(fields):
+    """Returns a copy of a dict of session fields with the dimension values replaced
+    by their IDs, as the database stores them."""
+    encoded = dict(fields)
+    for kind in DIMENSIONS:
+        if kind in encoded:
+            encoded[f"{kind}_dimension_id"] = get_dimension_id(kind, encoded.pop(kind))
+    return encoded
+
+
+def prefetch_dimensions(sessions):
+    """Looks up the dimensions of several sessions at once, so that reading their
+    values doesn't take a query per session."""
+    get_dimension_values(
+        getattr(session, f"{kind}_dimension_id")
+        for session in sessions
+        for kind in DIMENSIONS
+    )
+
+
+def get_url_hash(url):
+    return blake2b(url.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def normalize_url(url, strip_query=False, kept_params=()):
+    """Drops a URL's query parameters, except for the kept ones, if `strip_query`.
+    URLs that can't be parsed are left as they are."""
+    if not strip_query or not url:
+        return url
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    query = [
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name in kept_params
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def get_url_id(url):
+    """Returns the ID of a URL, creating it if it's new. Empty URLs have none."""
+    if not url:
+        return None
+    pk = _url_cache.get_id("url", url)
+    if pk is None:
+        try:
+            host = urlsplit(url).hostname or ""
+        except ValueError:
+            host = ""
+        Url = apps.get_model("analytics", "Url")
+        pk = Url.objects.get_or_create(
+            hash=get_url_hash(url), defaults={"url": url, "host": host}
+        )[0].pk
+        _remember(_url_cache, "url", url, pk)
+    return pk
+
+
+def get_url_values(pks):
+    """Returns a dict of URL IDs to URLs, like `get_dimension_values`."""
+    Url = apps.get_model("analytics", "Url")
+    return _get_values(
+        _url_cache,
+        lambda missing: (
+            (pk, "url", url)
+            for pk, url in Url.objects.filter(pk__in=missing).values_list("pk", "url")
+        ),
+        pks,
+    )
+
+
+def get_url_value(pk):
+    if pk is None:
+        return ""
+    return get_url_values([pk]).get(pk, "")
+
+
+def encode_urls(fields):
+    """Returns a copy of a dict of hit fields with the location and referrer
+    replaced by their IDs."""
+    encoded = dict(fields)
+    for name in ("location", "referrer"):
+        if name in encoded:
+            encoded[f"{name}_url_id"] = get_url_id(encoded.pop(name))
+    return encoded
+
+
+def prefetch_urls(hits):
+    """Looks up the URLs of several hits at once, like `prefetch_dimensions`."""
+    get_url_values(
+        pk for hit in hits for pk in (hit.location_url_id, hit.referrer_url_id)
+    )
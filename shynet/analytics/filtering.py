@@ -0,0 +1,120 @@
+import ipaddress
+import logging
+import re
+from functools import lru_cache
+
+import user_agents
+from django.core.cache import cache
+from django.db import transaction
+
+from core.metrics import increment
+from core.models import Service
+
+from .utils import is_robot, is_sampled
+
+log = logging.getLogger(__name__)
+
+# Cheap prefilter for robot user agents, so that only user agents that look like
+# robots need to be parsed in the request
+ROBOT_USER_AGENT_REGEX = re.compile(r"bot|crawl|spider|slurp", re.IGNORECASE)
+
+# Configs are cleared whenever their service is saved or deleted; the timeout only
+# bounds how stale they get after bulk updates, which don't send signals
+INGRESS_CONFIG_TIMEOUT = 3600
+
+
+def get_ingress_config_cache_path(service_uuid):
+    return f"service_ingress_config_{service_uuid}"
+
+
+def build_ingress_config(service):
+    return {
+        "active": service.status == Service.ACTIVE,
+        "respect_dnt": service.respect_dnt,
+        "ignore_robots": service.ignore_robots,
+        "ignored_ips": service.ignored_ips,
+        "sample_rate": service.sample_rate,
+    }
+
+
+def get_ingress_config(service_uuid):
+    """Returns the parts of a service's settings that decide whether an event is
+    ingested at all, from the cache when possible."""
+    cache_path = get_ingress_config_cache_path(service_uuid)
+    config = cache.get(cache_path)
+    if config is None:
+        service = Service.objects.filter(uuid=service_uuid).first()
+        if service is None:
+            config = {"active": False}
+        else:
+            config = build_ingress_config(service)
+        cache.set(cache_path, config, timeout=INGRESS_CONFIG_TIMEOUT)
+    return config
+
+
+def clear_ingress_config(sender, instance, **kwargs):
+    # Cleared once the change commits, so that the config isn't cached again from
+    # the service as it was before the change
+    cache_path = get_ingress_config_cache_path(instance.uuid)
+    transaction.on_commit(lambda: cache.delete(cache_path))
+
+
+def is_ignored_ip(ip, ignored_networks):
+    if not ip:
+        return False
+    try:
+        remote_ip = ipaddress.ip_network(ip)
+    except ValueError:
+        return False
+    return any(
+        network.version == remote_ip.version and network.supernet_of(remote_ip)
+        for network in ignored_networks
+    )
+
+
+def get_rejection_reason(config, ip, user_agent, dnt, association_id):
+    """Returns why an event shouldn't be ingested, or None if it should be."""
+    if not config["active"]:
+        return "inactive"
+    if not is_sampled(association_id, config.get("sample_rate", 1)):
+        return "sampled"
+    if dnt and config["respect_dnt"]:
+        return "dnt"
+    if config["ignored_ips"].strip() and is_ignored_ip(
+        ip, _parse_ignored_networks(config["ignored_ips"])
+    ):
+        return "ignored_ip"
+    if (
+        config["ignore_robots"]
+        and ROBOT_USER_AGENT_REGEX.search(user_agent)
+        and is_robot(user_agents.parse(user_agent))
+    ):
+        return "robot"
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _parse_ignored_networks(ignored_ips):
+    try:
+        return tuple(Service(ignored_ips=ignored_ips).get_ignored_networks())
+    except ValueError as e:
+        log.exception(e)
+        return ()
+
+
+def count_rejection(reason):
+    """Counts an event's rejection by its reason, if it has one. Returns the reason."""
+    if reason is not None:
+        log.debug(f"Rejecting event before ingestion: {reason}")
+        increment("ingress_rejected", reason=reason)
+    return reason
+
+
+def reject_event(service_uuid, ip, user_agent, dnt, association_id):
+    """Decides whether an event can be dropped before it's handed to the workers,
+    counting each rejection by its reason. Returns the reason, if any."""
+    return count_rejection(
+        get_rejection_reason(
+            get_ingress_config(service_uuid), ip, user_agent, dnt, association_id
+        )
+    )
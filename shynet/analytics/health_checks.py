@@ -0,0 +1,25 @@
+from health_check.backends import BaseHealthCheckBackend
+from health_check.exceptions import ServiceUnavailable, ServiceWarning
+
+from .overload import get_overload, measure_lag
+
+
+class IngressLagHealthCheck(BaseHealthCheckBackend):
+    # Ingestion falling behind shouldn't take the webserver out of rotation, which
+    # would only make things worse
+    critical_service = False
+
+    def check_status(self):
+        try:
+            lag = measure_lag()
+        except Exception as e:
+            raise ServiceUnavailable(f"Unable to measure ingestion lag: {e}")
+        self.lag = lag
+        if get_overload(lag) >= 1:
+            raise ServiceWarning(
+                f"Ingestion is behind: {lag['depth']} events waiting, the oldest "
+                f"for {lag['age']} seconds"
+            )
+
+    def identifier(self):
+        return "Ingestion lag"
@@ -0,0 +1,395 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import re
+from collections import deque
+from datetime import datetime
+from functools import lru_cache, partial
+from hashlib import sha256
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.utils import timezone
+
+from .dimensions import encode_dimensions, get_url_id
+from .filtering import is_ignored_ip
+from .models import Hit, Session
+from .sketches import SketchBuffer, get_visitor_key
+from .tasks import get_session_fields
+from .utils import is_sampled, uuid7
+
+log = logging.getLogger(__name__)
+
+# nginx's (and Apache's) `combined` log format
+COMBINED_LOG_REGEX = re.compile(
+    r'(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>\S+) (?P<path>\S+)[^"]*" '
+    r'(?P<status>\d{3}) \S+ "(?P<referrer>[^"]*)" "(?P<user_agent>[^"]*)"'
+)
+LOG_TIME_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+
+# Requests for these aren't page views
+ASSET_EXTENSIONS = (
+    ".css",
+    ".js",
+    ".map",
+    ".json",
+    ".xml",
+    ".txt",
+    ".ico",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".svg",
+    ".webp",
+    ".avif",
+    ".woff",
+    ".woff2",
+    ".ttf",
+    ".eot",
+    ".mp4",
+    ".webm",
+    ".pdf",
+    ".zip",
+)
+
+# Fields whose values need converting before they're inserted (on databases other
+# than PostgreSQL)
+PREPARED_FIELD_TYPES = (
+    "DateTimeField",
+    "ForeignKey",
+    "GenericIPAddressField",
+    "UUIDField",
+)
+
+# How many lines each worker parses at once
+CHUNK_SIZE = 2000
+
+
+def parse_line(line):
+    """Parses a line of a combined-format access log, returning None for lines
+    that can't be parsed."""
+    match = COMBINED_LOG_REGEX.match(line)
+    if match is None:
+        return None
+    request = match.groupdict()
+    try:
+        request["time"] = datetime.strptime(request["time"], LOG_TIME_FORMAT)
+    except ValueError:
+        return None
+    request["status"] = int(request["status"])
+    if request["referrer"] == "-":
+        request["referrer"] = ""
+    return request
+
+
+def is_page_view(request):
+    if request["method"] != "GET":
+        return False
+    if not (200 <= request["status"] < 300 or request["status"] == 304):
+        return False
+    path = request["path"].split("?", 1)[0].lower()
+    return not path.endswith(ASSET_EXTENSIONS)
+
+
+@lru_cache(maxsize=65536)
+def _get_session_fields(ip, user_agent):
+    return get_session_fields(ip, user_agent)
+
+
+def parse_chunk(chunk):
+    """Parses a chunk of lines into page views, along with the session fields
+    derived from their visitors. Runs in the worker processes, as parsing user
+    agents and looking up IP addresses is what importing spends most time on."""
+    lines, all_requests = chunk
+    requests = []
+    for line in lines:
+        request = parse_line(line)
+        if request is None or not (all_requests or is_page_view(request)):
+            continue
+        request["session"] = _get_session_fields(request["ip"], request["user_agent"])
+        requests.append(request)
+    return len(lines), requests
+
+
+def open_log(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def _get_visitor_key(ip, user_agent):
+    visitor_hash = sha256()
+    visitor_hash.update(str(ip).encode("utf-8"))
+    visitor_hash.update(str(user_agent).encode("utf-8"))
+    return visitor_hash.hexdigest()
+
+
+def _format_copy_value(value):
+    if value is None:
+        return r"\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _get_preparer(field, database):
+    # Only these need converting; everything else is stored as is
+    if field.get_internal_type() not in PREPARED_FIELD_TYPES:
+        return None
+    prepare = partial(field.get_db_prep_save, connection=database)
+    if field.get_internal_type() == "DateTimeField":
+        return prepare
+    # Keys repeat from row to row, so each is only converted once
+    return lru_cache(maxsize=65536)(prepare)
+
+
+def write_rows(model, rows):
+    """Inserts rows (dicts keyed by field attribute names) with `COPY` on
+    PostgreSQL, and with a single prepared statement elsewhere."""
+    if not rows:
+        return
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow([_format_copy_value(value) for value in row.values()])
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buffer,
+            )
+        else:
+            database = connections[DEFAULT_DB_ALIAS]
+            preparers = [_get_preparer(field, database) for field in fields]
+            cursor.executemany(
+                f"INSERT INTO {table} ({columns}) "
+                f"VALUES ({', '.join(['%s'] * len(fields))})",
+                [
+                    [
+                        value if prepare is None else prepare(value)
+                        for prepare, value in zip(preparers, row.values())
+                    ]
+                    for row in rows
+                ],
+            )
+
+
+class LogImporter:
+    """Turns page views from access logs into sessions and hits, associating them
+    the same way as live ingestion does: a visitor's page views belong to the same
+    session until they go `SESSION_MEMORY_TIMEOUT` seconds without one.
+
+    Progress is written to a state file after every batch, along with the sessions
+    that later lines could still continue, so an interrupted import can resume
+    where it stopped."""
+
+    def __init__(self, service, base_url, state_path, all_requests=False):
+        self.service = service
+        self.base_url = base_url.rstrip("/")
+        self.state_path = state_path
+        self.all_requests = all_requests
+        self.ignored_networks = service.get_ignored_networks()
+        self.collect_ips = service.collect_ips and not settings.BLOCK_ALL_IPS
+        self.timeout = timezone.timedelta(seconds=settings.SESSION_MEMORY_TIMEOUT)
+
+        self.files = {}  # path -> lines imported
+        self.sessions = {}  # visitor key -> open session
+        self._load_state()
+        self._new_sessions = []  # (session, row)
+        self._updated_sessions = {}  # pk -> session
+        self._hits = []
+        self._sketches = SketchBuffer()
+        self.stats = {"lines": 0, "sessions": 0, "hits": 0}
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as f:
+            state = json.load(f)
+        self.files = state["files"]
+        for key, (pk, last_seen, hits) in state["sessions"].items():
+            self.sessions[key] = {
+                "pk": pk,
+                "last_seen": datetime.fromisoformat(last_seen),
+                "hits": hits,
+            }
+
+    def _save_state(self):
+        state = {
+            "files": self.files,
+            "sessions": {
+                key: [session["pk"], session["last_seen"].isoformat(), session["hits"]]
+                for key, session in self.sessions.items()
+            },
+        }
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def read_chunks(self, path):
+        """Yields chunks of the lines of a log that haven't been imported yet."""
+        with open_log(path) as f:
+            lines = islice(f, self.files.get(path, 0), None)
+            while True:
+                chunk = list(islice(lines, CHUNK_SIZE))
+                if not chunk:
+                    return
+                yield chunk, self.all_requests
+
+    def import_file(self, path, pool=None, batch_size=10000, workers=1):
+        """Imports a log, parsing it in `pool` (if given). Yields the number of
+        lines imported after every batch."""
+        chunks = self.read_chunks(path)
+        if pool is None:
+            results = map(parse_chunk, chunks)
+        else:
+            results = self._parse_in_pool(pool, chunks, workers * 4)
+        pending = 0
+        for line_count, requests in results:
+            for request in requests:
+                self.add(request)
+            self.files[path] = self.files.get(path, 0) + line_count
+            self.stats["lines"] += line_count
+            pending += line_count
+            if pending >= batch_size:
+                self.flush()
+                yield pending
+                pending = 0
+        self.flush()
+        yield pending
+
+    def _parse_in_pool(self, pool, chunks, max_pending):
+        # Only read as far ahead as the workers can parse, rather than reading the
+        # whole log into memory
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(parse_chunk, (chunk,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def add(self, request):
+        session_fields = request["session"]
+        if session_fields["device_type"] == "ROBOT" and self.service.ignore_robots:
+            return
+        if self.ignored_networks and is_ignored_ip(
+            request["ip"], self.ignored_networks
+        ):
+            return
+        key = _get_visitor_key(request["ip"], request["user_agent"])
+        if not is_sampled(key, self.service.sample_rate):
+            return
+
+        time = request["time"]
+        session = self.sessions.get(key)
+        initial = session is None or time - session["last_seen"] > self.timeout
+        if initial:
+            session = self.sessions[key] = {
+                "pk": str(uuid7(time)),
+                "last_seen": time,
+                "hits": 0,
+            }
+            self._new_sessions.append(
+                (
+                    session,
+                    dict(
+                        session_fields,
+                        uuid=session["pk"],
+                        service_id=self.service.pk,
+                        identifier="",
+                        start_time=time,
+                        user_agent=request["user_agent"],
+                        ip=request["ip"] if self.collect_ips else None,
+                    ),
+                )
+            )
+            session["new"] = True
+        elif not session.get("new"):
+            self._updated_sessions[session["pk"]] = session
+        session["last_seen"] = max(session["last_seen"], time)
+        session["hits"] += 1
+
+        location_pk = get_url_id(
+            self.service.normalize_url(self.base_url + request["path"])
+        )
+        referrer_pk = get_url_id(self.service.normalize_url(request["referrer"]))
+        self._sketches.add_hit(
+            self.service.pk,
+            time,
+            get_visitor_key("", key) if initial else None,
+            location_pk,
+            referrer_pk,
+            initial,
+        )
+
+        self._hits.append(
+            {
+                "session_id": session["pk"],
+                "initial": initial,
+                "start_time": time,
+                "last_seen": time,
+                "heartbeats": 0,
+                "tracker": "LOG",
+                "location_url_id": location_pk,
+                "referrer_url_id": referrer_pk,
+                "load_time": None,
+                "service_id": self.service.pk,
+            }
+        )
+
+    def flush(self):
+        """Writes the sessions and hits of the current batch, and checkpoints."""
+        new_sessions = []
+        for session, row in self._new_sessions:
+            new_sessions.append(
+                encode_dimensions(
+                    dict(
+                        row,
+                        last_seen=session["last_seen"],
+                        is_bounce=session["hits"] < 2,
+                    )
+                )
+            )
+            del session["new"]
+        updated_sessions = [
+            Session(
+                pk=session["pk"],
+                last_seen=session["last_seen"],
+                is_bounce=session["hits"] < 2,
+            )
+            for session in self._updated_sessions.values()
+        ]
+        with transaction.atomic():
+            write_rows(Session, new_sessions)
+            write_rows(Hit, self._hits)
+            Session.objects.bulk_update(
+                updated_sessions, ["last_seen", "is_bounce"], batch_size=1000
+            )
+            self._sketches.flush()
+        self.stats["sessions"] += len(new_sessions)
+        self.stats["hits"] += len(self._hits)
+        self._new_sessions = []
+        self._updated_sessions = {}
+        self._hits = []
+
+        # Sessions that no later page view can continue don't need to be kept
+        if self.sessions:
+            latest = max(session["last_seen"] for session in self.sessions.values())
+            self.sessions = {
+                key: session
+                for key, session in self.sessions.items()
+                if latest - session["last_seen"] <= self.timeout
+            }
+        self._save_state()
@@ -0,0 +1,175 @@
+import logging
+import threading
+from collections import Counter
+from time import sleep
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .dimensions import get_url_values
+
+log = logging.getLogger(__name__)
+
+# Live stats cover the last few windows of this many seconds
+LIVE_WINDOW = 60
+LIVE_WINDOWS = 5
+
+# How many pages each window keeps, and how many of the top pages are shown
+MAX_WINDOW_PAGES = 100
+LIVE_TOP_PAGES = 10
+
+# How often each process adds the sessions and page loads it has ingested to the
+# windows in the cache, in seconds
+FLUSH_INTERVAL = 1
+
+# How long a process may hold a window while adding to it, in seconds
+WINDOW_LOCK_TIMEOUT = 5
+
+
+def _get_window_path(service_pk, window_number):
+    return f"live_{service_pk}_{window_number}"
+
+
+class LiveRecorder:
+    """Buffers the new sessions and page loads that a process ingests, and adds them
+    to the live stats windows in the cache every second.
+
+    Windows only keep their most loaded pages, so pages that are loaded too rarely
+    to make it into a window aren't counted in it."""
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._pending = {}  # (service, window number) -> [sessions, page loads]
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def _get_pending(self, service_pk, time):
+        now = timezone.now()
+        if time is not None and (now - time).total_seconds() > LIVE_WINDOW:
+            return None  # Too old to be live
+        window_number = int(now.timestamp() / LIVE_WINDOW)
+        return self._pending.setdefault(
+            (str(service_pk), window_number), [0, Counter()]
+        )
+
+    def record_session(self, service_pk, time=None):
+        with self._lock:
+            pending = self._get_pending(service_pk, time)
+            if pending is not None:
+                pending[0] += 1
+        self._start_flusher()
+
+    def record_page(self, service_pk, url_pk, time=None):
+        if url_pk is None:
+            return
+        with self._lock:
+            pending = self._get_pending(service_pk, time)
+            if pending is not None:
+                pending[1][url_pk] += 1
+        self._start_flusher()
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="live-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            sleep(self.flush_interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception(e)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            oldest = int(timezone.now().timestamp() / LIVE_WINDOW) - LIVE_WINDOWS
+            retry = {}
+            for (service_pk, window_number), (sessions, pages) in pending.items():
+                if window_number <= oldest:
+                    continue
+                if not self._add(service_pk, window_number, sessions, pages):
+                    retry[(service_pk, window_number)] = [sessions, pages]
+            # Windows that another process was adding to are tried again next time
+            with self._lock:
+                for key, (sessions, pages) in retry.items():
+                    pending = self._pending.setdefault(key, [0, Counter()])
+                    pending[0] += sessions
+                    pending[1].update(pages)
+
+    def _add(self, service_pk, window_number, sessions, pages):
+        path = _get_window_path(service_pk, window_number)
+        if not cache.add(f"{path}_lock", True, timeout=WINDOW_LOCK_TIMEOUT):
+            return False
+        try:
+            window = cache.get(path) or {"sessions": 0, "pages": {}}
+            window["sessions"] += sessions
+            window_pages = Counter(window["pages"])
+            window_pages.update(pages)
+            window["pages"] = dict(window_pages.most_common(MAX_WINDOW_PAGES))
+            cache.set(path, window, timeout=LIVE_WINDOW * (LIVE_WINDOWS + 1))
+            return True
+        finally:
+            cache.delete(f"{path}_lock")
+
+
+_recorder = LiveRecorder(FLUSH_INTERVAL)
+
+
+def record_session(service_pk, time=None):
+    _recorder.record_session(service_pk, time)
+
+
+def record_page(service_pk, url_pk, time=None):
+    _recorder.record_page(service_pk, url_pk, time)
+
+
+def get_live_stats(service):
+    """Returns a service's online sessions, and its new sessions and most loaded
+    pages of the last few minutes.
+
+    The stats are put together from the cache once per update interval and shared
+    through it, so any number of viewers can follow them without adding load."""
+    path = f"live_{service.pk}_stats"
+    stats = cache.get(path)
+    if stats is not None:
+        return stats
+
+    window_number = int(timezone.now().timestamp() / LIVE_WINDOW)
+    windows = cache.get_many(
+        [
+            _get_window_path(service.pk, number)
+            for number in range(window_number - LIVE_WINDOWS + 1, window_number + 1)
+        ]
+    ).values()
+    pages = Counter()
+    for window in windows:
+        pages.update(window["pages"])
+    top = pages.most_common(LIVE_TOP_PAGES)
+    locations = get_url_values(url_pk for url_pk, count in top)
+    stats = {
+        "online": service.get_currently_online(),
+        "sessions": service.scale_count(sum(window["sessions"] for window in windows)),
+        "pages": service.scale_counts(
+            [
+                {"location": locations.get(url_pk, ""), "count": count}
+                for url_pk, count in top
+            ]
+        ),
+        "minutes": LIVE_WINDOW * LIVE_WINDOWS // 60,
+        "estimated": service.is_sampled,
+    }
+    cache.set(path, stats, timeout=settings.LIVE_UPDATE_INTERVAL)
+    return stats
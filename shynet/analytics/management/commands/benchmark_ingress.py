@@ -0,0 +1,376 @@
+import http.client
+import json
+import random
+import threading
+from itertools import chain, zip_longest
+from time import perf_counter
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from analytics.tasks import ingress_request
+from core.benchmarking import (
+    QueryCounter,
+    compare_results,
+    create_benchmark_service,
+    get_environment,
+    save_results,
+    summarize_latencies,
+)
+
+TARGETS = ("task", "script", "pixel")
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:91.0) Gecko/20100101 Firefox/91.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 11; Pixel 5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.91 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPad; CPU OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Mobile/15E148 Safari/604.1",
+]
+
+ROBOT_USER_AGENTS = [
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+    "Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)",
+]
+
+REFERRERS = [
+    "https://news.ycombinator.com/",
+    "https://www.google.com/",
+    "https://twitter.com/",
+    "https://en.wikipedia.org/",
+    "",
+    "",
+    "",
+]
+
+# The metrics that are compared against a baseline run
+COMPARED_METRICS = ("throughput", "p50_ms", "p99_ms", "queries_per_event")
+
+
+def generate_visitors(events, seed, heartbeats, dnt_share, robot_share):
+    """Generates visitors until they send at least `events` events between them.
+    Each visitor loads a few pages, and (unless they're a robot) sends a number of
+    heartbeats after each page load, averaging `heartbeats`."""
+    rng = random.Random(seed)
+    visitors = []
+    total = 0
+    while total < events:
+        n = len(visitors)
+        robot = rng.random() < robot_share
+        visitor = {
+            "ip": f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}",
+            "user_agent": rng.choice(ROBOT_USER_AGENTS if robot else USER_AGENTS),
+            "dnt": rng.random() < dnt_share,
+            "events": [],
+        }
+        referrer = rng.choice(REFERRERS)
+        for page in range(1 if robot else rng.randint(1, 5)):
+            payload = {
+                "idempotency": f"{seed}-{n}-{page}",
+                "location": f"https://example.com/post/{rng.randint(0, 500)}",
+                "referrer": referrer if page == 0 else "https://example.com/",
+                "loadTime": rng.randint(100, 3000),
+            }
+            visitor["events"].append(("page_load", payload))
+            if not robot:
+                for _ in range(rng.randint(0, heartbeats * 2)):
+                    visitor["events"].append(("heartbeat", payload))
+        total += len(visitor["events"])
+        visitors.append(visitor)
+    return visitors
+
+
+def interleave(visitors):
+    """Orders the events of several visitors as if they browsed at the same time."""
+    return [
+        (visitor, kind, payload)
+        for visitor, kind, payload in chain.from_iterable(
+            zip_longest(
+                *(
+                    [(visitor, kind, payload) for kind, payload in visitor["events"]]
+                    for visitor in visitors
+                ),
+                fillvalue=(None, None, None),
+            )
+        )
+        if visitor is not None
+    ]
+
+
+class TaskSender:
+    """Calls the ingress task directly, bypassing the web server."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def send(self, visitor, payload):
+        ingress_request(
+            self.service.uuid,
+            "JS",
+            timezone.now(),
+            dict(payload),
+            visitor["ip"],
+            payload["location"],
+            visitor["user_agent"],
+            dnt=visitor["dnt"],
+        )
+        return True
+
+
+class ClientSender:
+    """Sends events to the ingress views in this process, through the full
+    middleware stack."""
+
+    def __init__(self, service, target):
+        self.target = target
+        # Requests must be for a host that Shynet serves
+        hosts = [host for host in settings.ALLOWED_HOSTS if host not in ("", "*")]
+        host = hosts[0].lstrip(".") if hosts else "localhost"
+        self.client = Client(raise_request_exception=False, HTTP_HOST=host)
+        self.url = reverse(
+            f"ingress:endpoint_{target}", kwargs={"service_uuid": service.uuid}
+        )
+
+    def send(self, visitor, payload):
+        headers = {
+            "HTTP_USER_AGENT": visitor["user_agent"],
+            "HTTP_REFERER": payload["location"],
+            "HTTP_DNT": "1" if visitor["dnt"] else "0",
+            "REMOTE_ADDR": visitor["ip"],
+        }
+        if self.target == "pixel":
+            response = self.client.get(self.url, **headers)
+        else:
+            response = self.client.post(
+                self.url,
+                json.dumps(payload),
+                content_type="application/json",
+                **headers,
+            )
+        return response.status_code == 200
+
+
+class HttpSender:
+    """Sends events to the ingress endpoints of a running Shynet instance, over a
+    kept-alive connection."""
+
+    def __init__(self, service, target, base_url):
+        self.target = target
+        url = urlparse(base_url)
+        connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.connection = connection_class(url.netloc, timeout=30)
+        self.path = url.path.rstrip("/") + reverse(
+            f"ingress:endpoint_{target}", kwargs={"service_uuid": service.uuid}
+        )
+
+    def send(self, visitor, payload):
+        headers = {
+            "User-Agent": visitor["user_agent"],
+            "Referer": payload["location"],
+            "DNT": "1" if visitor["dnt"] else "0",
+            "X-Forwarded-For": visitor["ip"],
+        }
+        if self.target == "pixel":
+            self.connection.request("GET", self.path, headers=headers)
+        else:
+            headers["Content-Type"] = "application/json"
+            self.connection.request(
+                "POST", self.path, body=json.dumps(payload), headers=headers
+            )
+        response = self.connection.getresponse()
+        response.read()
+        return response.status == 200
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks ingestion with concurrent clients sending a realistic mix of events"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            choices=TARGETS,
+            help="What to send events to: the ingress task, or the script or pixel "
+            "views (may be repeated; defaults to all)",
+        )
+        parser.add_argument("--events", type=int, default=5000)
+        parser.add_argument("--clients", type=int, default=4)
+        parser.add_argument(
+            "--heartbeats",
+            type=int,
+            default=3,
+            help="Average heartbeats per page load",
+        )
+        parser.add_argument("--dnt", type=float, default=0.1, help="Share of DNT")
+        parser.add_argument(
+            "--robots", type=float, default=0.05, help="Share of robots"
+        )
+        parser.add_argument("--warmup", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--url",
+            type=str,
+            help="Send events to the Shynet running at this URL instead of this "
+            "process (queries can't be counted then)",
+        )
+        parser.add_argument("--output", type=str, help="Save the results as JSON")
+        parser.add_argument(
+            "--baseline", type=str, help="Compare with the results of an earlier run"
+        )
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the benchmark services"
+        )
+
+    def handle(self, *args, **options):
+        targets = options.get("target") or TARGETS
+        if options.get("url") and "task" in targets:
+            raise CommandError("The task can only be benchmarked in this process")
+        config = {
+            key: options.get(key)
+            for key in (
+                "events",
+                "clients",
+                "heartbeats",
+                "dnt",
+                "robots",
+                "warmup",
+                "seed",
+                "url",
+            )
+        }
+        results = {}
+        for target in targets:
+            results[target] = self.benchmark(target, options)
+            self.report(target, results[target])
+
+        output = {
+            "environment": get_environment(),
+            "config": config,
+            "results": results,
+        }
+        if options.get("baseline"):
+            with open(options.get("baseline")) as f:
+                baseline = json.load(f)
+            self.compare(baseline["results"], results)
+        if options.get("output"):
+            save_results(options.get("output"), output)
+            self.stdout.write(f"Saved results to {options.get('output')}")
+
+    def get_sender(self, service, target, options):
+        if target == "task":
+            return TaskSender(service)
+        if options.get("url"):
+            return HttpSender(service, target, options.get("url"))
+        return ClientSender(service, target)
+
+    def benchmark(self, target, options):
+        service = create_benchmark_service(f"Ingress benchmark ({target})")
+        try:
+            visitors = generate_visitors(
+                options.get("events"),
+                options.get("seed"),
+                options.get("heartbeats"),
+                options.get("dnt"),
+                options.get("robots"),
+            )
+            if target == "pixel":
+                # Pixels can't send heartbeats
+                for visitor in visitors:
+                    visitor["events"] = [
+                        event for event in visitor["events"] if event[0] == "page_load"
+                    ]
+            if options.get("warmup"):
+                warmup = generate_visitors(
+                    options.get("warmup"),
+                    options.get("seed") - 1,
+                    options.get("heartbeats"),
+                    0,
+                    0,
+                )
+                self.run_clients(service, target, options, warmup, 1)
+            return self.run_clients(
+                service, target, options, visitors, options.get("clients")
+            )
+        finally:
+            if not options.get("keep"):
+                service.delete()
+
+    def run_clients(self, service, target, options, visitors, clients):
+        counter = QueryCounter()
+        latencies = [[] for _ in range(clients)]
+        kinds = [{"page_load": 0, "heartbeat": 0} for _ in range(clients)]
+        errors = [0] * clients
+
+        def run_client(n):
+            sender = self.get_sender(service, target, options)
+            events = interleave(visitors[n::clients])
+            try:
+                with connection.execute_wrapper(counter):
+                    for visitor, kind, payload in events:
+                        start = perf_counter()
+                        try:
+                            ok = sender.send(visitor, payload)
+                        except Exception:
+                            ok = False
+                        latencies[n].append(perf_counter() - start)
+                        kinds[n][kind] += 1
+                        if not ok:
+                            errors[n] += 1
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=run_client, args=(n,)) for n in range(clients)
+        ]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+
+        events = sum(len(client) for client in latencies)
+        result = {
+            "events": events,
+            "page_loads": sum(client["page_load"] for client in kinds),
+            "heartbeats": sum(client["heartbeat"] for client in kinds),
+            "errors": sum(errors),
+            "seconds": elapsed,
+            "throughput": events / elapsed if elapsed else None,
+            "queries_per_event": None
+            if options.get("url")
+            else counter.queries / max(events, 1),
+        }
+        result.update(summarize_latencies(chain.from_iterable(latencies)))
+        return result
+
+    def report(self, target, result):
+        queries = result["queries_per_event"]
+        self.stdout.write(
+            f"{target}: {result['events']} events ({result['page_loads']} page loads, "
+            f"{result['heartbeats']} heartbeats) in {result['seconds']:.2f}s: "
+            f"{result['throughput']:.0f} events/s, "
+            f"p50 {result['p50_ms']:.2f}ms, p99 {result['p99_ms']:.2f}ms"
+            + (f", {queries:.2f} queries/event" if queries is not None else "")
+            + (f", {result['errors']} errors" if result["errors"] else "")
+        )
+
+    def compare(self, baseline, results):
+        for name, before, after, change in compare_results(
+            baseline, results, COMPARED_METRICS
+        ):
+            change = f"{change:+.1%}" if change is not None else "n/a"
+            self.stdout.write(f"{name}: {before:.2f} -> {after:.2f} ({change})")
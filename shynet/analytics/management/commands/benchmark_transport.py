@@ -0,0 +1,139 @@
+import json
+from time import perf_counter
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from analytics import streams
+from analytics.tasks import ingress_request
+
+BENCHMARK_QUEUE = "shynet_benchmark"
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"
+
+
+def _event(n):
+    return (
+        (
+            "b9a1b4b0-3c6c-4a4c-9b5e-6d9f0c9e6a11",
+            "JS",
+            timezone.now(),
+            {
+                "idempotency": f"benchmark{n}",
+                "referrer": "https://news.ycombinator.com/",
+                "location": f"https://example.com/post/{n % 100}",
+                "loadTime": 812,
+            },
+            f"198.51.100.{n % 256}",
+            "https://example.com/",
+            USER_AGENT,
+        ),
+        {"dnt": False, "identifier": ""},
+    )
+
+
+class Command(BaseCommand):
+    help = "Compares the throughput of the Celery and Redis stream ingress transports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=10000)
+        parser.add_argument(
+            "--redis-url",
+            type=str,
+            default=settings.INGRESS_STREAM_URL or "redis://localhost:6379/15",
+            help="Redis used as both the Celery broker and the stream",
+        )
+
+    def handle(self, *args, **options):
+        if settings.CELERY_TASK_ALWAYS_EAGER:
+            raise CommandError(
+                "Celery tasks run eagerly; set CELERY_TASK_ALWAYS_EAGER=False"
+            )
+        events = [_event(n) for n in range(options.get("events"))]
+        url = options.get("redis_url")
+        client = redis.Redis.from_url(url)
+        try:
+            client.ping()
+        except redis.ConnectionError as e:
+            raise CommandError(f"Unable to connect to Redis at {url}: {e}")
+
+        results = {
+            "celery": self.benchmark_celery(client, url, events),
+            "stream": self.benchmark_stream(client, url, events),
+        }
+        for transport, result in results.items():
+            self.stdout.write(
+                f"{transport}: {result['publish_rate']:.0f} events/s published, "
+                f"{result['consume_rate']:.0f} events/s consumed, "
+                f"{result['bytes_per_event']:.0f} bytes/event"
+            )
+        self.stdout.write(json.dumps(results))
+
+    def benchmark_celery(self, client, url, events):
+        client.delete(BENCHMARK_QUEUE)
+        app = ingress_request.app
+        with app.connection_for_write(url) as connection:
+            with app.amqp.Producer(connection) as producer:
+                start = perf_counter()
+                for args, kwargs in events:
+                    ingress_request.apply_async(
+                        args,
+                        kwargs,
+                        queue=BENCHMARK_QUEUE,
+                        connection=connection,
+                        producer=producer,
+                    )
+                publish_time = perf_counter() - start
+
+            size = sum(
+                len(message) for message in client.lrange(BENCHMARK_QUEUE, 0, -1)
+            )
+
+            # Consume through Kombu, decoding each message like a worker would
+            start = perf_counter()
+            consumed = 0
+            with connection.SimpleQueue(BENCHMARK_QUEUE) as queue:
+                while consumed < len(events):
+                    message = queue.get(timeout=5)
+                    message.decode()
+                    message.ack()
+                    consumed += 1
+            consume_time = perf_counter() - start
+        client.delete(BENCHMARK_QUEUE)
+        return {
+            "publish_rate": len(events) / publish_time,
+            "consume_rate": consumed / consume_time,
+            "bytes_per_event": size / len(events),
+        }
+
+    def benchmark_stream(self, client, url, events):
+        client.delete(BENCHMARK_QUEUE)
+        start = perf_counter()
+        for args, kwargs in events:
+            client.xadd(BENCHMARK_QUEUE, {"e": streams.encode_event(args, kwargs)})
+        publish_time = perf_counter() - start
+
+        size = sum(
+            len(fields[b"e"]) + 1 for _, fields in client.xrange(BENCHMARK_QUEUE)
+        )
+
+        handled = []
+        consumer = streams.StreamConsumer(
+            lambda *args, **kwargs: handled.append(args),
+            BENCHMARK_QUEUE,
+            "benchmark",
+            batch_size=500,
+            block=100,
+            client=client,
+        )
+        start = perf_counter()
+        consumer.run(once=True)
+        consume_time = perf_counter() - start
+        client.delete(BENCHMARK_QUEUE)
+        return {
+            "publish_rate": len(events) / publish_time,
+            "consume_rate": len(handled) / consume_time,
+            "bytes_per_event": size / len(events),
+        }
@@ -0,0 +1,195 @@
+import json
+import uuid
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from analytics.dimensions import encode_dimensions, encode_urls
+from analytics.importing import write_rows
+from analytics.models import Hit, Session
+from analytics.synthetic import DatasetGenerator
+from analytics.utils import uuid7
+from core.benchmarking import (
+    compare_results,
+    create_benchmark_service,
+    get_environment,
+    get_index_sizes,
+    save_results,
+    summarize_latencies,
+)
+
+TARGETS = ("create", "heartbeat", "bulk")
+
+# How session keys are generated: time-ordered, as sessions are created, or random,
+# as they were before
+KEYS = {"uuid7": uuid7, "uuid4": uuid.uuid4}
+
+# The metrics that are compared against a baseline run
+COMPARED_METRICS = ("rows_per_second", "p50_ms", "p99_ms", "index_bytes")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks how fast sessions and hits are written, which depends on how "
+        "many indexes the database has to maintain"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            choices=TARGETS,
+            help="What to benchmark: creating sessions and hits one by one, like "
+            "ingestion does, updating hits like heartbeats do, or bulk inserts (may "
+            "be repeated; defaults to all)",
+        )
+        parser.add_argument(
+            "--sessions", type=int, default=2000, help="Sessions to write"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--keys",
+            choices=KEYS,
+            default="uuid7",
+            help="How session keys are generated (compare runs on a large table to "
+            "see the effect of random keys on throughput and index size)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", type=str, help="Save the results as JSON")
+        parser.add_argument(
+            "--baseline", type=str, help="Compare with the results of an earlier run"
+        )
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the benchmark service"
+        )
+
+    def handle(self, *args, **options):
+        service = create_benchmark_service("Write benchmark")
+        try:
+            results = {}
+            for n, target in enumerate(options.get("target") or TARGETS):
+                # Every target writes sessions of its own
+                generator = DatasetGenerator(service, seed=options.get("seed") + n)
+                day = timezone.now() - timezone.timedelta(days=n + 1)
+                sessions, hits = generator.generate_day(day, options.get("sessions"))
+                self.set_keys(sessions, hits, KEYS[options.get("keys")])
+                index_bytes = self.get_index_bytes()
+                results[target] = getattr(self, f"benchmark_{target}")(
+                    sessions, hits, options
+                )
+                # How much the indexes of sessions and hits grew
+                if index_bytes is not None:
+                    results[target]["index_bytes"] = (
+                        self.get_index_bytes() - index_bytes
+                    )
+                self.report(target, results[target])
+        finally:
+            if not options.get("keep"):
+                service.delete()
+
+        output = {
+            "environment": get_environment(),
+            "config": {
+                key: options.get(key)
+                for key in ("sessions", "batch_size", "keys", "seed")
+            },
+            "results": results,
+        }
+        if options.get("baseline"):
+            with open(options.get("baseline")) as f:
+                baseline = json.load(f)
+            for name, before, after, change in compare_results(
+                baseline["results"], results, COMPARED_METRICS
+            ):
+                change = f"{change:+.1%}" if change is not None else "n/a"
+                self.stdout.write(f"{name}: {before:.2f} -> {after:.2f} ({change})")
+        if options.get("output"):
+            save_results(options.get("output"), output)
+            self.stdout.write(f"Saved results to {options.get('output')}")
+
+    def set_keys(self, sessions, hits, generate):
+        """Gives the sessions new keys, generated in the order they're written, as
+        ingestion would."""
+        keys = {}
+        for session in sessions:
+            keys[session["uuid"]] = session["uuid"] = str(generate())
+        for hit in hits:
+            hit["session_id"] = keys[hit["session_id"]]
+
+    def get_index_bytes(self):
+        sizes = [get_index_sizes(model) for model in (Session, Hit)]
+        if not all(sizes):
+            return None
+        return sum(sum(model_sizes.values()) for model_sizes in sizes)
+
+    def benchmark_create(self, sessions, hits, options):
+        latencies = []
+        for model, rows in ((Session, sessions), (Hit, hits)):
+            for row in rows:
+                start = perf_counter()
+                model.objects.create(**row)
+                latencies.append(perf_counter() - start)
+        return self.summarize(latencies)
+
+    def benchmark_heartbeat(self, sessions, hits, options):
+        with transaction.atomic():
+            write_rows(Session, [encode_dimensions(session) for session in sessions])
+            write_rows(Hit, [encode_urls(hit) for hit in hits])
+        latencies = []
+        for pk in Hit.objects.filter(
+            session_id__in=[session["uuid"] for session in sessions]
+        ).values_list("pk", flat=True):
+            start = perf_counter()
+            Hit.objects.filter(pk=pk).update(
+                heartbeats=F("heartbeats") + 1, last_seen=timezone.now()
+            )
+            latencies.append(perf_counter() - start)
+        return self.summarize(latencies)
+
+    def benchmark_bulk(self, sessions, hits, options):
+        batch_size = options.get("batch_size")
+        rows = {
+            Session: [encode_dimensions(session) for session in sessions],
+            Hit: [encode_urls(hit) for hit in hits],
+        }
+        start = perf_counter()
+        for model, model_rows in rows.items():
+            for n in range(0, len(model_rows), batch_size):
+                with transaction.atomic():
+                    write_rows(model, model_rows[n : n + batch_size])
+        elapsed = perf_counter() - start
+        count = len(sessions) + len(hits)
+        return {
+            "rows": count,
+            "seconds": elapsed,
+            "rows_per_second": count / elapsed if elapsed else None,
+        }
+
+    def summarize(self, latencies):
+        elapsed = sum(latencies)
+        result = {
+            "rows": len(latencies),
+            "seconds": elapsed,
+            "rows_per_second": len(latencies) / elapsed if elapsed else None,
+        }
+        result.update(summarize_latencies(latencies))
+        return result
+
+    def report(self, target, result):
+        self.stdout.write(
+            f"{target}: {result['rows']} rows in {result['seconds']:.2f}s "
+            f"({result['rows_per_second']:.0f} rows/s)"
+            + (
+                f", p50 {result['p50_ms']:.2f}ms, p99 {result['p99_ms']:.2f}ms"
+                if "p50_ms" in result
+                else ""
+            )
+            + (
+                f", indexes grew by {result['index_bytes'] / 1024:.0f}KiB"
+                if "index_bytes" in result
+                else ""
+            )
+        )
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from analytics.models import Session
+from analytics.sketches import SKETCHES, build_sketches, get_sketch_start
+from core.models import Service
+
+
+def _parse_time(value):
+    try:
+        time = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"{value} is not an ISO 8601 date or time")
+    if timezone.is_naive(time):
+        time = timezone.make_aware(time)
+    return time
+
+
+class Command(BaseCommand):
+    help = "Builds sketches of the sessions and hits already in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--service",
+            type=str,
+            default=None,
+            help="Service to build sketches for (defaults to every service)",
+        )
+        parser.add_argument(
+            "--start",
+            type=str,
+            default=None,
+            help="Time to build from (defaults to the first session)",
+        )
+        parser.add_argument(
+            "--end",
+            type=str,
+            default=None,
+            help="Time to build up to (defaults to the first existing sketch, so "
+            "that sketches recorded during ingestion are kept)",
+        )
+
+    def handle(self, *args, **options):
+        services = Service.objects.all()
+        if options.get("service"):
+            try:
+                services = [Service.objects.get(pk=options.get("service"))]
+            except (Service.DoesNotExist, ValidationError):
+                raise CommandError(f"Service {options.get('service')} does not exist")
+
+        for service in services:
+            start = options.get("start") and _parse_time(options.get("start"))
+            if not start:
+                start = Session.objects.filter(service=service).aggregate(
+                    start=Min("start_time")
+                )["start"]
+            # Sketches of each kind are kept from when they were introduced, so
+            # by default each kind is built up to its first sketch
+            ends = {}
+            now = timezone.now()
+            for kind in SKETCHES:
+                end = options.get("end") and _parse_time(options.get("end"))
+                end = end or get_sketch_start(service.pk, kind) or now
+                ends.setdefault(end, []).append(kind)
+
+            count = 0
+            for end, kinds in ends.items():
+                # A day at a time, so that only a day's sketches are held in memory
+                day_start = start
+                while start is not None and day_start < end:
+                    day_end = min(day_start + timezone.timedelta(days=1), end)
+                    count += build_sketches(service, day_start, day_end, kinds)
+                    day_start = day_end
+            self.stdout.write(f"{service}: built {count} sketches")
+
+        self.stdout.write(self.style.SUCCESS("Sketches built"))
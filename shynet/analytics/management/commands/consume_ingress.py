@@ -0,0 +1,64 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from analytics.partitioning import get_local_table
+from analytics.sketches import flush_sketches
+from analytics.streams import StreamConsumer, default_consumer_name, get_stream_name
+from analytics.tasks import ingress_request
+
+
+def _exit(signum, frame):
+    raise SystemExit(0)
+
+
+def _handle(*args, **kwargs):
+    close_old_connections()
+    ingress_request(*args, **kwargs)
+
+
+class Command(BaseCommand):
+    help = "Consumes ingress events from the Redis stream transport"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queue",
+            type=str,
+            default=None,
+            help="Partition queue to consume (e.g., ingress_0), if partitioned",
+        )
+        parser.add_argument("--consumer", type=str, default=default_consumer_name())
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--claim-idle",
+            type=int,
+            default=60000,
+            help="Milliseconds after which other consumers' pending events are claimed",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the stream is drained"
+        )
+
+    def handle(self, *args, **options):
+        # Exit cleanly on SIGTERM, so that buffered partition writes are flushed
+        signal.signal(signal.SIGTERM, _exit)
+
+        stream = get_stream_name(options.get("queue"))
+        consumer = StreamConsumer(
+            _handle,
+            stream,
+            options.get("consumer"),
+            batch_size=options.get("batch_size"),
+            claim_idle=options.get("claim_idle"),
+        )
+        self.stdout.write(f"Consuming `{stream}` as `{consumer.consumer}`...")
+        try:
+            consumer.run(once=options.get("once"))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            table = get_local_table()
+            if table is not None:
+                table.flush()
+            flush_sketches()
@@ -0,0 +1,75 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.synthetic import DatasetGenerator
+from core.benchmarking import create_benchmark_service
+from core.models import Service
+
+
+class Command(BaseCommand):
+    help = "Bulk-generates synthetic sessions and hits for benchmarking dashboards"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--service",
+            type=str,
+            help="UUID of the service to add data to (a new one is created otherwise)",
+        )
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument(
+            "--sessions", type=int, default=1000, help="Average sessions per day"
+        )
+        parser.add_argument("--hits-per-session", type=float, default=3)
+        parser.add_argument(
+            "--locations", type=int, default=10000, help="Distinct locations"
+        )
+        parser.add_argument(
+            "--referrers", type=int, default=1000, help="Distinct referrers"
+        )
+        parser.add_argument(
+            "--zipf",
+            type=float,
+            default=1.1,
+            help="Exponent of the Zipf distributions of locations and referrers",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=50000)
+
+    def handle(self, *args, **options):
+        if options.get("service"):
+            try:
+                service = Service.objects.get(uuid=options.get("service"))
+            except (Service.DoesNotExist, ValueError):
+                raise CommandError(f"No service {options.get('service')}")
+        else:
+            service = create_benchmark_service("Synthetic dataset")
+            self.stdout.write(f"Created service {service.uuid}")
+
+        generator = DatasetGenerator(
+            service,
+            seed=options.get("seed"),
+            locations=options.get("locations"),
+            referrers=options.get("referrers"),
+            hits_per_session=options.get("hits_per_session"),
+            exponent=options.get("zipf"),
+        )
+        start = perf_counter()
+        for _ in generator.generate(
+            options.get("days"),
+            options.get("sessions"),
+            batch_size=options.get("batch_size"),
+        ):
+            elapsed = perf_counter() - start
+            self.stdout.write(
+                f"{generator.stats['sessions']} sessions and "
+                f"{generator.stats['hits']} hits "
+                f"({generator.stats['hits'] / elapsed:.0f} hits/s)"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {generator.stats['sessions']} sessions and "
+                f"{generator.stats['hits']} hits for {service.uuid} in "
+                f"{perf_counter() - start:.1f}s"
+            )
+        )
@@ -0,0 +1,88 @@
+import os
+from multiprocessing import Pool
+from time import perf_counter
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from analytics.importing import LogImporter
+from core.models import Service
+
+
+class Command(BaseCommand):
+    help = "Imports page views from combined-format access logs (plain or gzipped)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Logs to import, oldest first")
+        parser.add_argument("--service", type=str, required=True)
+        parser.add_argument(
+            "--base-url",
+            type=str,
+            default=None,
+            help="URL that request paths are relative to (defaults to the service's link)",
+        )
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Lines to import between checkpoints",
+        )
+        parser.add_argument(
+            "--state-file",
+            type=str,
+            default=None,
+            help="Where to keep progress, so that an interrupted import can resume",
+        )
+        parser.add_argument(
+            "--all-requests",
+            action="store_true",
+            help="Import every request rather than only page views",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            service = Service.objects.get(pk=options.get("service"))
+        except (Service.DoesNotExist, ValidationError):
+            raise CommandError(f"Service {options.get('service')} does not exist")
+        base_url = options.get("base_url") or service.link
+        if not base_url:
+            raise CommandError("The service has no link; pass --base-url")
+        state_file = options.get("state_file") or f"import_logs_{service.pk}.json"
+        for path in options.get("paths"):
+            if not os.path.exists(path):
+                raise CommandError(f"{path} does not exist")
+
+        importer = LogImporter(
+            service, base_url, state_file, all_requests=options.get("all_requests")
+        )
+        workers = options.get("workers")
+        # Worker processes only parse, so they shouldn't inherit database connections
+        connections.close_all()
+        pool = Pool(workers) if workers > 1 else None
+        start = perf_counter()
+        try:
+            for path in options.get("paths"):
+                self.stdout.write(f"Importing {path}...")
+                for _ in importer.import_file(
+                    path,
+                    pool=pool,
+                    batch_size=options.get("batch_size"),
+                    workers=workers,
+                ):
+                    self.report(importer, start)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        self.stdout.write(self.style.SUCCESS("Import complete"))
+        self.report(importer, start)
+
+    def report(self, importer, start):
+        elapsed = perf_counter() - start
+        stats = importer.stats
+        self.stdout.write(
+            f"{stats['lines']} lines ({stats['lines'] / max(elapsed, 1e-6):.0f} lines/s), "
+            f"{stats['sessions']} sessions and {stats['hits']} hits imported"
+        )
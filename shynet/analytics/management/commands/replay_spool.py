@@ -0,0 +1,57 @@
+from time import perf_counter, sleep
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.spool import get_spool
+from analytics.transport import send_ingress_events
+from analytics.utils import TRANSIENT_ERRORS
+
+
+class Command(BaseCommand):
+    help = "Replays ingress events that were spooled while the transport was down"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--follow",
+            action="store_true",
+            help="Keep replaying newly spooled events",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds between replays when following",
+        )
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        if spool is None:
+            raise CommandError("Spooling is disabled; set INGRESS_SPOOL_DIR")
+
+        while True:
+            self.replay(spool, options.get("batch_size"))
+            if not options.get("follow"):
+                return
+            sleep(options.get("interval"))
+
+    def replay(self, spool, batch_size):
+        stats = spool.stats()
+        if stats["segments"] == 0:
+            return
+        self.stdout.write(
+            f"Replaying {stats['segments']} spool segments ({stats['bytes']} bytes)..."
+        )
+        replayed = 0
+        start = perf_counter()
+        try:
+            for count in spool.replay(send_ingress_events, batch_size=batch_size):
+                replayed += count
+        except TRANSIENT_ERRORS as e:
+            self.stderr.write(f"Transport still unavailable: {e}")
+        elapsed = perf_counter() - start
+        self.stdout.write(
+            f"Replayed {replayed} events in {elapsed:.1f}s "
+            f"({replayed / max(elapsed, 1e-6):.0f} events/s); "
+            f"{spool.stats()['bytes']} bytes left in the spool"
+        )
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0010_auto_20220624_0744"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="hit",
+            name="tracker",
+            field=models.TextField(
+                choices=[
+                    ("JS", "JavaScript"),
+                    ("PIXEL", "Pixel (noscript)"),
+                    ("API", "Ingestion API"),
+                ]
+            ),
+        ),
+    ]
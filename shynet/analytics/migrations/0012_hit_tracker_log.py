@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0011_hit_tracker_api"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="hit",
+            name="tracker",
+            field=models.TextField(
+                choices=[
+                    ("JS", "JavaScript"),
+                    ("PIXEL", "Pixel (noscript)"),
+                    ("API", "Ingestion API"),
+                    ("LOG", "Access log import"),
+                ]
+            ),
+        ),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0012_hit_tracker_log"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="hit",
+            name="analytics_h_session_775f5a_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="hit",
+            name="analytics_h_session_98b8bf_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="hit",
+            name="analytics_h_service_f4f41e_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="session",
+            name="analytics_s_service_4b1137_idx",
+        ),
+        migrations.AlterField(
+            model_name="hit",
+            name="initial",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name="hit",
+            name="last_seen",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name="hit",
+            name="load_time",
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="hit",
+            name="location",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="hit",
+            name="referrer",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="hit",
+            name="service",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="core.service",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="hit",
+            name="session",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="analytics.session",
+                verbose_name="Session",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="identifier",
+            field=models.TextField(blank=True, verbose_name="Identifier"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="ip",
+            field=models.GenericIPAddressField(null=True, verbose_name="IP"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="is_bounce",
+            field=models.BooleanField(default=True, verbose_name="Is bounce"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="last_seen",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="Last seen"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="service",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="core.service",
+                verbose_name="Service",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hit",
+            index=models.Index(
+                fields=["service", "-start_time"],
+                include=("location", "load_time"),
+                name="hit_service_start_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hit",
+            index=models.Index(
+                condition=models.Q(("initial", True)),
+                fields=["service", "-start_time"],
+                include=("referrer",),
+                name="hit_initial_referrer_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                fields=["service", "-start_time"],
+                include=("is_bounce", "last_seen"),
+                name="session_service_start_idx",
+            ),
+        ),
+    ]
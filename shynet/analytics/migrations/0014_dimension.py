@@ -0,0 +1,138 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0013_rationalize_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Dimension",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("user_agent", "user_agent"),
+                            ("browser", "browser"),
+                            ("device", "device"),
+                            ("os", "os"),
+                            ("asn", "asn"),
+                            ("country", "country"),
+                            ("time_zone", "time_zone"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("value", models.TextField()),
+            ],
+            options={
+                "verbose_name": "Dimension",
+                "verbose_name_plural": "Dimensions",
+                "unique_together": {("kind", "value")},
+            },
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="user_agent_dimension",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.dimension",
+                verbose_name="User agent",
+            ),
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="browser_dimension",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.dimension",
+                verbose_name="Browser",
+            ),
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="device_dimension",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.dimension",
+                verbose_name="Device",
+            ),
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="os_dimension",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.dimension",
+                verbose_name="OS",
+            ),
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="asn_dimension",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.dimension",
+                verbose_name="Asn",
+            ),
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="country_dimension",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.dimension",
+                verbose_name="Country",
+            ),
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="time_zone_dimension",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.dimension",
+                verbose_name="Time zone",
+            ),
+        ),
+    ]
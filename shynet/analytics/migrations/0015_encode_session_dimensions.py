@@ -0,0 +1,57 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Substr
+
+DIMENSIONS = ("user_agent", "browser", "device", "os", "asn", "country", "time_zone")
+MAX_VALUE_LENGTH = 512
+
+
+def encode_dimensions(apps, schema_editor):
+    Dimension = apps.get_model("analytics", "Dimension")
+    Session = apps.get_model("analytics", "Session")
+    for kind in DIMENSIONS:
+        sessions = Session.objects.exclude(**{kind: ""})
+        values = {
+            value[:MAX_VALUE_LENGTH]
+            for value in sessions.values_list(kind, flat=True).distinct().iterator()
+        }
+        Dimension.objects.bulk_create(
+            [Dimension(kind=kind, value=value) for value in values],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        sessions.update(
+            **{
+                f"{kind}_dimension": Subquery(
+                    Dimension.objects.filter(
+                        kind=kind, value=Substr(OuterRef(kind), 1, MAX_VALUE_LENGTH)
+                    ).values("pk")[:1]
+                )
+            }
+        )
+
+
+def decode_dimensions(apps, schema_editor):
+    Dimension = apps.get_model("analytics", "Dimension")
+    Session = apps.get_model("analytics", "Session")
+    for kind in DIMENSIONS:
+        Session.objects.filter(**{f"{kind}_dimension__isnull": False}).update(
+            **{
+                kind: Subquery(
+                    Dimension.objects.filter(pk=OuterRef(f"{kind}_dimension")).values(
+                        "value"
+                    )[:1]
+                )
+            }
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0014_dimension"),
+    ]
+
+    operations = [
+        migrations.RunPython(encode_dimensions, decode_dimensions),
+    ]
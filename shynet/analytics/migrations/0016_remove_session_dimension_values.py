@@ -0,0 +1,75 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0015_encode_session_dimensions"),
+    ]
+
+    operations = [
+        # Defaults let the fields be added back when migrating backwards
+        migrations.AlterField(
+            model_name="session",
+            name="user_agent",
+            field=models.TextField(blank=True, default="", verbose_name="User agent"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="browser",
+            field=models.TextField(blank=True, default="", verbose_name="Browser"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="device",
+            field=models.TextField(blank=True, default="", verbose_name="Device"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="os",
+            field=models.TextField(blank=True, default="", verbose_name="OS"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="asn",
+            field=models.TextField(blank=True, default="", verbose_name="Asn"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="country",
+            field=models.TextField(blank=True, default="", verbose_name="Country"),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="time_zone",
+            field=models.TextField(blank=True, default="", verbose_name="Time zone"),
+        ),
+        migrations.RemoveField(
+            model_name="session",
+            name="user_agent",
+        ),
+        migrations.RemoveField(
+            model_name="session",
+            name="browser",
+        ),
+        migrations.RemoveField(
+            model_name="session",
+            name="device",
+        ),
+        migrations.RemoveField(
+            model_name="session",
+            name="os",
+        ),
+        migrations.RemoveField(
+            model_name="session",
+            name="asn",
+        ),
+        migrations.RemoveField(
+            model_name="session",
+            name="country",
+        ),
+        migrations.RemoveField(
+            model_name="session",
+            name="time_zone",
+        ),
+    ]
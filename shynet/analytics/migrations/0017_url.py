@@ -0,0 +1,59 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0016_remove_session_dimension_values"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Url",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hash", models.CharField(max_length=32, unique=True)),
+                ("url", models.TextField()),
+                ("host", models.TextField(blank=True)),
+            ],
+            options={
+                "verbose_name": "URL",
+                "verbose_name_plural": "URLs",
+            },
+        ),
+        migrations.AddField(
+            model_name="hit",
+            name="location_url",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.url",
+                verbose_name="Location",
+            ),
+        ),
+        migrations.AddField(
+            model_name="hit",
+            name="referrer_url",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="analytics.url",
+                verbose_name="Referrer",
+            ),
+        ),
+    ]
@@ -0,0 +1,85 @@
+from hashlib import blake2b
+from urllib.parse import urlsplit
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 1000
+
+
+def get_url_hash(url):
+    return blake2b(url.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_host(url):
+    try:
+        return urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+
+
+def encode_urls(apps, schema_editor):
+    Hit = apps.get_model("analytics", "Hit")
+    Url = apps.get_model("analytics", "Url")
+    urls = set()
+    for field in ("location", "referrer"):
+        urls.update(
+            Hit.objects.exclude(**{field: ""})
+            .values_list(field, flat=True)
+            .distinct()
+            .iterator()
+        )
+    Url.objects.bulk_create(
+        [Url(hash=get_url_hash(url), url=url, host=get_host(url)) for url in urls],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+    hits, url_table = Hit._meta.db_table, Url._meta.db_table
+    if schema_editor.connection.vendor == "postgresql":
+        # Joining the tables is much faster than looking up every hit's URLs
+        for field in ("location", "referrer"):
+            schema_editor.execute(
+                f'UPDATE "{hits}" SET "{field}_url_id" = "{url_table}"."id" '
+                f'FROM "{url_table}" WHERE "{url_table}"."url" = "{hits}"."{field}" '
+                f'AND "{hits}"."{field}" <> \'\''
+            )
+        return
+
+    # Elsewhere, hits look up their URLs through a temporary index
+    schema_editor.execute(
+        f'CREATE INDEX "analytics_url_migration_idx" ON "{url_table}" ("url")'
+    )
+    for field in ("location", "referrer"):
+        Hit.objects.exclude(**{field: ""}).update(
+            **{
+                f"{field}_url": Subquery(
+                    Url.objects.filter(url=OuterRef(field)).values("pk")[:1]
+                )
+            }
+        )
+    schema_editor.execute('DROP INDEX "analytics_url_migration_idx"')
+
+
+def decode_urls(apps, schema_editor):
+    Hit = apps.get_model("analytics", "Hit")
+    Url = apps.get_model("analytics", "Url")
+    for field in ("location", "referrer"):
+        Hit.objects.filter(**{f"{field}_url__isnull": False}).update(
+            **{
+                field: Subquery(
+                    Url.objects.filter(pk=OuterRef(f"{field}_url")).values("url")[:1]
+                )
+            }
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0017_url"),
+    ]
+
+    operations = [
+        migrations.RunPython(encode_urls, decode_urls),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0018_encode_hit_urls"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="hit",
+            name="hit_service_start_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="hit",
+            name="hit_initial_referrer_idx",
+        ),
+        # Defaults let the fields be added back when migrating backwards
+        migrations.AlterField(
+            model_name="hit",
+            name="location",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AlterField(
+            model_name="hit",
+            name="referrer",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.RemoveField(
+            model_name="hit",
+            name="location",
+        ),
+        migrations.RemoveField(
+            model_name="hit",
+            name="referrer",
+        ),
+        migrations.AddIndex(
+            model_name="hit",
+            index=models.Index(
+                fields=["service", "-start_time"],
+                include=("location_url", "load_time"),
+                name="hit_service_start_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hit",
+            index=models.Index(
+                condition=models.Q(("initial", True)),
+                fields=["service", "-start_time"],
+                include=("referrer_url",),
+                name="hit_initial_referrer_idx",
+            ),
+        ),
+    ]
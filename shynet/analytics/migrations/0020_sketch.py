@@ -0,0 +1,51 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_service_query_params"),
+        ("analytics", "0019_remove_hit_url_values"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Sketch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("visitors", "visitors")],
+                        max_length=16,
+                        verbose_name="Kind",
+                    ),
+                ),
+                ("hour", models.DateTimeField(verbose_name="Hour")),
+                ("data", models.BinaryField(verbose_name="Data")),
+                (
+                    "service",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="core.service",
+                        verbose_name="Service",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Sketch",
+                "verbose_name_plural": "Sketches",
+                "unique_together": {("service", "kind", "hour")},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0020_sketch"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="sketch",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("visitors", "visitors"),
+                    ("locations", "locations"),
+                    ("referrers", "referrers"),
+                ],
+                max_length=16,
+                verbose_name="Kind",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0021_sketch_top_kinds"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="sketch",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("visitors", "visitors"),
+                    ("locations", "locations"),
+                    ("referrers", "referrers"),
+                    ("load_times", "load_times"),
+                    ("page_load_times", "page_load_times"),
+                ],
+                max_length=16,
+                verbose_name="Kind",
+            ),
+        ),
+    ]
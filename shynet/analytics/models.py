@@ -1,5 +1,3 @@
-import uuid
-
 from django.db import models
 from django.shortcuts import reverse
 from django.utils import timezone
@@ -7,34 +5,126 @@ from django.utils.translation import gettext_lazy as _
 
 from core.models import Service, ACTIVE_USER_TIMEDELTA
 
+from .dimensions import (
+    DIMENSIONS,
+    get_dimension_id,
+    get_dimension_value,
+    get_url_id,
+    get_url_value,
+)
+from .sketches import SKETCHES
+from .utils import uuid7
+
 
 def _default_uuid():
-    return str(uuid.uuid4())
+    # Time-ordered, so that sessions are inserted at the end of the primary key's
+    # index (older sessions' random keys remain valid)
+    return str(uuid7())
+
+
+class Dimension(models.Model):
+    """A distinct value of one of the sessions' repetitive text fields (such as
+    browsers or countries), which sessions reference instead of repeating it."""
+
+    kind = models.CharField(
+        max_length=16, choices=[(kind, kind) for kind in DIMENSIONS]
+    )
+    value = models.TextField()
+
+    class Meta:
+        verbose_name = _("Dimension")
+        verbose_name_plural = _("Dimensions")
+        unique_together = [("kind", "value")]
+
+    def __str__(self):
+        return f"{self.kind}: {self.value}"
+
+
+class Url(models.Model):
+    """A URL that hits reference as their location or referrer. URLs can be too
+    long to index, so they're looked up by their hash."""
+
+    hash = models.CharField(max_length=32, unique=True)
+    url = models.TextField()
+    host = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = _("URL")
+        verbose_name_plural = _("URLs")
+
+    def __str__(self):
+        return self.url
+
+
+def _dimension_field(verbose_name):
+    return models.ForeignKey(
+        Dimension,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="+",
+        db_index=False,
+        verbose_name=verbose_name,
+    )
+
+
+def _dimension_property(kind):
+    """Reads and writes a dimension's value as if it was stored in the session."""
+    attname = f"{kind}_dimension_id"
+
+    def get_value(session):
+        return get_dimension_value(getattr(session, attname))
+
+    def set_value(session, value):
+        setattr(session, attname, get_dimension_id(kind, value))
+
+    return property(get_value, set_value)
+
+
+def _url_field(verbose_name):
+    return models.ForeignKey(
+        Url,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="+",
+        db_index=False,
+        verbose_name=verbose_name,
+    )
+
+
+def _url_property(name):
+    """Reads and writes a URL as if it was stored in the hit."""
+    attname = f"{name}_url_id"
+
+    def get_value(hit):
+        return get_url_value(getattr(hit, attname))
+
+    def set_value(hit, value):
+        setattr(hit, attname, get_url_id(value))
+
+    return property(get_value, set_value)
 
 
 class Session(models.Model):
     uuid = models.UUIDField(default=_default_uuid, primary_key=True)
     service = models.ForeignKey(
-        Service, verbose_name=_("Service"), on_delete=models.CASCADE, db_index=True
+        Service, verbose_name=_("Service"), on_delete=models.CASCADE, db_index=False
     )
 
     # Cross-session identification; optional, and provided by the service
-    identifier = models.TextField(
-        blank=True, db_index=True, verbose_name=_("Identifier")
-    )
+    identifier = models.TextField(blank=True, verbose_name=_("Identifier"))
 
     # Time
     start_time = models.DateTimeField(
         default=timezone.now, db_index=True, verbose_name=_("Start time")
     )
-    last_seen = models.DateTimeField(
-        default=timezone.now, db_index=True, verbose_name=_("Last seen")
-    )
+    last_seen = models.DateTimeField(default=timezone.now, verbose_name=_("Last seen"))
 
     # Core request information
-    user_agent = models.TextField(verbose_name=_("User agent"))
-    browser = models.TextField(verbose_name=_("Browser"))
-    device = models.TextField(verbose_name=_("Device"))
+    user_agent_dimension = _dimension_field(_("User agent"))
+    browser_dimension = _dimension_field(_("Browser"))
+    device_dimension = _dimension_field(_("Device"))
     device_type = models.CharField(
         max_length=7,
         choices=[
@@ -47,30 +137,44 @@ class Session(models.Model):
         default="OTHER",
         verbose_name=_("Device type"),
     )
-    os = models.TextField(verbose_name=_("OS"))
-    ip = models.GenericIPAddressField(db_index=True, null=True, verbose_name=_("IP"))
+    os_dimension = _dimension_field(_("OS"))
+    ip = models.GenericIPAddressField(null=True, verbose_name=_("IP"))
 
     # GeoIP data
-    asn = models.TextField(blank=True, verbose_name=_("Asn"))
-    country = models.TextField(blank=True, verbose_name=_("Country"))
+    asn_dimension = _dimension_field(_("Asn"))
+    country_dimension = _dimension_field(_("Country"))
     longitude = models.FloatField(null=True, verbose_name=_("Longitude"))
     latitude = models.FloatField(null=True, verbose_name=_("Latitude"))
-    time_zone = models.TextField(blank=True, verbose_name=_("Time zone"))
+    time_zone_dimension = _dimension_field(_("Time zone"))
 
-    is_bounce = models.BooleanField(
-        default=True, db_index=True, verbose_name=_("Is bounce")
-    )
+    is_bounce = models.BooleanField(default=True, verbose_name=_("Is bounce"))
 
     class Meta:
         verbose_name = _("Session")
         verbose_name_plural = _("Sessions")
         ordering = ["-start_time"]
+        # Every index slows down ingestion, so only the ones that the dashboard's
+        # queries use exist. The start time index serves the admin's ordering.
         indexes = [
-            models.Index(fields=["service", "-start_time"]),
-            models.Index(fields=["service", "-last_seen"]),
+            # Date range queries (the bounce count and session durations can be
+            # answered from the index alone on PostgreSQL)
+            models.Index(
+                fields=["service", "-start_time"],
+                include=["is_bounce", "last_seen"],
+                name="session_service_start_idx",
+            ),
             models.Index(fields=["service", "identifier"]),
         ]
 
+    # The dimensions' values, which can also be passed to the constructor
+    user_agent = _dimension_property("user_agent")
+    browser = _dimension_property("browser")
+    device = _dimension_property("device")
+    os = _dimension_property("os")
+    asn = _dimension_property("asn")
+    country = _dimension_property("country")
+    time_zone = _dimension_property("time_zone")
+
     @property
     def is_currently_active(self):
         return timezone.now() - self.last_seen < ACTIVE_USER_TIMEDELTA
@@ -80,7 +184,7 @@ class Session(models.Model):
         return self.last_seen - self.start_time
 
     def __str__(self):
-        return f"{self.identifier if self.identifier != '' else 'Anonymous'} @ {self.service.name} [{str(self.uuid)[:6]}]"
+        return f"{self.identifier if self.identifier != '' else 'Anonymous'} @ {self.service.name} [{str(self.uuid)[-6:]}]"
 
     def get_absolute_url(self):
         return reverse(
@@ -97,38 +201,61 @@ class Session(models.Model):
 
 class Hit(models.Model):
     session = models.ForeignKey(
-        Session, on_delete=models.CASCADE, db_index=True, verbose_name=_("Session")
+        Session, on_delete=models.CASCADE, db_index=False, verbose_name=_("Session")
     )
-    initial = models.BooleanField(default=True, db_index=True)
+    initial = models.BooleanField(default=True)
 
     # Base request information
     start_time = models.DateTimeField(default=timezone.now, db_index=True)
-    last_seen = models.DateTimeField(default=timezone.now, db_index=True)
+    last_seen = models.DateTimeField(default=timezone.now)
     heartbeats = models.IntegerField(default=0)
     tracker = models.TextField(
-        choices=[("JS", "JavaScript"), ("PIXEL", "Pixel (noscript)")]
-    )  # Tracking pixel or JS
+        choices=[
+            ("JS", "JavaScript"),
+            ("PIXEL", "Pixel (noscript)"),
+            ("API", "Ingestion API"),
+            ("LOG", "Access log import"),
+        ]
+    )  # Tracking pixel, JS, sent through the API, or imported from access logs
 
     # Advanced page information
-    location = models.TextField(blank=True, db_index=True)
-    referrer = models.TextField(blank=True, db_index=True)
-    load_time = models.FloatField(null=True, db_index=True)
+    location_url = _url_field(_("Location"))
+    referrer_url = _url_field(_("Referrer"))
+    load_time = models.FloatField(null=True)
 
     # While not necessary, we store the root service directly for performance.
     # It makes querying much easier; no need for inner joins.
-    service = models.ForeignKey(Service, on_delete=models.CASCADE, db_index=True)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, db_index=False)
 
     class Meta:
         verbose_name = _("Hit")
         verbose_name_plural = _("Hits")
         ordering = ["-start_time"]
+        # As with sessions, only the indexes that queries use exist
         indexes = [
+            # A session's hits, and deleting them with it
             models.Index(fields=["session", "-start_time"]),
-            models.Index(fields=["service", "-start_time"]),
-            models.Index(fields=["session", "location"]),
-            models.Index(fields=["session", "referrer"]),
+            # Date range queries (the location list and load times can be answered
+            # from the index alone on PostgreSQL)
+            models.Index(
+                fields=["service", "-start_time"],
+                include=["location_url", "load_time"],
+                name="hit_service_start_idx",
+            ),
+            # Referrers only count each session's initial hit
+            models.Index(
+                fields=["service", "-start_time"],
+                include=["referrer_url"],
+                condition=models.Q(initial=True),
+                name="hit_initial_referrer_idx",
+            ),
         ]
 
+    # The URLs' values, which can also be passed to the constructor (they're stored
+    # as given, so callers normalize them first)
+    location = _url_property("location")
+    referrer = _url_property("referrer")
+
     @property
     def duration(self):
         return self.last_seen - self.start_time
@@ -138,3 +265,28 @@ class Hit(models.Model):
             "dashboard:service_session",
             kwargs={"pk": self.service.pk, "session_pk": self.session.pk},
         )
+
+
+class Sketch(models.Model):
+    """A probabilistic summary of one of a service's hours (such as its distinct
+    visitors), which can be merged with others to summarize any range of hours."""
+
+    service = models.ForeignKey(
+        Service, verbose_name=_("Service"), on_delete=models.CASCADE, db_index=False
+    )
+    kind = models.CharField(
+        max_length=16,
+        choices=[(kind, kind) for kind in SKETCHES],
+        verbose_name=_("Kind"),
+    )
+    hour = models.DateTimeField(verbose_name=_("Hour"))
+    data = models.BinaryField(verbose_name=_("Data"))
+
+    class Meta:
+        verbose_name = _("Sketch")
+        verbose_name_plural = _("Sketches")
+        # Serves date range queries, too
+        unique_together = [("service", "kind", "hour")]
+
+    def __str__(self):
+        return f"{self.kind} @ {self.service.name} [{self.hour}]"
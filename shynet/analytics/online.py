@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+from math import ceil
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+# Sessions are online if they were seen within two heartbeats (like
+# `core.models.ACTIVE_USER_TIMEDELTA`), in seconds
+ONLINE_WINDOW = settings.SCRIPT_HEARTBEAT_FREQUENCY * 2 / 1000
+
+# How many sessions each process remembers having counted
+MAX_LOCAL_SESSIONS = 50000
+
+
+class OnlineCounter:
+    """Counts each service's online sessions in the cache, so that the count can be
+    read without querying the database.
+
+    Time is divided into windows as long as sessions stay online, and each window
+    counts the distinct sessions that were seen during it. A session is counted
+    the first time it's seen in a window, which takes a cache round trip. Processes
+    remember which sessions they've counted, so their later heartbeats in the same
+    window don't take any."""
+
+    def __init__(self, window):
+        self.window = window
+        self._counted = OrderedDict()  # (service, session) -> window number
+        self._lock = threading.Lock()
+
+    def _get_path(self, service_pk, window_number):
+        return f"online_{service_pk}_{window_number}"
+
+    def see(self, service_pk, session_pk, time=None):
+        """Counts a session as online, if it was seen recently enough."""
+        now = timezone.now()
+        if time is not None and (now - time).total_seconds() > self.window:
+            return
+        window_number = int(now.timestamp() / self.window)
+        key = (str(service_pk), str(session_pk))
+        with self._lock:
+            if self._counted.get(key) == window_number:
+                self._counted.move_to_end(key)
+                return
+            self._counted[key] = window_number
+            self._counted.move_to_end(key)
+            while len(self._counted) > MAX_LOCAL_SESSIONS:
+                self._counted.popitem(last=False)
+
+        path = self._get_path(service_pk, window_number)
+        # Windows are kept until the next one ends, since counts are read from both
+        timeout = ceil(self.window * 2) + 1
+        if not cache.add(f"{path}_{session_pk}", True, timeout=timeout):
+            return  # Another process already counted the session
+        try:
+            cache.incr(path)
+        except ValueError:
+            if not cache.add(path, 1, timeout=timeout):
+                cache.incr(path)
+
+    def count(self, service_pk):
+        """Returns how many of a service's sessions are online. Until the current
+        window has seen every online session, the previous window's count stands
+        in for it."""
+        window_number = int(timezone.now().timestamp() / self.window)
+        counts = cache.get_many(
+            [
+                self._get_path(service_pk, window_number),
+                self._get_path(service_pk, window_number - 1),
+            ]
+        )
+        return max(counts.values(), default=0)
+
+    def clear(self):
+        with self._lock:
+            self._counted.clear()
+
+
+_counter = OnlineCounter(ONLINE_WINDOW)
+
+
+def see_session(service_pk, session_pk, time=None):
+    _counter.see(service_pk, session_pk, time)
+
+
+def get_online_count(service_pk):
+    return _counter.count(service_pk)
@@ -0,0 +1,207 @@
+import logging
+import threading
+from hashlib import md5
+
+from celery import current_app
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import streams
+
+log = logging.getLogger(__name__)
+
+# Ingress degrades in stages as lag grows past its threshold: at the threshold,
+# heartbeats are shed; at twice the threshold, pixel hits too; and at four times the
+# threshold, only a sample of JS page loads is kept.
+SHED_NOTHING = 0
+SHED_HEARTBEATS = 1
+SHED_PIXELS = 2
+SHED_PAGE_LOADS = 3
+
+LAST_PROCESSED_CACHE_PATH = "ingress_last_processed"
+
+_last_recorded = 0
+_shed_level = (0, SHED_NOTHING)  # (checked at, level)
+_shed_level_lock = threading.Lock()
+
+
+def record_processed(time):
+    """Records that a worker picked up an event that was received at `time`. Only
+    done once per second per process, as it's only needed to estimate lag."""
+    global _last_recorded
+    now = timezone.now().timestamp()
+    if now - _last_recorded < 1:
+        return
+    _last_recorded = now
+    if isinstance(time, str):
+        time = parse_datetime(time)  # Older Celery versions serialize datetimes
+    cache.set(
+        LAST_PROCESSED_CACHE_PATH,
+        {"processed": now, "received": time.timestamp()},
+        timeout=None,
+    )
+
+
+def get_ingress_queues():
+    if settings.INGRESS_PARTITIONS > 0:
+        return [f"ingress_{n}" for n in range(settings.INGRESS_PARTITIONS)]
+    return [None]
+
+
+def _measure_celery_lag():
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        return {"depth": 0, "age": 0}
+    depth = 0
+    with current_app.connection_for_read() as connection:
+        for queue in get_ingress_queues():
+            try:
+                with connection.channel() as channel:
+                    _, message_count, _ = channel.queue_declare(
+                        queue or current_app.conf.task_default_queue, passive=True
+                    )
+                depth += message_count
+            except connection.channel_errors:
+                pass  # The queue hasn't been declared yet
+    if depth == 0:
+        return {"depth": 0, "age": 0}
+    # Celery can't peek at the oldest message, but it was received after the last
+    # event that a worker picked up, so it's at most that old
+    last_processed = cache.get(LAST_PROCESSED_CACHE_PATH)
+    if last_processed is None:
+        return {"depth": depth, "age": None}
+    return {
+        "depth": depth,
+        "age": timezone.now().timestamp() - last_processed["received"],
+    }
+
+
+def _following_id(entry_id):
+    milliseconds, sequence = entry_id.split("-")
+    return f"{milliseconds}-{int(sequence) + 1}"
+
+
+def _measure_stream_lag():
+    client = streams.get_client()
+    depth, oldest = 0, None
+    for queue in get_ingress_queues():
+        stream = streams.get_stream_name(queue)
+        if not client.exists(stream):
+            continue
+        groups = [
+            group
+            for group in client.xinfo_groups(stream)
+            if group["name"].decode() == streams.CONSUMER_GROUP
+        ]
+        last_delivered = groups[0]["last-delivered-id"].decode() if groups else "0-0"
+        entries = client.xrange(stream, min=_following_id(last_delivered), count=1)
+        if not entries:
+            continue
+        entry_time = int(entries[0][0].decode().split("-")[0]) / 1000
+        oldest = entry_time if oldest is None else min(oldest, entry_time)
+        if depth is None:
+            continue
+        if not groups:
+            depth += client.xlen(stream)  # Nothing was ever consumed
+        elif groups[0].get("lag") is not None:
+            depth += groups[0]["lag"]
+        else:
+            depth = None  # Only Redis 7 tracks how many entries are undelivered
+    return {
+        "depth": depth,
+        "age": 0 if oldest is None else timezone.now().timestamp() - oldest,
+    }
+
+
+def measure_lag():
+    """Returns the number of events waiting to be ingested (`depth`) and how long
+    the oldest of them has been waiting, in seconds (`age`). Either may be None if
+    the transport can't tell."""
+    if settings.INGRESS_TRANSPORT == "stream":
+        return _measure_stream_lag()
+    return _measure_celery_lag()
+
+
+def get_overload(lag):
+    """Returns how far past its threshold the lag is; 1 means right at it."""
+    ratios = [0]
+    if lag["age"] is not None and settings.INGRESS_LAG_THRESHOLD > 0:
+        ratios.append(lag["age"] / settings.INGRESS_LAG_THRESHOLD)
+    if lag["depth"] is not None and settings.INGRESS_QUEUE_DEPTH_THRESHOLD > 0:
+        ratios.append(lag["depth"] / settings.INGRESS_QUEUE_DEPTH_THRESHOLD)
+    return max(ratios)
+
+
+def get_shed_level_for(overload):
+    if overload >= 4:
+        return SHED_PAGE_LOADS
+    if overload >= 2:
+        return SHED_PIXELS
+    if overload >= 1:
+        return SHED_HEARTBEATS
+    return SHED_NOTHING
+
+
+def get_shed_level():
+    """Returns how much ingress should currently degrade. Lag is measured at most
+    once every `INGRESS_LAG_CHECK_INTERVAL` seconds per process."""
+    global _shed_level
+    if (
+        settings.INGRESS_LAG_THRESHOLD <= 0
+        and settings.INGRESS_QUEUE_DEPTH_THRESHOLD <= 0
+    ):
+        return SHED_NOTHING
+    now = timezone.now().timestamp()
+    checked_at, level = _shed_level
+    if now - checked_at < settings.INGRESS_LAG_CHECK_INTERVAL:
+        return level
+    with _shed_level_lock:
+        checked_at, level = _shed_level
+        if now - checked_at < settings.INGRESS_LAG_CHECK_INTERVAL:
+            return level
+        try:
+            level = get_shed_level_for(get_overload(measure_lag()))
+        except Exception as e:
+            # Never shed because the lag can't be measured
+            log.exception("Unable to measure ingestion lag: %s", e)
+            level = SHED_NOTHING
+        if level != _shed_level[1]:
+            log.warning(f"Ingress shed level changed to {level}")
+        _shed_level = (now, level)
+    return level
+
+
+def _is_sampled(idempotency):
+    # Keyed on the idempotency key, so that a retried page load is kept or dropped
+    # consistently
+    position = int(md5(str(idempotency).encode("utf-8")).hexdigest()[:8], 16)
+    return position / 0xFFFFFFFF < settings.INGRESS_SHED_SAMPLE_RATE
+
+
+def _is_heartbeat(idempotency):
+    # The idempotency keys are recorded as events arrive, rather than once the
+    # workers have created their hits, so that heartbeats are recognized while the
+    # workers are behind
+    return not cache.add(
+        f"ingress_idempotency_{idempotency}",
+        True,
+        timeout=settings.SESSION_MEMORY_TIMEOUT,
+    )
+
+
+def get_shed_reason(tracker, payload):
+    """Returns what kind of event this is if it should be shed, or None."""
+    idempotency = payload.get("idempotency") if tracker == "JS" else None
+    heartbeat = idempotency is not None and _is_heartbeat(idempotency)
+    level = get_shed_level()
+    if level == SHED_NOTHING:
+        return None
+    if idempotency is not None:
+        if heartbeat:
+            return "heartbeat"
+        if level >= SHED_PAGE_LOADS and not _is_sampled(idempotency):
+            return "page_load"
+    if tracker == "PIXEL" and level >= SHED_PIXELS:
+        return "pixel"
+    return None
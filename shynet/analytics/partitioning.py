@@ -0,0 +1,241 @@
+import logging
+import threading
+from bisect import bisect
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import md5
+from time import sleep
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Hit, Session
+
+log = logging.getLogger(__name__)
+
+# How many points each partition occupies on the hash ring. More points spread
+# visitors more evenly between partitions.
+VIRTUAL_NODES = 64
+
+
+def _ring_position(key):
+    return int(md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring over the ingress partition queues. Adding a partition
+    only moves the visitors that land on the new partition's points."""
+
+    def __init__(self, partitions):
+        self._ring = sorted(
+            (_ring_position(f"{partition}#{node}"), partition)
+            for partition in partitions
+            for node in range(VIRTUAL_NODES)
+        )
+        self._positions = [position for position, _ in self._ring]
+
+    def get_partition(self, key):
+        index = bisect(self._positions, _ring_position(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+@lru_cache(maxsize=None)
+def _get_ring(partitions):
+    return HashRing([f"ingress_{n}" for n in range(partitions)])
+
+
+def get_partition_queue(association_id):
+    """Returns the Celery queue that handles the given visitor's events, or None if
+    ingestion isn't partitioned."""
+    if settings.INGRESS_PARTITIONS <= 0:
+        return None
+    return _get_ring(settings.INGRESS_PARTITIONS).get_partition(association_id)
+
+
+class LocalIngressTable:
+    """Process-local table of a partition worker's active sessions and hits.
+
+    Because every event of a visitor is routed to the same partition, the worker
+    can keep their session state in memory instead of looking it up in the shared
+    cache, and buffer heartbeats (the bulk of all events) so they are written to
+    the database in bulk. Entries are written through to the shared cache by the
+    caller, so visitors that move to another partition are picked up from there."""
+
+    def __init__(self, max_entries, flush_size, flush_interval):
+        self.max_entries = max_entries
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._hits = {}  # Hits created by this worker: pk -> session pk
+        self._pending_hits = {}  # pk -> (new heartbeats, last seen)
+        self._pending_sessions = {}  # pk -> last seen
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def get_many(self, keys):
+        now = timezone.now().timestamp()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires, value = entry
+                if expires < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, entries):
+        expires = timezone.now().timestamp() + settings.SESSION_MEMORY_TIMEOUT
+        with self._lock:
+            for key, value in entries.items():
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            while len(self._hits) > self.max_entries:
+                self._hits.pop(next(iter(self._hits)))
+
+    def touch(self, keys):
+        """Extends the expiry of entries that are still in use."""
+        expires = timezone.now().timestamp() + settings.SESSION_MEMORY_TIMEOUT
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries[key] = (expires, self._entries[key][1])
+
+    def track_hit(self, hit_pk, session_pk):
+        with self._lock:
+            self._hits[hit_pk] = session_pk
+
+    def heartbeat(self, hit_pk, session_pk, time):
+        """Buffers a heartbeat of a hit created by this worker. Returns False if the
+        hit is unknown, in which case the caller must update it directly."""
+        with self._lock:
+            if self._hits.get(hit_pk) != session_pk:
+                return False
+            heartbeats, _ = self._pending_hits.get(hit_pk, (0, time))
+            self._pending_hits[hit_pk] = (heartbeats + 1, time)
+        self._maybe_flush()
+        return True
+
+    def see_session(self, session_pk, time):
+        """Buffers a session's new last seen time."""
+        with self._lock:
+            self._pending_sessions[session_pk] = time
+        self._maybe_flush()
+
+    def discard_session(self, session_pk):
+        """Drops a buffered update that a direct update of the session supersedes."""
+        with self._lock:
+            self._pending_sessions.pop(session_pk, None)
+
+    def _maybe_flush(self):
+        if len(self._pending_hits) + len(self._pending_sessions) >= self.flush_size:
+            self.flush()
+        elif self._flusher is None:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="ingress-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            sleep(self.flush_interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception(e)
+
+    def flush(self):
+        # Flushes are serialized so that an older flush can't overwrite a newer one
+        with self._flush_lock:
+            with self._lock:
+                pending_hits, self._pending_hits = self._pending_hits, {}
+                pending_sessions, self._pending_sessions = self._pending_sessions, {}
+            if not pending_hits and not pending_sessions:
+                return
+            try:
+                self._write(pending_hits, pending_sessions)
+            except Exception:
+                # Failed updates are kept for the next flush
+                with self._lock:
+                    for pk, (heartbeats, last_seen) in pending_hits.items():
+                        if pk in self._pending_hits:
+                            newer, last_seen = self._pending_hits[pk]
+                            heartbeats += newer
+                        self._pending_hits[pk] = (heartbeats, last_seen)
+                    for pk, last_seen in pending_sessions.items():
+                        self._pending_sessions.setdefault(pk, last_seen)
+                raise
+
+    def _write(self, pending_hits, pending_sessions):
+        log.debug(
+            f"Flushing {len(pending_hits)} hits and {len(pending_sessions)} sessions..."
+        )
+        # Other workers may update the same rows (e.g. after a rebalance), so the
+        # heartbeats are added and last seen times only move forward
+        with transaction.atomic():
+            Hit.objects.bulk_update(
+                [
+                    Hit(
+                        pk=pk,
+                        heartbeats=F("heartbeats") + heartbeats,
+                        last_seen=Greatest("last_seen", Value(last_seen)),
+                    )
+                    for pk, (heartbeats, last_seen) in pending_hits.items()
+                ],
+                ["heartbeats", "last_seen"],
+            )
+            Session.objects.bulk_update(
+                [
+                    Session(pk=pk, last_seen=Greatest("last_seen", Value(last_seen)))
+                    for pk, last_seen in pending_sessions.items()
+                ],
+                ["last_seen"],
+            )
+
+
+_local_table = None
+_local_table_lock = threading.Lock()
+
+
+def get_local_table():
+    """Returns this worker's local ingress table, or None if ingestion isn't
+    partitioned (or tasks run eagerly in the webserver, where visitors aren't
+    pinned to a process)."""
+    global _local_table
+    if settings.INGRESS_PARTITIONS <= 0 or (
+        settings.INGRESS_TRANSPORT == "celery" and settings.CELERY_TASK_ALWAYS_EAGER
+    ):
+        return None
+    with _local_table_lock:
+        if _local_table is None:
+            _local_table = LocalIngressTable(
+                max_entries=settings.INGRESS_PARTITION_TABLE_SIZE,
+                flush_size=settings.INGRESS_PARTITION_FLUSH_SIZE,
+                flush_interval=settings.INGRESS_PARTITION_FLUSH_INTERVAL,
+            )
+        return _local_table
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def _flush_local_table(**kwargs):
+    if _local_table is not None:
+        _local_table.flush()
@@ -0,0 +1,102 @@
+import logging
+import threading
+from collections import OrderedDict
+from math import ceil
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+log = logging.getLogger(__name__)
+
+# How many of a window's tokens a process claims from the shared bucket at once
+LEASE_FRACTION = 0.05
+# How many keys (e.g., client IPs) each process keeps leases for
+MAX_LOCAL_KEYS = 10000
+
+
+class RateLimiter:
+    """Token bucket rate limiter whose buckets are shared by all processes through
+    the cache.
+
+    The cache only offers atomic increments, so each bucket holds `burst` tokens
+    and is refilled all at once every `burst / rate` seconds, which allows `rate`
+    events per second on average and bursts of up to `burst` events. Processes
+    claim tokens from the shared bucket in small leases, so most events are
+    admitted (and, once the bucket is empty, rejected) without a cache round trip.
+    """
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.window = self.burst / rate if rate > 0 else 0
+        self.lease_size = max(1, ceil(self.burst * LEASE_FRACTION))
+        self._leases = OrderedDict()  # key -> [window number, tokens left]
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def allow(self, key):
+        if not self.enabled or key is None:
+            return True
+        window_number = int(time() / self.window)
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease[0] == window_number:
+                self._leases.move_to_end(key)
+                if lease[1] > 0:
+                    lease[1] -= 1
+                    return True
+                if lease[1] < 0:
+                    return False  # The shared bucket is already empty
+        granted = self._claim(key, window_number)
+        with self._lock:
+            # Tokens that a missing lease would hold are simply forfeited
+            self._leases[key] = [window_number, granted - 1 if granted else -1]
+            self._leases.move_to_end(key)
+            while len(self._leases) > MAX_LOCAL_KEYS:
+                self._leases.popitem(last=False)
+        return granted > 0
+
+    def _claim(self, key, window_number):
+        """Claims up to a lease's worth of tokens from the shared bucket, returning
+        how many were granted."""
+        cache_path = f"ratelimit_{self.name}_{key}_{window_number}"
+        try:
+            taken = cache.incr(cache_path, self.lease_size)
+        except ValueError:
+            if cache.add(cache_path, self.lease_size, timeout=ceil(self.window) + 1):
+                taken = self.lease_size
+            else:
+                taken = cache.incr(cache_path, self.lease_size)
+        return max(0, min(self.lease_size, self.burst - (taken - self.lease_size)))
+
+
+_limiters = {}
+
+
+def get_limiter(name):
+    """Returns the limiter for `service` or `ip` ingress, as configured."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        if name == "service":
+            rate = settings.INGRESS_RATE_LIMIT_SERVICE
+            burst = settings.INGRESS_RATE_LIMIT_SERVICE_BURST
+        else:
+            rate = settings.INGRESS_RATE_LIMIT_IP
+            burst = settings.INGRESS_RATE_LIMIT_IP_BURST
+        limiter = _limiters[name] = RateLimiter(name, rate, burst or ceil(rate * 10))
+    return limiter
+
+
+def get_rate_limit(service_uuid, ip):
+    """Returns which rate limit an event exceeds (`service` or `ip`), or None if it
+    exceeds neither."""
+    if not get_limiter("ip").allow(ip):
+        return "ip"
+    if not get_limiter("service").allow(str(service_uuid)):
+        return "service"
+    return None
@@ -0,0 +1,599 @@
+import atexit
+import logging
+import struct
+import threading
+from hashlib import blake2b, sha256
+from math import ceil, isfinite
+from math import log as ln
+from operator import itemgetter
+from time import sleep
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+log = logging.getLogger(__name__)
+
+
+class HyperLogLog:
+    """Estimates how many distinct values were added to it, in a fixed 4 KiB.
+
+    With 2^12 registers, the standard error is 1.04 / sqrt(4096) = 1.6%, so about
+    95% of estimates are within 3.3% of the true count. Sketches merge without
+    losing accuracy, so the count over any number of them is as accurate as the
+    count of one."""
+
+    PRECISION = 12
+    REGISTERS = 2**PRECISION
+    ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+    # Sketches with few registers set are stored as (index, value) pairs
+    DENSE, SPARSE = 0, 1
+    _PAIR = struct.Struct(">HB")
+
+    # 2^-value, by register value
+    _POWERS = [2.0**-value for value in range(64 - PRECISION + 2)]
+
+    # The high bit of every register, for merging them all at once
+    _HIGH_BITS = int.from_bytes(b"\x80" * REGISTERS, "big")
+
+    def __init__(self, registers=None):
+        self.registers = registers or bytearray(self.REGISTERS)
+
+    def add(self, value):
+        h = int.from_bytes(
+            blake2b(value.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        index = h >> (64 - self.PRECISION)
+        rest = h & (2 ** (64 - self.PRECISION) - 1)
+        # The position of the leftmost 1 bit of the rest of the hash
+        rank = 64 - self.PRECISION - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        # All registers are compared at once: registers are below 128, so with
+        # their high bits set, subtracting the other sketch's registers from these
+        # leaves each high bit set where this register is the larger, without
+        # borrowing from the next one
+        mine = int.from_bytes(self.registers, "big")
+        theirs = int.from_bytes(other.registers, "big")
+        larger = ((((mine | self._HIGH_BITS) - theirs) & self._HIGH_BITS) >> 7) * 0xFF
+        self.registers = bytearray(
+            ((mine & larger) | (theirs & ~larger)).to_bytes(self.REGISTERS, "big")
+        )
+
+    def count(self):
+        estimate = (
+            self.ALPHA
+            * self.REGISTERS**2
+            / sum(self._POWERS[value] for value in self.registers)
+        )
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.REGISTERS and zeros:
+            # Small counts are more accurately estimated from the empty registers
+            estimate = self.REGISTERS * ln(self.REGISTERS / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        pairs = [(index, value) for index, value in enumerate(self.registers) if value]
+        if len(pairs) * self._PAIR.size < self.REGISTERS:
+            return bytes([self.SPARSE]) + b"".join(
+                self._PAIR.pack(index, value) for index, value in pairs
+            )
+        return bytes([self.DENSE]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        if data[0] == cls.DENSE:
+            return cls(bytearray(data[1:]))
+        registers = bytearray(cls.REGISTERS)
+        for index, value in cls._PAIR.iter_unpack(data[1:]):
+            registers[index] = value
+        return cls(registers)
+
+
+class TopK:
+    """Keeps the most frequent of the integers added to it, with their counts
+    (Space-Saving). It holds up to twice `CAPACITY` counters, and whenever it runs
+    out (or is stored), it drops all but the largest `CAPACITY` of them.
+
+    An integer that was dropped (or never counted) was added at most `floor` times,
+    so integers that are first counted after a drop start from the floor, and
+    counts may be overestimated by as much (as recorded in `errors`). While nothing
+    has been dropped, the counts are exact."""
+
+    CAPACITY = 1000
+
+    _HEADER = struct.Struct(">I")
+    _ENTRY = struct.Struct(">QII")
+
+    def __init__(self, counts=None, errors=None, floor=0):
+        self.counts = counts or {}
+        self.errors = errors or {}
+        self.floor = floor
+
+    def add(self, item):
+        count = self.counts.get(item)
+        if count is not None:
+            self.counts[item] = count + 1
+            return
+        self.counts[item] = self.floor + 1
+        if self.floor:
+            self.errors[item] = self.floor
+        if len(self.counts) > 2 * self.CAPACITY:
+            self._truncate()
+
+    def _truncate(self):
+        if len(self.counts) <= self.CAPACITY:
+            return
+        ranked = sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        self.floor = max(self.floor, ranked[self.CAPACITY][1])
+        self.counts = dict(ranked[: self.CAPACITY])
+        self.errors = {
+            item: error for item, error in self.errors.items() if item in self.counts
+        }
+
+    def merge(self, other):
+        # Counts are added up, and only truncated when stored, so merging many
+        # sketches doesn't drop counters that are only large in total
+        counts, errors = self.counts, self.errors
+        for item, count in other.counts.items():
+            counts[item] = counts.get(item, 0) + count
+        for item, error in other.errors.items():
+            errors[item] = errors.get(item, 0) + error
+        self.floor += other.floor
+
+    @property
+    def is_exact(self):
+        return self.floor == 0
+
+    def top(self, limit=None):
+        """Returns the most frequent integers and their counts, most frequent
+        first."""
+        ranked = sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        return ranked[:limit]
+
+    def to_bytes(self):
+        self._truncate()
+        return self._HEADER.pack(self.floor) + b"".join(
+            self._ENTRY.pack(item, count, self.errors.get(item, 0))
+            for item, count in self.counts.items()
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        (floor,) = cls._HEADER.unpack_from(data)
+        counts, errors = {}, {}
+        for item, count, error in cls._ENTRY.iter_unpack(data[cls._HEADER.size :]):
+            counts[item] = count
+            if error:
+                errors[item] = error
+        return cls(counts, errors, floor)
+
+
+class DDSketch:
+    """Estimates the quantiles of the (non-negative) numbers added to it, such as
+    load times, to within 2% of their values (DDSketch).
+
+    Numbers are counted in buckets whose bounds grow by a constant factor, so each
+    bucket's midpoint is within 2% of the numbers in it. Numbers that are a few
+    percent apart share a bucket, so a sketch usually has a few dozen. Sketches
+    merge by adding up their buckets, without losing accuracy."""
+
+    RELATIVE_ACCURACY = 0.02
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _LOG_GAMMA = ln(GAMMA)
+
+    PERCENTILES = (50, 75, 95, 99)
+
+    _HEADER = struct.Struct(">I")  # Zeros
+    _BUCKET = struct.Struct(">hI")  # Index and count
+
+    def __init__(self, buckets=None, zeros=0):
+        self.buckets = buckets or {}
+        self.zeros = zeros
+
+    def add(self, value):
+        if not isfinite(value) or value < 0:
+            return
+        if value == 0:
+            self.zeros += 1
+            return
+        index = min(max(ceil(ln(value) / self._LOG_GAMMA), -(2**15)), 2**15 - 1)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            buckets[index] = buckets.get(index, 0) + count
+        self.zeros += other.zeros
+
+    @property
+    def count(self):
+        return self.zeros + sum(self.buckets.values())
+
+    def quantile(self, q):
+        """Returns the number that a fraction `q` of the numbers are below, or None
+        if none were added."""
+        rank = q * (self.count - 1)
+        if rank < 0:
+            return None
+        seen = self.zeros
+        if seen > rank:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.GAMMA**index / (self.GAMMA + 1)
+
+    def percentiles(self):
+        """Returns the percentiles as a dict (like `{"p50": 812.4, ...}`), or None
+        if no numbers were added."""
+        if not self.count:
+            return None
+        return {
+            f"p{percentile}": self.quantile(percentile / 100)
+            for percentile in self.PERCENTILES
+        }
+
+    def to_bytes(self):
+        return self._HEADER.pack(self.zeros) + b"".join(
+            self._BUCKET.pack(index, count) for index, count in self.buckets.items()
+        )
+
+    def merge_bytes(self, data, offset=0, length=None):
+        """Merges a stored sketch into this one, without reading it into a sketch
+        of its own first."""
+        end = len(data) if length is None else offset + length
+        (zeros,) = self._HEADER.unpack_from(data, offset)
+        self.zeros += zeros
+        buckets = self.buckets
+        for index, count in self._BUCKET.iter_unpack(
+            data[offset + self._HEADER.size : end]
+        ):
+            buckets[index] = buckets.get(index, 0) + count
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        sketch.merge_bytes(bytes(data))
+        return sketch
+
+
+class KeyedDDSketch:
+    """Keeps a `DDSketch` for each integer key (such as URL IDs). Only the `CAPACITY`
+    keys with the most numbers are stored."""
+
+    CAPACITY = 50
+
+    _KEY = struct.Struct(">QH")  # Key and length of its sketch
+
+    def __init__(self, sketches=None):
+        self.sketches = sketches or {}
+
+    def add(self, item):
+        key, value = item
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = DDSketch()
+        sketch.add(value)
+
+    def merge(self, other):
+        for key, sketch in other.sketches.items():
+            if key in self.sketches:
+                self.sketches[key].merge(sketch)
+            else:
+                self.sketches[key] = sketch
+
+    def to_bytes(self):
+        largest = sorted(
+            self.sketches.items(), key=lambda item: item[1].count, reverse=True
+        )
+        parts = []
+        for key, sketch in largest[: self.CAPACITY]:
+            data = sketch.to_bytes()
+            parts.append(self._KEY.pack(key, len(data)) + data)
+        return b"".join(parts)
+
+    def merge_bytes(self, data):
+        """Merges a stored sketch into this one. Stored sketches hold many small
+        sketches, so merging them in place saves reading each into a sketch of its
+        own (which would take most of the time)."""
+        data = bytes(data)
+        offset = 0
+        while offset < len(data):
+            key, length = self._KEY.unpack_from(data, offset)
+            offset += self._KEY.size
+            sketch = self.sketches.get(key)
+            if sketch is None:
+                sketch = self.sketches[key] = DDSketch()
+            sketch.merge_bytes(data, offset, length)
+            offset += length
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        sketch.merge_bytes(data)
+        return sketch
+
+
+# The kinds of sketches that are kept for every service and hour
+SKETCHES = {
+    # Distinct visitors, by identifier or association hash
+    "visitors": HyperLogLog,
+    # The most loaded pages, by URL ID (0 for none)
+    "locations": TopK,
+    # The sessions' most common referrers, by URL ID (0 for none)
+    "referrers": TopK,
+    # Load times, in milliseconds
+    "load_times": DDSketch,
+    # The most loaded pages' load times, by URL ID (0 for none)
+    "page_load_times": KeyedDDSketch,
+}
+
+
+def get_visitor_key(identifier, association_id):
+    """Returns what identifies a visitor when counting distinct visitors: the
+    identifier the service gave them, or else their association hash."""
+    identifier = (identifier or "").strip()
+    if identifier:
+        return f"identifier:{identifier}"
+    return association_id
+
+
+def _get_hour(time):
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+class SketchBuffer:
+    """Buffers a process's additions to each service's hourly sketches, and merges
+    them into the sketches in the database every `flush_interval` seconds (or only
+    when flushed, if it's None)."""
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval
+        self._pending = {}  # (service, kind, hour) -> sketch
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, service_pk, kind, time, value):
+        key = (str(service_pk), kind, _get_hour(time))
+        with self._lock:
+            sketch = self._pending.get(key)
+            if sketch is None:
+                sketch = self._pending[key] = SKETCHES[kind]()
+            sketch.add(value)
+        if self.flush_interval is not None and self._flusher is None:
+            self._start_flusher()
+
+    def add_hit(
+        self,
+        service_pk,
+        time,
+        visitor_key,
+        location_pk,
+        referrer_pk,
+        initial,
+        load_time=None,
+        kinds=SKETCHES,
+    ):
+        """Adds a page load to the service's sketches (of the given kinds). Only
+        sessions' initial hits count towards referrers, and visitors and load times
+        aren't added without a key or load time."""
+        if visitor_key is not None and "visitors" in kinds:
+            self.add(service_pk, "visitors", time, visitor_key)
+        if "locations" in kinds:
+            self.add(service_pk, "locations", time, location_pk or 0)
+        if initial and "referrers" in kinds:
+            self.add(service_pk, "referrers", time, referrer_pk or 0)
+        try:
+            load_time = float(load_time)
+        except (TypeError, ValueError):
+            return
+        if "load_times" in kinds:
+            self.add(service_pk, "load_times", time, load_time)
+        if "page_load_times" in kinds:
+            self.add(service_pk, "page_load_times", time, (location_pk or 0, load_time))
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="sketch-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            sleep(self.flush_interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception(e)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            failed = {}
+            for key, sketch in pending.items():
+                try:
+                    merge_sketch(*key, sketch)
+                except IntegrityError:
+                    # The service was deleted since, so there is nothing to merge into
+                    log.warning("Dropping sketch of missing service %s", key[0])
+                except Exception as e:
+                    log.exception(e)
+                    failed[key] = sketch
+            # Failed additions are kept for the next flush
+            with self._lock:
+                for key, sketch in failed.items():
+                    if key in self._pending:
+                        sketch.merge(self._pending[key])
+                    self._pending[key] = sketch
+
+
+def merge_sketch(service_pk, kind, hour, sketch):
+    """Merges a sketch into a service's stored sketch of an hour."""
+    Sketch = apps.get_model("analytics", "Sketch")
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                row = (
+                    Sketch.objects.select_for_update()
+                    .filter(service_id=service_pk, kind=kind, hour=hour)
+                    .first()
+                )
+                if row is None:
+                    Sketch.objects.create(
+                        service_id=service_pk,
+                        kind=kind,
+                        hour=hour,
+                        data=sketch.to_bytes(),
+                    )
+                    return
+                stored = SKETCHES[kind].from_bytes(row.data)
+                stored.merge(sketch)
+                row.data = stored.to_bytes()
+                row.save(update_fields=["data"])
+                return
+        except IntegrityError:
+            if attempt:
+                raise
+            # Another process created the sketch first, so merge into theirs
+
+
+def get_sketch(service_pk, kind, start_time, end_time):
+    """Returns the merged sketch of the hours that overlap a time range."""
+    Sketch = apps.get_model("analytics", "Sketch")
+    merged = SKETCHES[kind]()
+    # Kinds that can merge stored sketches directly do so
+    merge_bytes = getattr(merged, "merge_bytes", None)
+    for data in Sketch.objects.filter(
+        service_id=service_pk,
+        kind=kind,
+        hour__gte=_get_hour(start_time),
+        hour__lt=end_time,
+    ).values_list("data", flat=True):
+        if merge_bytes is not None:
+            merge_bytes(data)
+        else:
+            merged.merge(SKETCHES[kind].from_bytes(data))
+    return merged
+
+
+def get_sketch_start(service_pk, kind):
+    """Returns the first hour that a service has a sketch of, if any."""
+    Sketch = apps.get_model("analytics", "Sketch")
+    return (
+        Sketch.objects.filter(service_id=service_pk, kind=kind)
+        .order_by("hour")
+        .values_list("hour", flat=True)
+        .first()
+    )
+
+
+def build_sketches(service, start_time, end_time, kinds=None):
+    """Rebuilds a service's sketches (of the given kinds, or all of them) of the
+    hours from `start_time` to `end_time` from the sessions and hits in the
+    database, replacing the stored ones. Returns how many sketches were built.
+
+    Sessions don't keep their association hash, so visitors are told apart by
+    their identifier, IP address and user agent (or, without an IP address, by
+    their session)."""
+    Session = apps.get_model("analytics", "Session")
+    Hit = apps.get_model("analytics", "Hit")
+    Sketch = apps.get_model("analytics", "Sketch")
+    from .dimensions import get_dimension_value
+
+    kinds = set(SKETCHES if kinds is None else kinds)
+    start_time, end_time = _get_hour(start_time), _get_hour(end_time)
+    buffer = SketchBuffer()
+    if "visitors" in kinds:
+        sessions = Session.objects.filter(
+            service=service, start_time__gte=start_time, start_time__lt=end_time
+        ).values_list("uuid", "start_time", "identifier", "ip", "user_agent_dimension")
+        for pk, start, identifier, ip, user_agent in sessions.iterator():
+            if ip:
+                user_agent = get_dimension_value(user_agent)
+                association_id = sha256(f"{ip}{user_agent}".encode("utf-8")).hexdigest()
+            else:
+                association_id = str(pk)
+            buffer.add(
+                service.pk,
+                "visitors",
+                start,
+                get_visitor_key(identifier, association_id),
+            )
+    if kinds - {"visitors"}:
+        hits = Hit.objects.filter(
+            service=service, start_time__gte=start_time, start_time__lt=end_time
+        ).values_list(
+            "start_time", "initial", "location_url", "referrer_url", "load_time"
+        )
+        for start, initial, location_pk, referrer_pk, load_time in hits.iterator():
+            buffer.add_hit(
+                service.pk,
+                start,
+                None,
+                location_pk,
+                referrer_pk,
+                initial,
+                load_time,
+                kinds=kinds,
+            )
+
+    with transaction.atomic():
+        Sketch.objects.filter(
+            service=service, kind__in=kinds, hour__gte=start_time, hour__lt=end_time
+        ).delete()
+        count = len(buffer)
+        buffer.flush()
+    return count
+
+
+_buffer = SketchBuffer(settings.SKETCH_FLUSH_INTERVAL)
+
+
+def record_hit(
+    service_pk, time, visitor_key, location_pk, referrer_pk, initial, load_time=None
+):
+    _buffer.add_hit(
+        service_pk, time, visitor_key, location_pk, referrer_pk, initial, load_time
+    )
+
+
+def flush_sketches():
+    """Merges what the process has buffered into the sketches in the database. This
+    happens periodically, and when the process exits."""
+    _buffer.flush()
+
+
+def clear_sketches():
+    """Discards what the process has buffered, such as the additions of a test whose
+    database changes are rolled back."""
+    _buffer.clear()
+
+
+atexit.register(flush_sketches)
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def _flush_buffer(**kwargs):
+    flush_sketches()
@@ -0,0 +1,198 @@
+import atexit
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+from time import time_ns
+
+from django.conf import settings
+
+from .streams import decode_event, encode_event
+
+log = logging.getLogger(__name__)
+
+# Each record is prefixed with its length; a zero length marks the end of a segment
+HEADER = struct.Struct(">I")
+
+NEW_SUFFIX = ".new"
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".spool"
+CHECKPOINT_SUFFIX = ".offset"
+
+
+def _encode_record(args, kwargs, queue):
+    return f"{queue or ''}\t{encode_event(args, kwargs)}".encode("utf-8")
+
+
+def _decode_record(record):
+    queue, event = record.decode("utf-8").split("\t", 1)
+    args, kwargs = decode_event(event)
+    return args, kwargs, queue or None
+
+
+def _read_records(path, offset=0):
+    """Yields the records of a segment after `offset`, along with the offset that
+    follows each of them."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while offset + HEADER.size <= len(data):
+                (length,) = HEADER.unpack_from(data, offset)
+                start = offset + HEADER.size
+                if length == 0 or start + length > len(data):
+                    return  # The end of the segment, or a torn record at its end
+                offset = start + length
+                yield offset, data[start:offset]
+
+
+def _is_locked(path):
+    """Returns whether a process still holds the lock on a segment it's writing."""
+    with open(path, "rb") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return False
+
+
+class Spool:
+    """Append-only local spool of ingress events that couldn't be handed to the
+    workers, so that they can be replayed once the transport recovers.
+
+    Every process appends to its own memory-mapped segment file, which is sealed
+    once it's full or the transport is reachable again. Segments are named after
+    the time they were opened, so replaying them in name order keeps events in
+    order. Records survive the process crashing, but not the machine: a process
+    holds a lock on its open segment until it seals it, and the lock is released
+    when the process dies, so open segments that aren't locked are replayed too."""
+
+    def __init__(self, directory, segment_size):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._path = None
+        self._file = None
+        self._mmap = None
+        self._offset = 0
+
+    def append(self, args, kwargs, queue=None):
+        record = _encode_record(args, kwargs, queue)
+        size = HEADER.size + len(record)
+        if size > self.segment_size:
+            raise ValueError("Ingress event is larger than a spool segment")
+        with self._lock:
+            if self._mmap is None or self._offset + size > self.segment_size:
+                self._seal()
+                self._open()
+            # The length is written last, so that a record is only read once it's
+            # complete, even if the process dies while writing it
+            self._mmap[self._offset + HEADER.size : self._offset + size] = record
+            HEADER.pack_into(self._mmap, self._offset, len(record))
+            self._offset += size
+
+    def seal(self):
+        """Closes this process's segment, making it available for replay."""
+        if self._mmap is None:
+            return
+        with self._lock:
+            self._seal()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = os.path.join(self.directory, f"{time_ns():020d}-{os.getpid()}")
+        # The segment is only named as open once it's locked, so that it's never
+        # mistaken for the segment of a process that died
+        self._file = open(name + NEW_SUFFIX, "w+b")
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._path = name + OPEN_SUFFIX
+        os.rename(name + NEW_SUFFIX, self._path)
+        self._file.truncate(self.segment_size)
+        self._mmap = mmap.mmap(self._file.fileno(), self.segment_size)
+        self._offset = 0
+
+    def _seal(self):
+        if self._mmap is None:
+            return
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.truncate(self._offset)
+        # Renamed before the lock is released, so it isn't replayed as an open segment
+        os.rename(self._path, self._path[: -len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        self._file.close()
+        self._path = self._file = self._mmap = None
+
+    def get_segments(self):
+        """Returns the segments that can be replayed, oldest first: those that were
+        sealed, and those whose process died before it could seal them."""
+        if not os.path.isdir(self.directory):
+            return []
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(OPEN_SUFFIX):
+                if _is_locked(os.path.join(self.directory, name)):
+                    continue
+            elif not name.endswith(SEALED_SUFFIX):
+                continue
+            segments.append(os.path.join(self.directory, name))
+        return sorted(segments, key=os.path.basename)
+
+    def stats(self):
+        segments = self.get_segments()
+        return {
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(segment) for segment in segments),
+        }
+
+    def replay(self, send_events, batch_size=500):
+        """Hands spooled events to `send_events` in order and in batches, deleting
+        each segment once it's replayed. Progress within a segment is checkpointed
+        after every batch, so a failed replay resumes where it stopped. Yields the
+        size of each replayed batch."""
+        for path in self.get_segments():
+            checkpoint_path = path + CHECKPOINT_SUFFIX
+            offset = 0
+            if os.path.exists(checkpoint_path):
+                with open(checkpoint_path) as f:
+                    offset = int(f.read() or 0)
+            batch = []
+            for end, record in _read_records(path, offset):
+                try:
+                    batch.append(_decode_record(record))
+                except (ValueError, TypeError) as e:
+                    log.warning("Skipping unreadable spool record in %s: %s", path, e)
+                    continue
+                if len(batch) >= batch_size:
+                    send_events(batch)
+                    self._checkpoint(checkpoint_path, end)
+                    yield len(batch)
+                    batch = []
+            if batch:
+                send_events(batch)
+            os.remove(path)
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            if batch:
+                yield len(batch)
+
+    def _checkpoint(self, checkpoint_path, offset):
+        with open(checkpoint_path + ".tmp", "w") as f:
+            f.write(str(offset))
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+_spool = None
+
+
+def get_spool():
+    """Returns this process's spool, or None if spooling is disabled."""
+    global _spool
+    if not settings.INGRESS_SPOOL_DIR:
+        return None
+    if _spool is None:
+        _spool = Spool(settings.INGRESS_SPOOL_DIR, settings.INGRESS_SPOOL_SEGMENT_SIZE)
+        atexit.register(_spool.seal)
+    return _spool
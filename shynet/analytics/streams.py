@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import socket
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+ENCODING_VERSION = 1
+CONSUMER_GROUP = "shynet"
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.INGRESS_STREAM_URL)
+    return _client
+
+
+def get_stream_name(queue=None):
+    """Returns the stream that holds ingress events, with one stream per partition
+    queue when ingestion is partitioned."""
+    if queue is None:
+        return settings.INGRESS_STREAM_NAME
+    return f"{settings.INGRESS_STREAM_NAME}.{queue}"
+
+
+def encode_event(args, kwargs):
+    """Encodes the arguments of an `ingress_request` call as a compact positional
+    tuple, with the time as integer microseconds since the epoch."""
+    service_uuid, tracker, time, payload, ip, location, user_agent = args
+    return json.dumps(
+        [
+            ENCODING_VERSION,
+            str(service_uuid),
+            tracker,
+            round(time.timestamp() * 1_000_000),
+            payload,
+            ip,
+            location,
+            user_agent,
+            1 if kwargs.get("dnt") else 0,
+            kwargs.get("identifier", ""),
+        ],
+        separators=(",", ":"),
+    )
+
+
+def decode_event(data):
+    """Decodes an event encoded by `encode_event` into `ingress_request` arguments."""
+    (
+        version,
+        service_uuid,
+        tracker,
+        time,
+        payload,
+        ip,
+        location,
+        user_agent,
+        dnt,
+        identifier,
+    ) = json.loads(data)
+    if version != ENCODING_VERSION:
+        raise ValueError(f"Unsupported ingress event encoding {version}")
+    time = datetime.fromtimestamp(time / 1_000_000, tz=dt_timezone.utc)
+    return (
+        (service_uuid, tracker, time, payload, ip, location, user_agent),
+        {"dnt": bool(dnt), "identifier": identifier},
+    )
+
+
+def publish(args, kwargs, queue=None):
+    get_client().xadd(
+        get_stream_name(queue),
+        {"e": encode_event(args, kwargs)},
+        maxlen=settings.INGRESS_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+def publish_many(events):
+    """Publishes a batch of events, given as `(args, kwargs, queue)` tuples, in a
+    single round trip. The batch is published as a whole or not at all."""
+    pipeline = get_client().pipeline(transaction=True)
+    for args, kwargs, queue in events:
+        pipeline.xadd(
+            get_stream_name(queue),
+            {"e": encode_event(args, kwargs)},
+            maxlen=settings.INGRESS_STREAM_MAXLEN,
+            approximate=True,
+        )
+    pipeline.execute()
+
+
+def default_consumer_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class StreamConsumer:
+    """Reads ingress events from a stream as part of the Shynet consumer group, so
+    any number of consumers can share the stream. Events are only acknowledged
+    once they've been handled; events that a crashed consumer left pending are
+    reclaimed by the others once they've been idle for `claim_idle` milliseconds.
+    """
+
+    def __init__(
+        self,
+        handle,
+        stream,
+        consumer,
+        batch_size=100,
+        block=5000,
+        claim_idle=60000,
+        max_deliveries=5,
+        client=None,
+    ):
+        self.handle = handle
+        self.stream = stream
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.block = block
+        self.claim_idle = claim_idle
+        self.max_deliveries = max_deliveries
+        self.client = client or get_client()
+
+    def create_group(self):
+        try:
+            self.client.xgroup_create(
+                self.stream, CONSUMER_GROUP, id="0", mkstream=True
+            )
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def process(self, entries):
+        """Handles entries and acknowledges those that were handled (or that can
+        never be). Returns the number of entries handled."""
+        handled = []
+        for entry_id, fields in entries:
+            try:
+                args, kwargs = decode_event(fields[b"e"])
+            except (KeyError, ValueError) as e:
+                log.exception("Dropping malformed ingress event %s: %s", entry_id, e)
+                handled.append(entry_id)
+                continue
+            try:
+                self.handle(*args, **kwargs)
+            except Exception as e:
+                # Left pending, so that it's retried once it's reclaimed
+                log.exception(e)
+                continue
+            handled.append(entry_id)
+        if handled:
+            self.client.xack(self.stream, CONSUMER_GROUP, *handled)
+        return len(handled)
+
+    def read(self):
+        response = self.client.xreadgroup(
+            CONSUMER_GROUP,
+            self.consumer,
+            {self.stream: ">"},
+            count=self.batch_size,
+            block=self.block,
+        )
+        return response[0][1] if response else []
+
+    def reclaim(self):
+        """Claims entries that other consumers left pending for too long, dropping
+        those that have failed too often."""
+        pending = self.client.xpending_range(
+            self.stream, CONSUMER_GROUP, "-", "+", self.batch_size
+        )
+        stale = [
+            entry
+            for entry in pending
+            if entry["time_since_delivered"] >= self.claim_idle
+        ]
+        poisoned = [
+            entry["message_id"]
+            for entry in stale
+            if entry["times_delivered"] >= self.max_deliveries
+        ]
+        if poisoned:
+            log.error("Dropping %d repeatedly failing ingress events", len(poisoned))
+            self.client.xack(self.stream, CONSUMER_GROUP, *poisoned)
+        claimable = [
+            entry["message_id"]
+            for entry in stale
+            if entry["times_delivered"] < self.max_deliveries
+        ]
+        if not claimable:
+            return []
+        claimed = self.client.xclaim(
+            self.stream, CONSUMER_GROUP, self.consumer, self.claim_idle, claimable
+        )
+        # Entries that were trimmed from the stream in the meantime have no fields
+        trimmed = [entry_id for entry_id, fields in claimed if not fields]
+        if trimmed:
+            self.client.xack(self.stream, CONSUMER_GROUP, *trimmed)
+        return [entry for entry in claimed if entry[1]]
+
+    def run(self, once=False):
+        """Consumes the stream forever (or, if `once` is set, until it's drained).
+        Entries this consumer held before a restart are reclaimed like any other
+        consumer's."""
+        self.create_group()
+        while True:
+            handled = self.process(self.reclaim())
+            handled += self.process(self.read())
+            if once and handled == 0:
+                return
@@ -0,0 +1,246 @@
+import random
+from itertools import accumulate
+
+from django.db import transaction
+from django.utils import timezone
+
+from .dimensions import encode_dimensions, encode_urls
+from .importing import write_rows
+from .models import Hit, Session
+from .utils import uuid7
+
+# (weight, user agent, browser, OS, device, device type)
+USER_AGENT_PROFILES = [
+    (
+        30,
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
+        "Chrome",
+        "Windows",
+        "Other",
+        "DESKTOP",
+    ),
+    (
+        18,
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+        "Mobile Safari",
+        "iOS",
+        "iPhone",
+        "PHONE",
+    ),
+    (
+        16,
+        "Mozilla/5.0 (Linux; Android 13; SM-S911B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Mobile Safari/537.36",
+        "Chrome Mobile",
+        "Android",
+        "Samsung SM-S911B",
+        "PHONE",
+    ),
+    (
+        12,
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
+        "Safari",
+        "Mac OS X",
+        "Mac",
+        "DESKTOP",
+    ),
+    (
+        8,
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:118.0) Gecko/20100101 Firefox/118.0",
+        "Firefox",
+        "Windows",
+        "Other",
+        "DESKTOP",
+    ),
+    (
+        5,
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36 Edg/118.0.2088.46",
+        "Edge",
+        "Windows",
+        "Other",
+        "DESKTOP",
+    ),
+    (
+        4,
+        "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/118.0",
+        "Firefox",
+        "Linux",
+        "Other",
+        "DESKTOP",
+    ),
+    (
+        4,
+        "Mozilla/5.0 (iPad; CPU OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+        "Mobile Safari",
+        "iOS",
+        "iPad",
+        "TABLET",
+    ),
+    (
+        3,
+        "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+        "Googlebot",
+        "Other",
+        "Spider",
+        "ROBOT",
+    ),
+]
+
+# (weight, country, time zone, ASN)
+COUNTRY_PROFILES = [
+    (30, "US", "America/New_York", "COMCAST-7922"),
+    (12, "DE", "Europe/Berlin", "DTAG"),
+    (10, "GB", "Europe/London", "BT-UK-AS"),
+    (9, "IN", "Asia/Kolkata", "RELIANCEJIO-IN"),
+    (7, "FR", "Europe/Paris", "FREE SAS"),
+    (6, "CA", "America/Toronto", "ROGERS-COMMUNICATIONS"),
+    (5, "BR", "America/Sao_Paulo", "CLARO S.A."),
+    (5, "JP", "Asia/Tokyo", "NTT"),
+    (4, "NL", "Europe/Amsterdam", "KPN"),
+    (4, "AU", "Australia/Sydney", "TELSTRA"),
+    (8, "", "", ""),  # Unknown
+]
+
+# Relative traffic by hour of the day (UTC)
+HOURLY_WEIGHTS = [
+    3, 2, 2, 2, 2, 3, 4, 6, 8, 9, 10, 10, 10, 10, 10, 10, 9, 9, 8, 8, 7, 6, 5, 4
+]  # fmt: skip
+
+
+def zipf_cum_weights(count, exponent):
+    return list(accumulate(1 / rank**exponent for rank in range(1, count + 1)))
+
+
+class DatasetGenerator:
+    """Generates a service's sessions and hits directly, without ingesting events.
+
+    Locations and referrers follow Zipf distributions, so a few pages and sources
+    get most of the traffic and the rest form a long tail, and user agents,
+    countries and the time of day follow realistic mixes. Everything is derived
+    from the service and seed, so the same arguments always generate the same
+    dataset (and adding more data to a service takes a different seed)."""
+
+    def __init__(
+        self,
+        service,
+        seed=0,
+        locations=10000,
+        referrers=1000,
+        hits_per_session=3,
+        exponent=1.1,
+    ):
+        self.service = service
+        # Seeded per service, so that services generated alike don't share keys
+        self.rng = random.Random(f"{service.uuid}:{seed}")
+        self.hits_per_session = hits_per_session
+        self.locations = [f"https://example.com/page/{n}" for n in range(locations)]
+        self.location_weights = zipf_cum_weights(locations, exponent)
+        self.referrers = [f"https://site{n}.example.org/" for n in range(referrers)]
+        self.referrer_weights = zipf_cum_weights(referrers, exponent)
+        self.profiles = [profile[1:] for profile in USER_AGENT_PROFILES]
+        self.profile_weights = list(accumulate(p[0] for p in USER_AGENT_PROFILES))
+        self.countries = [profile[1:] for profile in COUNTRY_PROFILES]
+        self.country_weights = list(accumulate(p[0] for p in COUNTRY_PROFILES))
+        self.stats = {"sessions": 0, "hits": 0}
+
+    def generate_day(self, day, session_count):
+        """Returns the session and hit rows of a day's sessions."""
+        rng = self.rng
+        profiles = rng.choices(
+            self.profiles, cum_weights=self.profile_weights, k=session_count
+        )
+        countries = rng.choices(
+            self.countries, cum_weights=self.country_weights, k=session_count
+        )
+        hours = rng.choices(range(24), weights=HOURLY_WEIGHTS, k=session_count)
+        sessions, hits = [], []
+        for profile, country, hour in zip(profiles, countries, hours):
+            user_agent, browser, os, device, device_type = profile
+            country, time_zone, asn = country
+            start = day + timezone.timedelta(hours=hour, seconds=rng.random() * 3600)
+            session_uuid = str(uuid7(start, rng.getrandbits(74)))
+            hit_count = (
+                1
+                if device_type == "ROBOT"
+                else 1 + int(rng.expovariate(1 / max(self.hits_per_session - 1, 0.1)))
+            )
+            locations = rng.choices(
+                self.locations, cum_weights=self.location_weights, k=hit_count
+            )
+            referrer = ""
+            if rng.random() < 0.5:
+                referrer = rng.choices(
+                    self.referrers, cum_weights=self.referrer_weights
+                )[0]
+            time = start
+            for n, location in enumerate(locations):
+                heartbeats = int(rng.expovariate(1 / 4))
+                last_seen = time + timezone.timedelta(seconds=heartbeats * 5)
+                hits.append(
+                    {
+                        "session_id": session_uuid,
+                        "initial": n == 0,
+                        "start_time": time,
+                        "last_seen": last_seen,
+                        "heartbeats": heartbeats,
+                        "tracker": "JS",
+                        "location": location,
+                        "referrer": referrer if n == 0 else locations[n - 1],
+                        "load_time": round(rng.lognormvariate(6.5, 0.6)),
+                        "service_id": self.service.pk,
+                    }
+                )
+                time = last_seen + timezone.timedelta(seconds=rng.randint(1, 60))
+            sessions.append(
+                {
+                    "uuid": session_uuid,
+                    "service_id": self.service.pk,
+                    "identifier": "",
+                    "start_time": start,
+                    "last_seen": last_seen,
+                    "user_agent": user_agent,
+                    "browser": browser,
+                    "device": device,
+                    "device_type": device_type,
+                    "os": os,
+                    "ip": None,
+                    "asn": asn,
+                    "country": country,
+                    "longitude": None,
+                    "latitude": None,
+                    "time_zone": time_zone,
+                    "is_bounce": hit_count == 1,
+                }
+            )
+        return sessions, hits
+
+    def generate(self, days, sessions_per_day, batch_size=50000, end=None):
+        """Generates the sessions of the `days` days before `end` (today, by
+        default), writing them in batches of at least `batch_size` hits. Yields
+        after every batch."""
+        end = (end or timezone.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        sessions, hits = [], []
+        for n in range(days, 0, -1):
+            day = end - timezone.timedelta(days=n)
+            # Traffic varies from day to day, and is lower on weekends
+            count = sessions_per_day * self.rng.uniform(0.8, 1.2)
+            if day.weekday() >= 5:
+                count *= 0.7
+            day_sessions, day_hits = self.generate_day(day, round(count))
+            sessions += day_sessions
+            hits += day_hits
+            if len(hits) >= batch_size:
+                self.write(sessions, hits)
+                sessions, hits = [], []
+                yield
+        self.write(sessions, hits)
+        yield
+
+    def write(self, sessions, hits):
+        # Outside of the transaction, so that new dimensions are cached right away
+        sessions = [encode_dimensions(session) for session in sessions]
+        hits = [encode_urls(hit) for hit in hits]
+        with transaction.atomic():
+            write_rows(Session, sessions)
+            write_rows(Hit, hits)
+        self.stats["sessions"] += len(sessions)
+        self.stats["hits"] += len(hits)
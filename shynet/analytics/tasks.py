@@ -1,21 +1,32 @@
-import ipaddress
 import logging
-from hashlib import sha256
+from time import perf_counter, sleep
 
 import geoip2.database
 import user_agents
 from celery import shared_task
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Q
-from django.utils import timezone
+from django.db.models import F, Q
 
+from core.metrics import increment, observe
 from core.models import Service
+from core.tracing import set_attribute, span, trace
 
+from .filtering import is_ignored_ip
+from .live import record_page, record_session
 from .models import Hit, Session
+from .online import see_session
+from .overload import record_processed
+from .partitioning import get_local_table
+from .sketches import get_visitor_key, record_hit
+from .utils import TRANSIENT_ERRORS, get_association_id, is_robot, is_sampled
 
 log = logging.getLogger(__name__)
 
+# How long a worker may take to create a session that other workers wait for, in seconds
+SESSION_RESERVATION_TIMEOUT = 10
+SESSION_RESERVATION_POLL_INTERVAL = 0.05
+
 _geoip2_city_reader = None
 _geoip2_asn_reader = None
 
@@ -44,6 +55,123 @@ def _geoip2_lookup(ip):
         return {}
 
 
+def _load_session_state(session_state, service):
+    """Returns the cached state of a session, which carries everything the ingress
+    path needs to know about the session without reading it from the database."""
+    if session_state is None or isinstance(session_state, dict):
+        return session_state
+    # Legacy cache entries only hold the session's primary key
+    session = (
+        Session.objects.filter(pk=session_state, service=service)
+        .values("identifier", "is_bounce")
+        .first()
+    )
+    if session is None:
+        return None
+    return {
+        "pk": str(session_state),
+        "identified": session["identifier"] != "",
+        "bounce": session["is_bounce"],
+    }
+
+
+def _associate_session(session_cache_path, create_session):
+    """Associates a visitor with a new session, making sure that only one worker
+    creates it. Workers that lose the race wait for the winner's session instead.
+
+    Returns the session state (or None if `create_session` declined to create one)
+    and whether this worker created it."""
+    reservation_path = f"{session_cache_path}_reservation"
+    while not cache.add(reservation_path, True, timeout=SESSION_RESERVATION_TIMEOUT):
+        sleep(SESSION_RESERVATION_POLL_INTERVAL)
+        session_state = cache.get(session_cache_path)
+        if session_state is not None:
+            return session_state, False
+    try:
+        # The session may have been associated between our lookup and reservation
+        session_state = cache.get(session_cache_path)
+        if session_state is not None:
+            return session_state, False
+        session_state = create_session()
+        if session_state is not None:
+            cache.set_many(
+                {
+                    session_cache_path: session_state,
+                    f"{session_cache_path}_hits": 0,
+                },
+                timeout=settings.SESSION_MEMORY_TIMEOUT,
+            )
+        return session_state, True
+    finally:
+        cache.delete(reservation_path)
+
+
+def get_session_fields(ip, user_agent):
+    """Returns the fields of a session that are derived from the visitor's IP
+    address and user agent."""
+    with span("geoip"):
+        ip_data = (_geoip2_lookup(ip) if ip else None) or {}
+    log.debug(f"Found geoip2 data...")
+
+    with span("user_agent"):
+        ua = user_agents.parse(user_agent)
+    device_type = "OTHER"
+    if is_robot(ua):
+        device_type = "ROBOT"
+    elif ua.is_mobile:
+        device_type = "PHONE"
+    elif ua.is_tablet:
+        device_type = "TABLET"
+    elif ua.is_pc:
+        device_type = "DESKTOP"
+    return {
+        "browser": ua.browser.family or "",
+        "device": ua.device.family or ua.device.model or "",
+        "device_type": device_type,
+        "os": ua.os.family or "",
+        "asn": ip_data.get("asn") or "",
+        "country": ip_data.get("country") or "",
+        "longitude": ip_data.get("longitude"),
+        "latitude": ip_data.get("latitude"),
+        "time_zone": ip_data.get("time_zone") or "",
+    }
+
+
+def _create_session(service, time, ip, user_agent, identifier):
+    """Creates a session and returns its state, or None if the visitor is a robot
+    that the service ignores."""
+    session_fields = get_session_fields(ip, user_agent)
+    if session_fields["device_type"] == "ROBOT" and service.ignore_robots:
+        return None
+    with span("session_create"):
+        session = Session.objects.create(
+            service=service,
+            ip=ip if service.collect_ips and not settings.BLOCK_ALL_IPS else None,
+            user_agent=user_agent,
+            identifier=identifier.strip(),
+            start_time=time,
+            last_seen=time,
+            **session_fields,
+        )
+    return {
+        "pk": str(session.pk),
+        "identified": session.identifier != "",
+        "bounce": session.is_bounce,
+    }
+
+
+def _count_hit(session_cache_path, session_pk):
+    """Atomically counts a new hit of a session and returns its number of hits."""
+    hits_path = f"{session_cache_path}_hits"
+    try:
+        return cache.incr(hits_path)
+    except ValueError:
+        # The counter expired; the database already includes the new hit
+        hits = Hit.objects.filter(session_id=session_pk).count()
+        cache.set(hits_path, hits, timeout=settings.SESSION_MEMORY_TIMEOUT)
+        return hits
+
+
 @shared_task
 def ingress_request(
     service_uuid,
@@ -56,8 +184,44 @@ def ingress_request(
     dnt=False,
     identifier="",
 ):
+    start = perf_counter()
     try:
-        service = Service.objects.get(pk=service_uuid, status=Service.ACTIVE)
+        with trace("ingress_request", tracker=tracker):
+            _ingress_request(
+                service_uuid,
+                tracker,
+                time,
+                payload,
+                ip,
+                location,
+                user_agent,
+                dnt=dnt,
+                identifier=identifier,
+            )
+    finally:
+        observe(
+            "ingress_request_duration_seconds", perf_counter() - start, tracker=tracker
+        )
+
+
+def _ingress_request(
+    service_uuid,
+    tracker,
+    time,
+    payload,
+    ip,
+    location,
+    user_agent,
+    dnt=False,
+    identifier="",
+):
+    if tracker != "API":
+        # API events carry their own (possibly earlier) times, so they say nothing
+        # about how long events wait to be ingested
+        record_processed(time)
+    try:
+        with span("service"):
+            service = Service.objects.get(pk=service_uuid, status=Service.ACTIVE)
         log.debug(f"Linked to service {service}")
 
         if dnt and service.respect_dnt:
@@ -65,142 +229,197 @@ def ingress_request(
             return
 
         try:
-            remote_ip = ipaddress.ip_network(ip)
-            for ignored_network in service.get_ignored_networks():
-                if (
-                    ignored_network.version == remote_ip.version
-                    and ignored_network.supernet_of(remote_ip)
-                ):
-                    log.debug("Ignoring because of ignored IP")
-                    return
+            ignored_networks = service.get_ignored_networks()
         except ValueError as e:
             log.exception(e)
+            ignored_networks = []
+        if is_ignored_ip(ip, ignored_networks):
+            log.debug("Ignoring because of ignored IP")
+            return
+
+        association_id = get_association_id(service.pk, ip, user_agent, identifier)
+        if not is_sampled(association_id, service.sample_rate):
+            log.debug("Ignoring because the session isn't sampled")
+            return
 
         # Validate payload
         if payload.get("loadTime", 1) <= 0:
             payload["loadTime"] = None
 
-        association_id_hash = sha256()
-        association_id_hash.update(str(ip).encode("utf-8"))
-        association_id_hash.update(str(user_agent).encode("utf-8"))
-        if settings.AGGRESSIVE_HASH_SALTING:
-            association_id_hash.update(str(service.pk).encode("utf-8"))
-            association_id_hash.update(
-                str(timezone.now().date().isoformat()).encode("utf-8")
-            )
-        session_cache_path = (
-            f"session_association_{service.pk}_{association_id_hash.hexdigest()}"
+        session_cache_path = f"session_association_{service.pk}_{association_id}"
+        idempotency = payload.get("idempotency")
+        idempotency_path = f"hit_idempotency_{idempotency}"
+
+        # Fetch the session state and the idempotency entry in one round trip (or
+        # none, if this worker's partition already holds them)
+        table = get_local_table()
+        cache_keys = [session_cache_path]
+        if idempotency is not None:
+            cache_keys.append(idempotency_path)
+        with span("cache_lookup"):
+            cached = table.get_many(cache_keys) if table is not None else {}
+            missing = [key for key in cache_keys if key not in cached]
+            if missing:
+                fetched = cache.get_many(missing)
+                if table is not None:
+                    table.set_many(fetched)
+                cached.update(fetched)
+        increment(
+            "cache_requests",
+            key="session",
+            result="hit" if session_cache_path in cached else "miss",
         )
+        if idempotency is not None:
+            increment(
+                "cache_requests",
+                key="idempotency",
+                result="hit" if idempotency_path in cached else "miss",
+            )
+        with span("session_lookup"):
+            session_state = _load_session_state(cached.get(session_cache_path), service)
+        cache_updates = {}
+        if session_state is not None and not isinstance(
+            cached[session_cache_path], dict
+        ):
+            cache_updates[session_cache_path] = session_state  # Legacy cache entry
 
         # Create or update session
-        session = None
-        if cache.get(session_cache_path) is not None:
-            cache.touch(session_cache_path, settings.SESSION_MEMORY_TIMEOUT)
-            session = Session.objects.filter(
-                pk=cache.get(session_cache_path), service=service
-            ).first()
-        if session is None:
-            initial = True
-
+        initial = False
+        if session_state is None:
             log.debug("Cannot link to existing session; creating a new one...")
-
-            ip_data = _geoip2_lookup(ip)
-            log.debug(f"Found geoip2 data...")
-
-            ua = user_agents.parse(user_agent)
-            device_type = "OTHER"
-            if (
-                ua.is_bot
-                or (ua.browser.family or "").strip().lower() == "googlebot"
-                or (ua.device.family or ua.device.model or "").strip().lower()
-                == "spider"
-            ):
-                device_type = "ROBOT"
-            elif ua.is_mobile:
-                device_type = "PHONE"
-            elif ua.is_tablet:
-                device_type = "TABLET"
-            elif ua.is_pc:
-                device_type = "DESKTOP"
-            if device_type == "ROBOT" and service.ignore_robots:
+            with span("session_association"):
+                session_state, initial = _associate_session(
+                    session_cache_path,
+                    lambda: _create_session(service, time, ip, user_agent, identifier),
+                )
+            if session_state is None:
+                log.debug("Ignoring because of robot user agent")
                 return
-            session = Session.objects.create(
-                service=service,
-                ip=ip if service.collect_ips and not settings.BLOCK_ALL_IPS else None,
-                user_agent=user_agent,
-                identifier=identifier.strip(),
-                browser=ua.browser.family or "",
-                device=ua.device.family or ua.device.model or "",
-                device_type=device_type,
-                start_time=time,
-                last_seen=time,
-                os=ua.os.family or "",
-                asn=ip_data.get("asn") or "",
-                country=ip_data.get("country") or "",
-                longitude=ip_data.get("longitude"),
-                latitude=ip_data.get("latitude"),
-                time_zone=ip_data.get("time_zone") or "",
-            )
-            cache.set(
-                session_cache_path, session.pk, timeout=settings.SESSION_MEMORY_TIMEOUT
-            )
-        else:
-            initial = False
 
+        if initial:
+            session_updates = {}
+        else:
             log.debug("Updating old session with new data...")
 
             # Update last seen time
-            session.last_seen = time
-            if session.identifier == "" and identifier.strip() != "":
-                session.identifier = identifier.strip()
-            session.save()
+            session_updates = {"last_seen": time}
+            if not session_state["identified"] and identifier.strip() != "":
+                session_updates["identifier"] = identifier.strip()
+                session_state["identified"] = True
+                cache_updates[session_cache_path] = session_state
 
         # Create or update hit
-        idempotency = payload.get("idempotency")
-        idempotency_path = f"hit_idempotency_{idempotency}"
-        hit = None
+        hit_state = cached.get(idempotency_path)
+        legacy_hit_state = isinstance(hit_state, int)
+        if legacy_hit_state:
+            hit_state = {"pk": hit_state}  # Legacy cache entry
+        updated = 0
 
-        if idempotency is not None:
-            if cache.get(idempotency_path) is not None:
-                cache.touch(idempotency_path, settings.SESSION_MEMORY_TIMEOUT)
-                hit = Hit.objects.filter(
-                    pk=cache.get(idempotency_path), session=session
-                ).first()
-                if hit is not None:
-                    # There is an existing hit with an identical idempotency key. That means
-                    # this is a heartbeat.
-                    log.debug("Hit is a heartbeat; updating old hit with new data...")
-                    hit.heartbeats += 1
-                    hit.last_seen = time
-                    hit.save()
-
-        if hit is None:
+        if hit_state is not None:
+            with span("heartbeat"):
+                if table is not None and table.heartbeat(
+                    hit_state["pk"], session_state["pk"], time
+                ):
+                    updated = 1
+                else:
+                    updated = Hit.objects.filter(
+                        pk=hit_state["pk"], session_id=session_state["pk"]
+                    ).update(heartbeats=F("heartbeats") + 1, last_seen=time)
+            if updated:
+                # There is an existing hit with an identical idempotency key. That means
+                # this is a heartbeat.
+                log.debug("Hit is a heartbeat; updated old hit with new data...")
+                if legacy_hit_state:
+                    cache_updates[idempotency_path] = hit_state
+
+        set_attribute("heartbeat", bool(updated))
+        if not updated:
             log.debug("Hit is a page load; creating new hit...")
             # There is no existing hit; create a new one
-            hit = Hit.objects.create(
-                session=session,
-                initial=initial,
-                tracker=tracker,
-                # At first, location is given by the HTTP referrer. Some browsers
-                # will send the source of the script, however, so we allow JS payloads
-                # to include the location.
-                location=payload.get("location", location),
-                referrer=payload.get("referrer", ""),
-                load_time=payload.get("loadTime"),
-                start_time=time,
-                last_seen=time,
-                service=service,
-            )
+            with span("hit_create"):
+                hit = Hit.objects.create(
+                    session_id=session_state["pk"],
+                    initial=initial,
+                    tracker=tracker,
+                    # At first, location is given by the HTTP referrer. Some browsers
+                    # will send the source of the script, however, so we allow JS
+                    # payloads to include the location.
+                    location=service.normalize_url(payload.get("location", location)),
+                    referrer=service.normalize_url(payload.get("referrer", "")),
+                    load_time=payload.get("loadTime"),
+                    start_time=time,
+                    last_seen=time,
+                    service=service,
+                )
+            if table is not None:
+                table.track_hit(hit.pk, session_state["pk"])
+            if initial:
+                record_session(service.pk, time)
+            record_page(service.pk, hit.location_url_id, time)
+            with span("sketches"):
+                record_hit(
+                    service.pk,
+                    time,
+                    get_visitor_key(identifier, association_id),
+                    hit.location_url_id,
+                    hit.referrer_url_id,
+                    initial,
+                    hit.load_time,
+                )
 
-            # Recalculate whether the session is a bounce
-            session.recalculate_bounce()
+            # Recalculate whether the session is a bounce; once it isn't, it never
+            # will be again, so the hit counter is only needed until then.
+            if session_state["bounce"]:
+                with span("bounce"):
+                    if _count_hit(session_cache_path, session_state["pk"]) > 1:
+                        session_state["bounce"] = False
+                        session_updates["is_bounce"] = False
+                        cache_updates[session_cache_path] = session_state
 
             # Set idempotency (if applicable)
             if idempotency is not None:
-                cache.set(
-                    idempotency_path, hit.pk, timeout=settings.SESSION_MEMORY_TIMEOUT
-                )
+                cache_updates[idempotency_path] = {"pk": hit.pk}
+
+        if table is not None and session_updates.keys() == {"last_seen"}:
+            table.see_session(session_state["pk"], time)
+        elif session_updates:
+            if table is not None:
+                table.discard_session(session_state["pk"])
+            with span("session_update"):
+                Session.objects.filter(pk=session_state["pk"]).update(**session_updates)
+
+        with span("online"):
+            see_session(service.pk, session_state["pk"], time)
+
+        # Entries that didn't change are only touched, so that they still expire a
+        # timeout after the visitor's latest event without being written again
+        cache_touches = [session_cache_path]
+        if updated:
+            cache_touches.append(idempotency_path)
+        cache_touches = [key for key in cache_touches if key not in cache_updates]
+        with span("cache_write"):
+            if cache_updates:
+                cache.set_many(cache_updates, timeout=settings.SESSION_MEMORY_TIMEOUT)
+            for key in cache_touches:
+                cache.touch(key, settings.SESSION_MEMORY_TIMEOUT)
+        if table is not None:
+            table.set_many(cache_updates)
+            table.touch(cache_touches)
     except Exception as e:
         log.exception(e)
         print(e)
         raise e
+
+
+@shared_task
+def ingress_requests(events):
+    """Ingests a batch of events, each given as the arguments of `ingress_request`.
+    The batch fails as a whole if the database is unavailable, so that it can be
+    retried; other failures only skip the event that caused them."""
+    for args, kwargs in events:
+        try:
+            ingress_request(*args, **kwargs)
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception:
+            continue  # Already logged by `ingress_request`
@@ -0,0 +1,76 @@
+from django.test import SimpleTestCase
+
+from analytics.management.commands.benchmark_ingress import (
+    ROBOT_USER_AGENTS,
+    generate_visitors,
+    interleave,
+)
+from core.benchmarking import percentile, summarize_latencies
+
+
+class TestIngressWorkload(SimpleTestCase):
+    def test_workload_is_reproducible(self):
+        """
+        GIVEN: A seed
+        WHEN: Visitors are generated twice with it
+        THEN: They send the same events, at least as many as requested
+        """
+        visitors = generate_visitors(1000, 7, 3, 0.1, 0.05)
+
+        self.assertEqual(visitors, generate_visitors(1000, 7, 3, 0.1, 0.05))
+        self.assertGreaterEqual(sum(len(v["events"]) for v in visitors), 1000)
+
+    def test_workload_mix(self):
+        """
+        GIVEN: A mix of DNT, robots and heartbeats
+        WHEN: Visitors are generated
+        THEN: Robots only load a page, and everyone else's heartbeats follow the
+              page load they belong to
+        """
+        visitors = generate_visitors(5000, 0, 3, 0.1, 0.05)
+
+        robots = [v for v in visitors if v["user_agent"] in ROBOT_USER_AGENTS]
+        self.assertTrue(robots)
+        self.assertTrue(any(v["dnt"] for v in visitors))
+        for robot in robots:
+            self.assertEqual([kind for kind, _ in robot["events"]], ["page_load"])
+        for visitor in visitors:
+            loaded = set()
+            for kind, payload in visitor["events"]:
+                if kind == "page_load":
+                    loaded.add(payload["idempotency"])
+                else:
+                    self.assertIn(payload["idempotency"], loaded)
+
+    def test_interleave_keeps_each_visitors_order(self):
+        """
+        GIVEN: Several visitors
+        WHEN: Their events are interleaved
+        THEN: Every event is sent once, in each visitor's own order
+        """
+        visitors = generate_visitors(200, 0, 3, 0, 0)
+
+        events = interleave(visitors)
+
+        self.assertEqual(len(events), sum(len(v["events"]) for v in visitors))
+        self.assertNotEqual(events[1][0], events[0][0])
+        for visitor in visitors:
+            self.assertEqual(
+                [(kind, payload) for v, kind, payload in events if v is visitor],
+                visitor["events"],
+            )
+
+    def test_latency_percentiles(self):
+        """
+        GIVEN: Latencies of 1 to 100ms
+        WHEN: They are summarized
+        THEN: The nearest-rank percentiles are reported in milliseconds
+        """
+        latencies = [n / 1000 for n in range(100, 0, -1)]
+
+        summary = summarize_latencies(latencies)
+
+        self.assertAlmostEqual(summary["p50_ms"], 50)
+        self.assertAlmostEqual(summary["p99_ms"], 99)
+        self.assertAlmostEqual(summary["max_ms"], 100)
+        self.assertIsNone(percentile([], 50))
@@ -0,0 +1,205 @@
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from analytics import dimensions
+from analytics.dimensions import (
+    MAX_VALUE_LENGTH,
+    DimensionCache,
+    encode_dimensions,
+    get_dimension_id,
+    get_dimension_values,
+    normalize_url,
+)
+from analytics.models import Dimension, Hit, Session, Url
+from core.factories import ServiceFactory, UserFactory
+
+
+class TestDimensions(TestCase):
+    def setUp(self):
+        self.service = ServiceFactory(owner=UserFactory())
+        for name in ("_cache", "_url_cache"):
+            patcher = mock.patch.object(dimensions, name, DimensionCache(100))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sessions_share_dimensions(self):
+        """
+        GIVEN: Two sessions with the same browser, and one without a country
+        WHEN: They are created
+        THEN: They reference the same dimension, empty values reference none, and
+              the values read back as before
+        """
+        first = Session.objects.create(
+            service=self.service, browser="Firefox", country="NL"
+        )
+        second = Session.objects.create(service=self.service, browser="Firefox")
+
+        self.assertEqual(first.browser_dimension_id, second.browser_dimension_id)
+        self.assertIsNone(second.country_dimension_id)
+        self.assertEqual(Dimension.objects.filter(kind="browser").count(), 1)
+        session = Session.objects.get(pk=second.pk)
+        self.assertEqual(session.browser, "Firefox")
+        self.assertEqual(session.country, "")
+
+    def test_long_values_are_cut_off(self):
+        """
+        GIVEN: A user agent that's longer than dimensions can be
+        WHEN: A session is created with it
+        THEN: Its dimension holds the start of it
+        """
+        user_agent = "Mozilla/5.0 " + "x" * MAX_VALUE_LENGTH
+
+        session = Session.objects.create(service=self.service, user_agent=user_agent)
+
+        self.assertEqual(session.user_agent, user_agent[:MAX_VALUE_LENGTH])
+
+    def test_cached_once_committed(self):
+        """
+        GIVEN: A dimension created in a transaction that commits, and one in a
+               transaction that is rolled back
+        WHEN: Their IDs are looked up again
+        THEN: Only the committed one is served from the cache
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            committed = get_dimension_id("os", "Linux")
+        try:
+            with transaction.atomic():
+                get_dimension_id("os", "Windows")
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dimension_id("os", "Linux"), committed)
+            self.assertEqual(get_dimension_values([committed]), {committed: "Linux"})
+        self.assertIsNone(dimensions._cache.get_id("os", "Windows"))
+
+    def test_encode_dimensions(self):
+        """
+        GIVEN: Session fields as ingestion derives them
+        WHEN: They are encoded
+        THEN: The dimensions are replaced by their IDs, and other fields are kept
+        """
+        fields = {"browser": "Safari", "os": "", "device_type": "PHONE"}
+
+        encoded = encode_dimensions(fields)
+
+        self.assertEqual(
+            encoded,
+            {
+                "browser_dimension_id": Dimension.objects.get(value="Safari").pk,
+                "os_dimension_id": None,
+                "device_type": "PHONE",
+            },
+        )
+
+    def test_top_dimensions(self):
+        """
+        GIVEN: Sessions from a few countries
+        WHEN: The service's stats are computed
+        THEN: The countries are counted by dimension and labelled with their values
+        """
+        now = timezone.now()
+        for country in ("NL", "NL", "DE", ""):
+            Session.objects.create(
+                service=self.service,
+                start_time=now - timezone.timedelta(hours=1),
+                country=country,
+            )
+
+        stats = self.service.get_core_stats(now - timezone.timedelta(days=1), now)
+
+        self.assertEqual(
+            sorted(stats["countries"], key=lambda row: (-row["count"], row["country"])),
+            [
+                {"country": "NL", "count": 2},
+                {"country": "", "count": 1},
+                {"country": "DE", "count": 1},
+            ],
+        )
+
+    def test_hits_share_urls(self):
+        """
+        GIVEN: Two hits of the same page, one of them with a referrer
+        WHEN: They are created
+        THEN: They reference the same URL, which knows its host, and the other hit
+              has no referrer
+        """
+        session = Session.objects.create(service=self.service)
+        first = Hit.objects.create(
+            session=session,
+            service=self.service,
+            location="https://example.com/",
+            referrer="https://Search.example.org/?q=shynet",
+        )
+        second = Hit.objects.create(
+            session=session, service=self.service, location="https://example.com/"
+        )
+
+        self.assertEqual(first.location_url_id, second.location_url_id)
+        self.assertIsNone(second.referrer_url_id)
+        self.assertEqual(
+            Url.objects.get(pk=first.referrer_url_id).host, "search.example.org"
+        )
+        hit = Hit.objects.get(pk=first.pk)
+        self.assertEqual(hit.location, "https://example.com/")
+        self.assertEqual(hit.referrer, "https://Search.example.org/?q=shynet")
+
+    def test_normalize_url(self):
+        """
+        GIVEN: URLs with query parameters and fragments
+        WHEN: They are normalized
+        THEN: Parameters are only removed when stripping, except for the kept ones,
+              and fragments and unparseable URLs stay as they are
+        """
+        url = "https://example.com/?a=1&b=2&c#section"
+
+        self.assertEqual(normalize_url(url), url)
+        self.assertEqual(
+            normalize_url(url, True, {"b", "c"}), "https://example.com/?b=2&c=#section"
+        )
+        self.assertEqual(normalize_url(url, True), "https://example.com/#section")
+        self.assertEqual(normalize_url("http://[::1/", True), "http://[::1/")
+
+    def test_top_locations(self):
+        """
+        GIVEN: Hits of a few pages, some of them from a referrer
+        WHEN: The service's stats are computed
+        THEN: Locations and initial hits' referrers are counted by URL and
+              labelled with the URLs
+        """
+        now = timezone.now() - timezone.timedelta(hours=1)
+        session = Session.objects.create(service=self.service, start_time=now)
+        for location, referrer, initial in (
+            ("https://example.com/", "https://duck.com/", True),
+            ("https://example.com/about/", "https://example.com/", False),
+            ("https://example.com/", "", True),
+        ):
+            Hit.objects.create(
+                session=session,
+                service=self.service,
+                start_time=now,
+                location=location,
+                referrer=referrer,
+                initial=initial,
+            )
+
+        stats = self.service.get_core_stats(now - timezone.timedelta(days=1))
+
+        self.assertEqual(
+            stats["locations"],
+            [
+                {"location": "https://example.com/", "count": 2},
+                {"location": "https://example.com/about/", "count": 1},
+            ],
+        )
+        self.assertEqual(
+            sorted(stats["referrers"], key=lambda row: row["referrer"]),
+            [
+                {"referrer": "", "count": 1},
+                {"referrer": "https://duck.com/", "count": 1},
+            ],
+        )
@@ -0,0 +1,137 @@
+from unittest import mock
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from analytics.filtering import get_ingress_config, get_rejection_reason
+from analytics.utils import get_association_id
+from core.factories import ServiceFactory, UserFactory
+from core.metrics import get_counter
+from core.models import Service
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"
+ROBOT_USER_AGENT = (
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+)
+
+
+@mock.patch("analytics.views.ingress.send_ingress_event")
+class TestIngressFiltering(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = ServiceFactory(
+            owner=UserFactory(), ignore_robots=True, ignored_ips="198.51.100.0/24"
+        )
+        self.url = reverse(
+            "ingress:endpoint_pixel", kwargs={"service_uuid": self.service.uuid}
+        )
+
+    def test_rejects_before_enqueueing(self, send_ingress_event):
+        """
+        GIVEN: A service that respects DNT, ignores robots, and ignores an IP range
+        WHEN: Events that the service ignores are sent to the ingress endpoint
+        THEN: They are dropped without being enqueued, and counted by reason
+        """
+        self.client.get(self.url, HTTP_USER_AGENT=USER_AGENT, HTTP_DNT="1")
+        self.client.get(self.url, HTTP_USER_AGENT=ROBOT_USER_AGENT)
+        self.client.get(
+            self.url, HTTP_USER_AGENT=USER_AGENT, REMOTE_ADDR="198.51.100.7"
+        )
+
+        send_ingress_event.assert_not_called()
+        for reason in ("dnt", "robot", "ignored_ip"):
+            self.assertEqual(get_counter("ingress_rejected", reason=reason), 1)
+
+    def test_enqueues_other_events(self, send_ingress_event):
+        """
+        GIVEN: A service that ignores robots
+        WHEN: A browser whose user agent mentions a robot-like word sends an event
+        THEN: The event is enqueued
+        """
+        user_agent = "Mozilla/5.0 (Linux; Android 10; CUBOT X30) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.91 Mobile Safari/537.36"
+        response = self.client.get(self.url, HTTP_USER_AGENT=user_agent)
+
+        self.assertEqual(response.status_code, 200)
+        send_ingress_event.assert_called_once()
+
+    def test_archived_service(self, send_ingress_event):
+        """
+        GIVEN: An archived service
+        WHEN: An event is sent for it
+        THEN: It is dropped without being enqueued
+        """
+        Service.objects.filter(pk=self.service.pk).update(status=Service.ARCHIVED)
+
+        self.client.get(self.url, HTTP_USER_AGENT=USER_AGENT)
+
+        send_ingress_event.assert_not_called()
+        self.assertEqual(get_counter("ingress_rejected", reason="inactive"), 1)
+
+    def test_config_follows_service_changes(self, send_ingress_event):
+        """
+        GIVEN: A service whose ingress config is cached
+        WHEN: The service is changed outside the dashboard, then deleted
+        THEN: The config reflects each change
+        """
+        get_ingress_config(self.service.uuid)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.ignored_ips = ""
+            self.service.save()
+        self.assertEqual(get_ingress_config(self.service.uuid)["ignored_ips"], "")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.delete()
+        self.assertFalse(get_ingress_config(self.service.uuid)["active"])
+
+
+class TestRejectionReason(TestCase):
+    def test_dnt_only_rejected_when_respected(self):
+        """
+        GIVEN: A service that doesn't respect DNT
+        WHEN: An event with DNT set is checked
+        THEN: It isn't rejected
+        """
+        config = {
+            "active": True,
+            "respect_dnt": False,
+            "ignore_robots": False,
+            "ignored_ips": "",
+        }
+        self.assertIsNone(
+            get_rejection_reason(config, "203.0.113.1", USER_AGENT, True, "0" * 64)
+        )
+
+    def test_sampling_keeps_whole_visitors(self):
+        """
+        GIVEN: A service that records a tenth of its sessions
+        WHEN: Events of many visitors are checked, twice
+        THEN: About a tenth of visitors is kept, consistently
+        """
+        config = {
+            "active": True,
+            "respect_dnt": True,
+            "ignore_robots": False,
+            "ignored_ips": "",
+            "sample_rate": 0.1,
+        }
+        service_uuid = uuid4()
+        association_ids = [
+            get_association_id(service_uuid, f"10.0.{n // 256}.{n % 256}", USER_AGENT)
+            for n in range(1000)
+        ]
+
+        def kept():
+            return [
+                association_id
+                for association_id in association_ids
+                if get_rejection_reason(
+                    config, "203.0.113.1", USER_AGENT, False, association_id
+                )
+                is None
+            ]
+
+        self.assertEqual(kept(), kept())
+        self.assertAlmostEqual(len(kept()), 100, delta=40)
@@ -0,0 +1,97 @@
+import os
+import tempfile
+
+from django.test import TestCase
+
+from analytics.importing import LogImporter, parse_line
+from analytics.models import Hit, Session
+from core.factories import ServiceFactory, UserFactory
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"
+ROBOT_USER_AGENT = (
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+)
+
+
+def _line(time, path, user_agent=USER_AGENT, referrer="-"):
+    return (
+        f'203.0.113.1 - - [{time} +0000] "GET {path} HTTP/1.1" 200 612 '
+        f'"{referrer}" "{user_agent}"\n'
+    )
+
+
+class TestLogImporter(TestCase):
+    def setUp(self):
+        self.service = ServiceFactory(
+            owner=UserFactory(), link="https://example.com", ignore_robots=True
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.state_path = os.path.join(self.directory.name, "state.json")
+
+    def write_log(self, name, lines):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as f:
+            f.writelines(lines)
+        return path
+
+    def import_logs(self, *paths):
+        importer = LogImporter(self.service, self.service.link, self.state_path)
+        for path in paths:
+            list(importer.import_file(path, batch_size=1))
+        return importer
+
+    def test_parse_line(self):
+        """
+        GIVEN: A line of a combined-format access log
+        WHEN: It's parsed
+        THEN: The request's details are extracted
+        """
+        request = parse_line(
+            _line("01/Mar/2021:10:00:00", "/about/", referrer="https://duck.com/")
+        )
+
+        self.assertEqual(request["path"], "/about/")
+        self.assertEqual(request["referrer"], "https://duck.com/")
+        self.assertEqual(request["time"].isoformat(), "2021-03-01T10:00:00+00:00")
+        self.assertIsNone(parse_line("not a log line"))
+
+    def test_import_resumes_sessions(self):
+        """
+        GIVEN: Two consecutive logs, the second of which continues a session
+        WHEN: They're imported separately, in small batches
+        THEN: Page views are grouped into sessions across both imports, and assets
+              and robots are skipped
+        """
+        first = self.write_log(
+            "access.log.1",
+            [
+                _line("01/Mar/2021:10:00:00", "/"),
+                _line("01/Mar/2021:10:00:01", "/static/app.css"),
+                _line("01/Mar/2021:10:00:02", "/", user_agent=ROBOT_USER_AGENT),
+            ],
+        )
+        second = self.write_log(
+            "access.log",
+            [
+                _line("01/Mar/2021:10:05:00", "/about/"),
+                _line("01/Mar/2021:12:00:00", "/"),
+            ],
+        )
+
+        self.import_logs(first)
+        importer = self.import_logs(first, second)
+
+        self.assertEqual(importer.stats["lines"], 2)
+        sessions = list(Session.objects.order_by("start_time"))
+        self.assertEqual(len(sessions), 2)
+        self.assertFalse(sessions[0].is_bounce)
+        self.assertTrue(sessions[1].is_bounce)
+        self.assertEqual(
+            [(hit.location, hit.initial) for hit in Hit.objects.order_by("start_time")],
+            [
+                ("https://example.com/", True),
+                ("https://example.com/about/", False),
+                ("https://example.com/", True),
+            ],
+        )
@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import uuid
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase
+from django.utils import timezone
+
+from analytics.models import Hit, Session
+from analytics.utils import uuid7
+from core.benchmarking import get_index_sizes
+from core.factories import ServiceFactory, UserFactory
+
+
+@skipUnless(
+    connection.vendor == "sqlite",
+    "PostgreSQL's planner may prefer sequential scans of small tables",
+)
+class TestIndexUsage(TestCase):
+    def setUp(self):
+        self.service = ServiceFactory(owner=UserFactory())
+        self.end = timezone.now()
+        self.start = self.end - timezone.timedelta(days=30)
+
+    def get_hits(self):
+        return Hit.objects.filter(
+            service=self.service, start_time__gt=self.start, start_time__lt=self.end
+        )
+
+    def test_locations_use_service_index(self):
+        """
+        GIVEN: The location list's query
+        WHEN: Its plan is explained
+        THEN: It searches the hits' service and start time index
+        """
+        plan = (
+            self.get_hits()
+            .values("location_url")
+            .annotate(count=Count("pk"))
+            .order_by("-count")
+            .explain()
+        )
+
+        self.assertIn("hit_service_start_idx", plan)
+
+    def test_referrers_use_partial_index(self):
+        """
+        GIVEN: The referrer list's query, which only counts initial hits
+        WHEN: Its plan is explained
+        THEN: It searches the partial index of initial hits
+        """
+        plan = (
+            self.get_hits()
+            .filter(initial=True)
+            .values("referrer_url")
+            .annotate(count=Count("pk"))
+            .order_by("-count")
+            .explain()
+        )
+
+        self.assertIn("hit_initial_referrer_idx", plan)
+
+    def test_sessions_use_service_index(self):
+        """
+        GIVEN: The bounce count's query
+        WHEN: Its plan is explained
+        THEN: It searches the sessions' service and start time index
+        """
+        plan = (
+            Session.objects.filter(
+                service=self.service,
+                start_time__gt=self.start,
+                start_time__lt=self.end,
+                is_bounce=True,
+            )
+            .values("pk")
+            .explain()
+        )
+
+        self.assertIn("session_service_start_idx", plan)
+
+
+class TestSessionKeys(TestCase):
+    def test_keys_are_time_ordered(self):
+        """
+        GIVEN: Sessions created one after another, and a session with a random key
+        WHEN: Their keys are compared
+        THEN: New keys are version 7 UUIDs that sort by creation time, and the
+              random key still works
+        """
+        service = ServiceFactory(owner=UserFactory())
+        old = Session.objects.create(service=service, uuid=uuid.uuid4())
+        now = timezone.now()
+        keys = [
+            uuid7(now + timezone.timedelta(milliseconds=n), random_bits=2**74 - n)
+            for n in range(3)
+        ]
+        session = Session.objects.create(service=service)
+        session.refresh_from_db()
+
+        self.assertEqual(session.uuid.version, 7)
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual({key.version for key in keys}, {7})
+        self.assertEqual(Session.objects.get(pk=str(old.pk)), old)
+
+
+class TestBenchmarkWrites(TestCase):
+    def test_benchmark(self):
+        """
+        GIVEN: No data
+        WHEN: Writes are benchmarked
+        THEN: Each target's throughput is saved, and the benchmark's rows are
+              deleted afterwards
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            call_command(
+                "benchmark_writes",
+                "--sessions=20",
+                f"--output={path}",
+                stdout=StringIO(),
+            )
+            with open(path) as f:
+                results = json.load(f)
+
+        self.assertEqual(set(results["results"]), {"create", "heartbeat", "bulk"})
+        for result in results["results"].values():
+            self.assertGreaterEqual(result["rows"], 20)
+            self.assertGreater(result["rows_per_second"], 0)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Hit.objects.exists())
+
+    def test_random_keys(self):
+        """
+        GIVEN: No data
+        WHEN: Bulk writes are benchmarked with random session keys
+        THEN: The sessions were written with version 4 keys, and the growth of the
+              indexes is measured where the database can tell
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            call_command(
+                "benchmark_writes",
+                "--target=bulk",
+                "--sessions=20",
+                "--keys=uuid4",
+                "--keep",
+                f"--output={path}",
+                stdout=StringIO(),
+            )
+            with open(path) as f:
+                results = json.load(f)
+
+        self.assertEqual(results["config"]["keys"], "uuid4")
+        self.assertEqual({s.uuid.version for s in Session.objects.all()}, {4})
+        if get_index_sizes(Session):
+            self.assertGreaterEqual(results["results"]["bulk"]["index_bytes"], 0)
@@ -0,0 +1,137 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from analytics import live, online
+from analytics.dimensions import get_url_id
+from analytics.live import LiveRecorder, get_live_stats
+from analytics.online import ONLINE_WINDOW, OnlineCounter
+from analytics.sketches import clear_sketches
+from analytics.tasks import ingress_request
+from core.factories import ServiceFactory, UserFactory
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"
+
+
+class TestLiveStats(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(clear_sketches)
+        self.recorder = LiveRecorder(60)
+        for module, name, value in (
+            (live, "_recorder", self.recorder),
+            (online, "_counter", OnlineCounter(ONLINE_WINDOW)),
+        ):
+            patcher = mock.patch.object(module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = UserFactory()
+        self.service = ServiceFactory(owner=self.user)
+
+    def ingest(self, ip, location, idempotency):
+        ingress_request(
+            self.service.uuid,
+            "JS",
+            timezone.now(),
+            {"location": location, "idempotency": idempotency},
+            ip,
+            location,
+            USER_AGENT,
+        )
+
+    def test_ingested_events_are_live(self):
+        """
+        GIVEN: Two visitors who load pages, one of them twice with a heartbeat
+        WHEN: The process flushes its live stats and they're read
+        THEN: The new sessions and page loads are counted, but heartbeats aren't
+        """
+        self.ingest("203.0.113.1", "https://example.com/", "a")
+        self.ingest("203.0.113.1", "https://example.com/", "a")
+        self.ingest("203.0.113.1", "https://example.com/about/", "b")
+        self.ingest("203.0.113.2", "https://example.com/", "c")
+        self.recorder.flush()
+
+        stats = get_live_stats(self.service)
+
+        self.assertEqual(stats["online"], 2)
+        self.assertEqual(stats["sessions"], 2)
+        self.assertEqual(
+            stats["pages"],
+            [
+                {"location": "https://example.com/", "count": 2},
+                {"location": "https://example.com/about/", "count": 1},
+            ],
+        )
+
+    def test_processes_add_to_windows(self):
+        """
+        GIVEN: Two processes that recorded page loads, and a stale event
+        WHEN: Both flush
+        THEN: Their page loads are added up, and the stale event is left out
+        """
+        url = get_url_id("https://example.com/")
+        other = LiveRecorder(60)
+        self.recorder.record_page(self.service.pk, url)
+        other.record_page(self.service.pk, url)
+        other.record_session(self.service.pk)
+        other.record_session(
+            self.service.pk, timezone.now() - timezone.timedelta(hours=1)
+        )
+        self.recorder.flush()
+        other.flush()
+
+        stats = get_live_stats(self.service)
+
+        self.assertEqual(stats["sessions"], 1)
+        self.assertEqual(
+            stats["pages"], [{"location": "https://example.com/", "count": 2}]
+        )
+
+    def test_stats_are_shared(self):
+        """
+        GIVEN: Live stats that were just put together
+        WHEN: They are read again
+        THEN: They come from the cache without querying the database
+        """
+        get_live_stats(self.service)
+
+        with self.assertNumQueries(0):
+            get_live_stats(self.service)
+
+    @override_settings(LIVE_STREAM_DURATION=0)
+    def test_live_view(self):
+        """
+        GIVEN: A user who can view a service
+        WHEN: They open the service's live stream
+        THEN: It sends how often to reconnect and the latest stats, then ends
+        """
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse("dashboard:service_live", kwargs={"pk": self.service.pk})
+        )
+        content = b"".join(response.streaming_content).decode("utf-8")
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        retry, event = content.strip().split("\n\n")
+        self.assertEqual(retry, "retry: 5000")
+        self.assertTrue(event.startswith("event: stats\ndata: "))
+        self.assertEqual(json.loads(event.split("data: ")[1])["sessions"], 0)
+
+    def test_live_view_requires_permission(self):
+        """
+        GIVEN: A user who can't view a service
+        WHEN: They open the service's live stream
+        THEN: It should return 403
+        """
+        self.client.force_login(UserFactory())
+
+        response = self.client.get(
+            reverse("dashboard:service_live", kwargs={"pk": self.service.pk})
+        )
+
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from analytics.online import OnlineCounter
+
+
+class TestOnlineCounter(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.counter = OnlineCounter(10)
+        self.now = timezone.now().replace(microsecond=0)
+        # Start at the beginning of a window
+        self.now -= timezone.timedelta(seconds=self.now.timestamp() % 10)
+
+    def at(self, seconds):
+        return mock.patch(
+            "analytics.online.timezone.now",
+            return_value=self.now + timezone.timedelta(seconds=seconds),
+        )
+
+    def test_sessions_are_counted_once(self):
+        """
+        GIVEN: A session that sends heartbeats, seen by two processes
+        WHEN: The service's online sessions are counted
+        THEN: The session is counted once per service
+        """
+        other_process = OnlineCounter(10)
+        with self.at(1):
+            for counter in (self.counter, self.counter, other_process):
+                counter.see("service", "session")
+            self.counter.see("service", "other")
+            self.counter.see("other service", "session")
+
+            self.assertEqual(self.counter.count("service"), 2)
+            self.assertEqual(self.counter.count("other service"), 1)
+
+    def test_previous_window(self):
+        """
+        GIVEN: Two sessions seen in one window, and one of them in the next
+        WHEN: The online sessions are counted early in the next window, and once
+              the previous window has expired
+        THEN: The previous window's count stands in until the session that left is
+              no longer counted
+        """
+        with self.at(1):
+            self.counter.see("service", "first")
+            self.counter.see("service", "second")
+        with self.at(11):
+            self.counter.see("service", "first")
+            self.assertEqual(self.counter.count("service"), 2)
+        with self.at(21):
+            self.assertEqual(self.counter.count("service"), 1)
+        with self.at(31):
+            self.assertEqual(self.counter.count("service"), 0)
+
+    def test_old_events_are_ignored(self):
+        """
+        GIVEN: An event from before the sessions' online window
+        WHEN: Its session is seen
+        THEN: It isn't counted as online
+        """
+        with self.at(1):
+            self.counter.see(
+                "service", "session", self.now - timezone.timedelta(minutes=5)
+            )
+
+            self.assertEqual(self.counter.count("service"), 0)
@@ -0,0 +1,76 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from analytics import overload
+from analytics.health_checks import IngressLagHealthCheck
+from core.factories import ServiceFactory, UserFactory
+from core.metrics import get_counter
+
+
+@override_settings(INGRESS_LAG_THRESHOLD=60, INGRESS_SHED_SAMPLE_RATE=0)
+@mock.patch("analytics.views.ingress.send_ingress_event")
+@mock.patch.object(overload, "_shed_level", (0, overload.SHED_NOTHING))
+class TestLoadShedding(TestCase):
+    def setUp(self):
+        cache.clear()
+        service = ServiceFactory(owner=UserFactory())
+        self.script_url = reverse(
+            "ingress:endpoint_script", kwargs={"service_uuid": service.uuid}
+        )
+        self.pixel_url = reverse(
+            "ingress:endpoint_pixel", kwargs={"service_uuid": service.uuid}
+        )
+
+    def send_script(self, idempotency):
+        self.client.post(
+            self.script_url,
+            {"idempotency": idempotency},
+            content_type="application/json",
+        )
+
+    def send_events(self, stage):
+        self.send_script("heartbeat")
+        self.send_script(f"page_load_{stage}")
+        self.client.get(self.pixel_url)
+
+    def test_sheds_in_order(self, send_ingress_event):
+        """
+        GIVEN: Ingestion falling further and further behind, with a page load that
+               the workers haven't ingested yet
+        WHEN: A heartbeat of that page load, a page load and a pixel hit are sent at
+              each stage
+        THEN: Heartbeats are shed first, then pixel hits, then page loads
+        """
+        self.send_script("heartbeat")
+        sent = []
+        for age in (0, 60, 120, 240):
+            send_ingress_event.reset_mock()
+            with mock.patch.object(
+                overload, "measure_lag", return_value={"depth": None, "age": age}
+            ), mock.patch.object(overload, "_shed_level", (0, overload.SHED_NOTHING)):
+                self.send_events(age)
+            sent.append([call.args[0][1] for call in send_ingress_event.call_args_list])
+
+        self.assertEqual(sent, [["JS", "JS", "PIXEL"], ["JS", "PIXEL"], ["JS"], []])
+        self.assertEqual(get_counter("ingress_shed", kind="heartbeat"), 3)
+        self.assertEqual(get_counter("ingress_shed", kind="pixel"), 2)
+        self.assertEqual(get_counter("ingress_shed", kind="page_load"), 1)
+
+    def test_health_check_reports_lag(self, send_ingress_event):
+        """
+        GIVEN: Ingestion that is behind
+        WHEN: The ingestion lag health check runs
+        THEN: It reports a non-critical warning
+        """
+        check = IngressLagHealthCheck()
+        with mock.patch(
+            "analytics.health_checks.measure_lag",
+            return_value={"depth": 1000, "age": 90},
+        ):
+            check.run_check()
+
+        self.assertEqual(len(check.errors), 1)
+        self.assertFalse(check.critical_service)
@@ -0,0 +1,124 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import OperationalError
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from analytics import partitioning
+from analytics.models import Hit, Session
+from analytics.partitioning import HashRing
+from analytics.sketches import clear_sketches
+from analytics.tasks import ingress_request
+from core.factories import ServiceFactory, UserFactory
+
+
+class TestHashRing(TestCase):
+    def test_adding_a_partition_only_moves_its_share(self):
+        """
+        GIVEN: A hash ring with four partitions
+        WHEN: A fifth partition is added
+        THEN: Only the keys that land on the new partition move
+        """
+        keys = [f"visitor-{n}" for n in range(2000)]
+        before = HashRing([f"ingress_{n}" for n in range(4)])
+        after = HashRing([f"ingress_{n}" for n in range(5)])
+
+        moved = [
+            key for key in keys if before.get_partition(key) != after.get_partition(key)
+        ]
+
+        self.assertTrue(all(after.get_partition(key) == "ingress_4" for key in moved))
+        self.assertLess(len(moved), len(keys) / 3)
+
+
+@override_settings(
+    INGRESS_PARTITIONS=2,
+    INGRESS_PARTITION_FLUSH_INTERVAL=3600,
+    CELERY_TASK_ALWAYS_EAGER=False,
+)
+class TestPartitionedIngressRequest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(clear_sketches)
+        self.service = ServiceFactory(owner=UserFactory())
+        self.table = mock.patch.object(partitioning, "_local_table", None)
+        self.table.start()
+        self.addCleanup(self.table.stop)
+
+    def ingress(self, time):
+        ingress_request(
+            self.service.uuid,
+            "JS",
+            time,
+            {"idempotency": "a"},
+            "203.0.113.1",
+            "https://example.com/",
+            "Mozilla/5.0",
+        )
+
+    def test_heartbeats_are_written_in_bulk(self):
+        """
+        GIVEN: A partition worker
+        WHEN: A visitor sends a page load and heartbeats
+        THEN: The heartbeats are buffered until the worker flushes them
+        """
+        start = timezone.now()
+        self.ingress(start)
+        for n in range(1, 4):
+            self.ingress(start + timezone.timedelta(seconds=n))
+
+        self.assertEqual(Hit.objects.get().heartbeats, 0)
+
+        partitioning.get_local_table().flush()
+
+        hit = Hit.objects.get()
+        self.assertEqual(hit.heartbeats, 3)
+        self.assertEqual(hit.last_seen, start + timezone.timedelta(seconds=3))
+        self.assertEqual(
+            Session.objects.get().last_seen, start + timezone.timedelta(seconds=3)
+        )
+
+    def test_flush_adds_to_other_updates(self):
+        """
+        GIVEN: A partition worker with buffered heartbeats
+        WHEN: Another worker updates the same hit and session, and the buffer flushes
+        THEN: Both workers' heartbeats are counted, and the later last seen time is
+              kept
+        """
+        start = timezone.now()
+        later = start + timezone.timedelta(seconds=10)
+        self.ingress(start)
+        for n in range(1, 4):
+            self.ingress(start + timezone.timedelta(seconds=n))
+        Hit.objects.update(heartbeats=F("heartbeats") + 2, last_seen=later)
+        Session.objects.update(last_seen=later)
+
+        partitioning.get_local_table().flush()
+
+        hit = Hit.objects.get()
+        self.assertEqual(hit.heartbeats, 5)
+        self.assertEqual(hit.last_seen, later)
+        self.assertEqual(Session.objects.get().last_seen, later)
+
+    def test_failed_flush_is_retried(self):
+        """
+        GIVEN: A partition worker with buffered heartbeats
+        WHEN: Its flush fails, it buffers another heartbeat, and it flushes again
+        THEN: All of the heartbeats are written
+        """
+        start = timezone.now()
+        self.ingress(start)
+        self.ingress(start + timezone.timedelta(seconds=1))
+        table = partitioning.get_local_table()
+
+        with mock.patch.object(table, "_write", side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                table.flush()
+        self.ingress(start + timezone.timedelta(seconds=2))
+        table.flush()
+
+        hit = Hit.objects.get()
+        self.assertEqual(hit.heartbeats, 2)
+        self.assertEqual(hit.last_seen, start + timezone.timedelta(seconds=2))
@@ -0,0 +1,76 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from analytics import ratelimit
+from analytics.ratelimit import RateLimiter
+from core.factories import ServiceFactory, UserFactory
+from core.metrics import get_counter
+
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_limits_bursts_across_processes(self):
+        """
+        GIVEN: Two processes' limiters sharing a bucket of 40 tokens
+        WHEN: Both admit events for the same key, and for another key
+        THEN: 40 events are admitted for the key in total, until the bucket refills
+        """
+        limiters = [RateLimiter("test", rate=4, burst=40) for _ in range(2)]
+
+        with mock.patch("analytics.ratelimit.time", return_value=1000.0):
+            admitted = sum(
+                limiter.allow("203.0.113.1") for _ in range(50) for limiter in limiters
+            )
+            self.assertEqual(admitted, 40)
+            self.assertTrue(limiters[0].allow("203.0.113.2"))
+
+        with mock.patch("analytics.ratelimit.time", return_value=1010.0):
+            self.assertTrue(limiters[1].allow("203.0.113.1"))
+
+
+@override_settings(
+    INGRESS_RATE_LIMIT_IP=1,
+    INGRESS_RATE_LIMIT_IP_BURST=2,
+    INGRESS_RATE_LIMIT_RESPONSE="429",
+    INGRESS_MAX_BODY_SIZE=64,
+)
+@mock.patch("analytics.views.ingress.send_ingress_event")
+@mock.patch.object(ratelimit, "_limiters", {})
+class TestIngressRateLimiting(TestCase):
+    def setUp(self):
+        cache.clear()
+        service = ServiceFactory(owner=UserFactory())
+        self.url = reverse(
+            "ingress:endpoint_script", kwargs={"service_uuid": service.uuid}
+        )
+
+    def post(self, data):
+        return self.client.post(self.url, data, content_type="application/json")
+
+    def test_rate_limited_requests_are_rejected(self, send_ingress_event):
+        """
+        GIVEN: A per-IP limit of two events at once
+        WHEN: A client sends three events
+        THEN: The third is answered with a 429 and isn't enqueued
+        """
+        statuses = [self.post({"idempotency": str(n)}).status_code for n in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(send_ingress_event.call_count, 2)
+        self.assertEqual(get_counter("ingress_rejected", reason="rate_limit_ip"), 1)
+
+    def test_large_bodies_are_rejected(self, send_ingress_event):
+        """
+        GIVEN: A body size limit
+        WHEN: A client sends a larger body
+        THEN: It's rejected without being parsed
+        """
+        response = self.post({"location": "x" * 100})
+
+        self.assertEqual(response.status_code, 413)
+        send_ingress_event.assert_not_called()
@@ -0,0 +1,428 @@
+import os
+import random
+import tempfile
+from datetime import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase
+from django.utils import timezone
+
+from analytics import sketches
+from analytics.importing import LogImporter
+from analytics.models import Hit, Session, Sketch
+from analytics.sketches import (
+    DDSketch,
+    HyperLogLog,
+    KeyedDDSketch,
+    SketchBuffer,
+    TopK,
+    get_sketch,
+)
+from analytics.tasks import ingress_request
+from core.factories import ServiceFactory, UserFactory
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"
+
+
+class TestHyperLogLog(TestCase):
+    def test_count(self):
+        """
+        GIVEN: Sketches of a hundred and of ten thousand distinct values, each added
+               more than once
+        WHEN: They're counted
+        THEN: The counts are within the sketches' error bound
+        """
+        for distinct in (100, 10000):
+            sketch = HyperLogLog()
+            for _ in range(2):
+                for value in range(distinct):
+                    sketch.add(str(value))
+
+            self.assertAlmostEqual(sketch.count(), distinct, delta=distinct * 0.05)
+
+    def test_merge(self):
+        """
+        GIVEN: Two sketches of overlapping values
+        WHEN: One is merged into the other
+        THEN: It counts the values of both once
+        """
+        first, second = HyperLogLog(), HyperLogLog()
+        for value in range(3000):
+            first.add(str(value))
+        for value in range(2000, 5000):
+            second.add(str(value))
+
+        first.merge(second)
+
+        self.assertAlmostEqual(first.count(), 5000, delta=250)
+
+    def test_serialization(self):
+        """
+        GIVEN: A sketch of a few values, and one of many
+        WHEN: They're serialized and read back
+        THEN: The small sketch is stored sparsely, and both are read back unchanged
+        """
+        small, large = HyperLogLog(), HyperLogLog()
+        for value in range(10):
+            small.add(str(value))
+        for value in range(10000):
+            large.add(str(value))
+
+        self.assertEqual(len(small.to_bytes()), 1 + 10 * 3)
+        self.assertEqual(len(large.to_bytes()), 1 + HyperLogLog.REGISTERS)
+        for sketch in (small, large):
+            self.assertEqual(
+                HyperLogLog.from_bytes(sketch.to_bytes()).registers, sketch.registers
+            )
+
+
+class TestTopK(TestCase):
+    def test_exact_counts(self):
+        """
+        GIVEN: A sketch of fewer integers than it has room for
+        WHEN: Its top integers are read
+        THEN: They're counted exactly
+        """
+        sketch = TopK()
+        for item in (1, 2, 2, 3, 3, 3):
+            sketch.add(item)
+
+        self.assertEqual(sketch.top(2), [(3, 3), (2, 2)])
+        self.assertTrue(sketch.is_exact)
+
+    @mock.patch.object(TopK, "CAPACITY", 10)
+    def test_heavy_hitters(self):
+        """
+        GIVEN: A sketch with room for ten integers, of a few frequent integers
+               among many rare ones
+        WHEN: It's stored, read back and merged with another
+        THEN: The frequent integers are on top, with counts within the floor of
+              their true counts
+        """
+        sketch, other = TopK(), TopK()
+        for rare in range(1000):
+            sketch.add(rare + 100)
+            if rare % 4 == 0:
+                for frequent in (1, 2, 3):
+                    sketch.add(frequent)
+        for _ in range(50):
+            other.add(1)
+
+        sketch = TopK.from_bytes(sketch.to_bytes())
+        sketch.merge(other)
+
+        top = dict(sketch.top(3))
+        self.assertFalse(sketch.is_exact)
+        self.assertEqual(set(top), {1, 2, 3})
+        for item, count in ((1, 300), (2, 250), (3, 250)):
+            self.assertGreaterEqual(top[item], count)
+            self.assertLessEqual(top[item], count + sketch.floor)
+
+
+class TestDDSketch(TestCase):
+    def test_percentiles(self):
+        """
+        GIVEN: Sketches of load times split between two processes
+        WHEN: They're stored, read back and merged
+        THEN: The percentiles are within 2% of the true ones
+        """
+        rng = random.Random(0)
+        values = [rng.lognormvariate(6.5, 0.6) for _ in range(10000)]
+        first, second = DDSketch(), DDSketch()
+        for i, value in enumerate(values):
+            (first if i % 2 else second).add(value)
+
+        sketch = DDSketch.from_bytes(first.to_bytes())
+        sketch.merge_bytes(second.to_bytes())
+
+        values.sort()
+        for percentile, estimate in sketch.percentiles().items():
+            value = values[int(int(percentile[1:]) / 100 * (len(values) - 1))]
+            self.assertAlmostEqual(estimate, value, delta=value * 0.02)
+
+    def test_edge_values(self):
+        """
+        GIVEN: An empty sketch, and one of zeros and invalid values
+        WHEN: Their percentiles are read
+        THEN: The empty one has none, and the other's are zero
+        """
+        sketch = DDSketch()
+        self.assertIsNone(sketch.percentiles())
+
+        for value in (0, 0, -1, float("nan"), float("inf")):
+            sketch.add(value)
+
+        self.assertEqual(sketch.count, 2)
+        self.assertEqual(sketch.percentiles()["p99"], 0)
+
+    @mock.patch.object(KeyedDDSketch, "CAPACITY", 2)
+    def test_keyed(self):
+        """
+        GIVEN: A keyed sketch with room for two keys, of three keys
+        WHEN: It's stored and read back
+        THEN: The two keys with the most values are kept
+        """
+        sketch = KeyedDDSketch()
+        for key, count in ((1, 3), (2, 1), (3, 2)):
+            for _ in range(count):
+                sketch.add((key, 100))
+
+        data = sketch.to_bytes()
+
+        sketches = KeyedDDSketch.from_bytes(data).sketches
+        self.assertEqual(set(sketches), {1, 3})
+        self.assertEqual(sketches[1].count, 3)
+
+
+class TestSketches(TestCase):
+    def setUp(self):
+        self.buffer = SketchBuffer()
+        patcher = mock.patch.object(sketches, "_buffer", self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = ServiceFactory(owner=UserFactory(), link="https://example.com")
+
+    def ingest(
+        self, ip, idempotency, identifier="", path="/", referrer="", load_time=None
+    ):
+        payload = {
+            "location": f"https://example.com{path}",
+            "referrer": referrer,
+            "idempotency": idempotency,
+        }
+        if load_time is not None:
+            payload["loadTime"] = load_time
+        ingress_request(
+            self.service.uuid,
+            "JS",
+            timezone.now(),
+            payload,
+            ip,
+            f"https://example.com{path}",
+            USER_AGENT,
+            identifier=identifier,
+        )
+
+    def test_unique_visitors(self):
+        """
+        GIVEN: A visitor who loads two pages, and two visitors who share an IP
+               address but are told apart by their primary keys
+        WHEN: The buffered visitors are flushed and the service's stats are read
+        THEN: Three unique visitors are counted
+        """
+        self.ingest("203.0.113.1", "a")
+        self.ingest("203.0.113.1", "b")
+        self.ingest("203.0.113.2", "c", identifier="alice")
+        self.ingest("203.0.113.2", "d", identifier="bob")
+        self.buffer.flush()
+
+        stats = self.service.get_core_stats()
+
+        self.assertTrue(stats["visitors_estimated"])
+        self.assertEqual(stats["unique_visitors"], 3)
+        self.assertEqual(stats["compare"]["unique_visitors"], 0)
+
+    def test_unique_visitors_before_sketches(self):
+        """
+        GIVEN: Sessions of three visitors, one of them from two IP addresses, from
+               before the service had sketches
+        WHEN: The service's stats are read
+        THEN: Three unique visitors are counted exactly, since no sketches cover
+              the sessions
+        """
+        self.ingest("203.0.113.1", "a")
+        self.ingest("203.0.113.1", "b")
+        self.ingest("203.0.113.2", "c", identifier="alice")
+        self.ingest("203.0.113.3", "d", identifier="alice")
+        self.ingest("203.0.113.4", "e", identifier="bob")
+
+        stats = self.service.get_core_stats()
+
+        self.assertFalse(stats["visitors_estimated"])
+        self.assertEqual(stats["unique_visitors"], 3)
+
+    def test_top_urls(self):
+        """
+        GIVEN: Page loads of a service that hides a referrer
+        WHEN: The buffered sketches are flushed and its stats are read, estimated
+              and exactly
+        THEN: Both have the same top locations and referrers, without the hidden
+              one
+        """
+        self.service.hide_referrer_regex = r"https://hidden\.example"
+        self.service.save()
+        self.ingest("203.0.113.1", "a", referrer="https://duck.com/")
+        self.ingest("203.0.113.1", "b", path="/about/")
+        self.ingest("203.0.113.2", "c", path="/about/", referrer="https://duck.com/")
+        self.ingest("203.0.113.3", "d", referrer="https://hidden.example/")
+        self.ingest("203.0.113.4", "e")
+        self.buffer.flush()
+
+        stats = self.service.get_core_stats()
+        exact = self.service.get_core_stats(exact=True)
+
+        self.assertTrue(stats["top_estimated"])
+        self.assertFalse(exact["top_estimated"])
+        for key in ("locations", "referrers"):
+            self.assertEqual(stats[key], exact[key])
+        self.assertEqual(
+            stats["locations"],
+            [
+                {"location": "https://example.com/", "count": 3},
+                {"location": "https://example.com/about/", "count": 2},
+            ],
+        )
+        self.assertEqual(
+            stats["referrers"],
+            [
+                {"referrer": "https://duck.com/", "count": 2},
+                {"referrer": "", "count": 1},
+            ],
+        )
+
+    def test_load_time_percentiles(self):
+        """
+        GIVEN: Page loads of two pages, with load times
+        WHEN: The buffered sketches are flushed and the service's stats are read
+        THEN: The load time percentiles of the service and of each page are
+              estimated
+        """
+        for i, load_time in enumerate((100, 200, 300, 400)):
+            self.ingest(f"203.0.113.{i}", f"{i}", load_time=load_time)
+        self.ingest("203.0.113.9", "about", path="/about/", load_time=1000)
+        self.buffer.flush()
+
+        stats = self.service.get_core_stats()
+
+        percentiles = stats["load_time_percentiles"]
+        self.assertAlmostEqual(percentiles["p50"], 300, delta=6)
+        self.assertAlmostEqual(percentiles["p75"], 400, delta=8)
+        self.assertIsNone(stats["compare"]["load_time_percentiles"])
+        by_location = {
+            row["location"]: row["load_time_percentiles"] for row in stats["locations"]
+        }
+        self.assertAlmostEqual(by_location["https://example.com/"]["p50"], 200, delta=4)
+        self.assertAlmostEqual(
+            by_location["https://example.com/about/"]["p50"], 1000, delta=20
+        )
+
+    def test_top_urls_before_sketches(self):
+        """
+        GIVEN: A hit from before the service had sketches, and one since
+        WHEN: Its stats are read
+        THEN: The top locations are counted exactly, since the sketches don't
+              cover the hit
+        """
+        self.ingest("203.0.113.1", "a")
+        self.ingest("203.0.113.2", "b")
+        self.buffer.flush()
+        Hit.objects.filter(pk=Hit.objects.order_by("pk")[0].pk).update(
+            start_time=timezone.now() - timezone.timedelta(days=2)
+        )
+
+        stats = self.service.get_core_stats()
+
+        self.assertFalse(stats["top_estimated"])
+        self.assertEqual(stats["locations"][0]["count"], 2)
+
+    def test_flushes_merge(self):
+        """
+        GIVEN: Two processes that saw overlapping visitors in the same hour
+        WHEN: Both flush
+        THEN: The hour's sketch counts each visitor once
+        """
+        time = timezone.now()
+        other = SketchBuffer()
+        for visitor in ("a", "b"):
+            self.buffer.add(self.service.pk, "visitors", time, visitor)
+        for visitor in ("b", "c"):
+            other.add(self.service.pk, "visitors", time, visitor)
+
+        self.buffer.flush()
+        other.flush()
+
+        self.assertEqual(Sketch.objects.count(), 1)
+        sketch = get_sketch(
+            self.service.pk, "visitors", time, time + timezone.timedelta(hours=1)
+        )
+        self.assertEqual(sketch.count(), 3)
+
+    def test_flush_drops_deleted_services(self):
+        """
+        GIVEN: Buffered visitors of a service that's deleted before they're flushed
+        WHEN: The buffer flushes
+        THEN: The visitors are dropped rather than kept for the next flush
+        """
+        self.buffer.add(self.service.pk, "visitors", timezone.now(), "a")
+
+        # The database rejects the sketch's foreign key to the deleted service
+        with mock.patch.object(sketches, "merge_sketch", side_effect=IntegrityError):
+            self.buffer.flush()
+
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(Sketch.objects.count(), 0)
+
+    def test_import_records_visitors(self):
+        """
+        GIVEN: An access log with two visitors, one of them in two sessions
+        WHEN: It's imported
+        THEN: Two unique visitors are counted
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "access.log")
+            with open(path, "w") as f:
+                for ip, time in (
+                    ("203.0.113.1", "01/Mar/2021:10:00:00"),
+                    ("203.0.113.1", "01/Mar/2021:14:00:00"),
+                    ("203.0.113.2", "01/Mar/2021:10:05:00"),
+                ):
+                    f.write(
+                        f'{ip} - - [{time} +0000] "GET / HTTP/1.1" 200 612 "-" '
+                        f'"{USER_AGENT}"\n'
+                    )
+            importer = LogImporter(
+                self.service,
+                self.service.link,
+                os.path.join(directory, "state.json"),
+            )
+            list(importer.import_file(path))
+
+        start = datetime.fromisoformat("2021-03-01T00:00:00+00:00")
+        stats = self.service.get_core_stats(start, start + timezone.timedelta(days=1))
+        self.assertEqual(Session.objects.count(), 3)
+        self.assertEqual(stats["unique_visitors"], 2)
+
+    def test_build_sketches(self):
+        """
+        GIVEN: Sessions from before unique visitors were counted, and a sketch that
+               was recorded during ingestion since
+        WHEN: Sketches are built
+        THEN: The earlier sessions' visitors are counted, and the recorded sketch is
+              kept
+        """
+        now = timezone.now()
+        for ip, days_ago in (
+            ("203.0.113.1", 3),
+            ("203.0.113.1", 2),
+            ("203.0.113.2", 2),
+            (None, 2),
+        ):
+            Session.objects.create(
+                service=self.service,
+                ip=ip,
+                user_agent=USER_AGENT,
+                start_time=now - timezone.timedelta(days=days_ago),
+            )
+        self.buffer.add(self.service.pk, "visitors", now, "recorded")
+        self.buffer.flush()
+
+        call_command("build_sketches", service=str(self.service.pk), stdout=StringIO())
+
+        stats = self.service.get_core_stats(
+            now - timezone.timedelta(days=5), now + timezone.timedelta(hours=1)
+        )
+        self.assertEqual(stats["unique_visitors"], 4)
+        self.assertEqual(Sketch.objects.count(), 3)
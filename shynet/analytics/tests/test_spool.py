@@ -0,0 +1,174 @@
+import tempfile
+from unittest import mock
+
+import redis
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from analytics import spool
+from analytics.spool import Spool
+from analytics.transport import send_ingress_event, send_ingress_events
+
+
+def _event(n):
+    return (
+        (
+            "b9a1b4b0-3c6c-4a4c-9b5e-6d9f0c9e6a11",
+            "JS",
+            timezone.now(),
+            {"idempotency": str(n)},
+            "203.0.113.1",
+            "https://example.com/",
+            "Mozilla/5.0",
+        ),
+        {"dnt": False, "identifier": ""},
+    )
+
+
+class TestSpool(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_replays_in_order_across_segments(self):
+        """
+        GIVEN: A spool with small segments
+        WHEN: Many events are spooled and the spool is replayed
+        THEN: Every event is replayed once, in order, and the spool is emptied
+        """
+        events = [_event(n) for n in range(50)]
+        ingress_spool = Spool(self.directory.name, segment_size=1024)
+        for args, kwargs in events:
+            ingress_spool.append(args, kwargs, queue="ingress_1")
+
+        # The segment that is still being written can't be replayed yet
+        self.assertGreater(ingress_spool.stats()["segments"], 1)
+        ingress_spool.seal()
+
+        replayed = []
+        batches = list(ingress_spool.replay(replayed.extend, batch_size=7))
+
+        self.assertEqual(sum(batches), len(events))
+        self.assertEqual(
+            replayed, [(args, kwargs, "ingress_1") for args, kwargs in events]
+        )
+        self.assertEqual(ingress_spool.stats(), {"segments": 0, "bytes": 0})
+
+    def test_resumes_failed_replay(self):
+        """
+        GIVEN: A spooled segment
+        WHEN: The transport fails partway through replaying it
+        THEN: The next replay resumes after the last replayed batch
+        """
+        events = [_event(n) for n in range(10)]
+        ingress_spool = Spool(self.directory.name, segment_size=64 * 1024)
+        for args, kwargs in events:
+            ingress_spool.append(args, kwargs)
+        ingress_spool.seal()
+
+        replayed = []
+
+        def fail_after_first_batch(batch):
+            if replayed:
+                raise redis.ConnectionError()
+            replayed.extend(batch)
+
+        with self.assertRaises(redis.ConnectionError):
+            list(ingress_spool.replay(fail_after_first_batch, batch_size=4))
+        list(ingress_spool.replay(replayed.extend, batch_size=4))
+
+        self.assertEqual(
+            [args for args, _, _ in replayed], [args for args, _ in events]
+        )
+
+    def test_replays_segments_of_dead_processes(self):
+        """
+        GIVEN: A process that is writing to a segment
+        WHEN: Another process replays the spool, before and after the first one dies
+        THEN: The segment is only replayed once it's no longer locked
+        """
+        events = [_event(n) for n in range(3)]
+        writer = Spool(self.directory.name, segment_size=64 * 1024)
+        for args, kwargs in events:
+            writer.append(args, kwargs)
+        replayer = Spool(self.directory.name, segment_size=64 * 1024)
+
+        self.assertEqual(replayer.get_segments(), [])
+
+        # Dying releases the lock without sealing the segment
+        writer._mmap.close()
+        writer._file.close()
+        replayed = []
+        list(replayer.replay(replayed.extend))
+
+        self.assertEqual(
+            [args for args, _, _ in replayed], [args for args, _ in events]
+        )
+
+    def test_skips_unreadable_records(self):
+        """
+        GIVEN: A segment with an unreadable record between two events, and a torn
+               record at its end
+        WHEN: The spool is replayed
+        THEN: Both events are replayed and the segment is deleted
+        """
+        events = [_event(n) for n in range(2)]
+        ingress_spool = Spool(self.directory.name, segment_size=64 * 1024)
+        ingress_spool.append(*events[0])
+        ingress_spool.seal()
+        (path,) = ingress_spool.get_segments()
+        with open(path, "ab") as f:
+            f.write(spool.HEADER.pack(4) + b"\xff\xfe\x00\x01")
+            record = spool._encode_record(*events[1], None)
+            f.write(spool.HEADER.pack(len(record)) + record)
+            f.write(spool.HEADER.pack(1024) + record[:10])
+
+        replayed = []
+        list(ingress_spool.replay(replayed.extend))
+
+        self.assertEqual(
+            [args for args, _, _ in replayed], [args for args, _ in events]
+        )
+        self.assertEqual(ingress_spool.stats(), {"segments": 0, "bytes": 0})
+
+
+class TestSpoolFallback(TestCase):
+    def test_spools_when_transport_is_down(self):
+        """
+        GIVEN: Spooling is enabled
+        WHEN: The transport is unavailable
+        THEN: The event is spooled instead of failing the request
+        """
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            INGRESS_SPOOL_DIR=directory
+        ), mock.patch.object(spool, "_spool", None), mock.patch(
+            "analytics.transport._send", side_effect=redis.ConnectionError()
+        ):
+            args, kwargs = _event(0)
+            send_ingress_event(args, kwargs)
+            spool.get_spool().seal()
+
+            self.assertEqual(spool.get_spool().stats()["segments"], 1)
+
+    @override_settings(INGRESS_TRANSPORT="celery")
+    def test_spools_undelivered_queues(self):
+        """
+        GIVEN: Spooling is enabled
+        WHEN: A batch of events for two queues is sent, and the second queue is
+              unavailable
+        THEN: Only the second queue's events are spooled
+        """
+        events = [_event(0) + ("ingress_0",), _event(1) + ("ingress_1",)]
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            INGRESS_SPOOL_DIR=directory
+        ), mock.patch.object(spool, "_spool", None), mock.patch(
+            "analytics.transport.ingress_requests.apply_async",
+            side_effect=[None, redis.ConnectionError()],
+        ):
+            send_ingress_events(events, spool_on_failure=True)
+            spool.get_spool().seal()
+
+            replayed = []
+            list(spool.get_spool().replay(replayed.extend))
+
+        self.assertEqual(replayed, [events[1]])
@@ -0,0 +1,26 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from analytics.streams import decode_event, encode_event
+
+
+class TestStreamEncoding(TestCase):
+    def test_round_trip(self):
+        """
+        GIVEN: The arguments of an ingress request
+        WHEN: They are encoded for the stream and decoded again
+        THEN: The decoded arguments are identical
+        """
+        time = timezone.now()
+        args = (
+            "b9a1b4b0-3c6c-4a4c-9b5e-6d9f0c9e6a11",
+            "JS",
+            time,
+            {"idempotency": "a", "loadTime": 812},
+            "203.0.113.1",
+            "https://example.com/",
+            "Mozilla/5.0",
+        )
+        kwargs = {"dnt": True, "identifier": "user"}
+
+        self.assertEqual(decode_event(encode_event(args, kwargs)), (args, kwargs))
@@ -0,0 +1,68 @@
+from collections import Counter
+
+from django.test import TestCase
+from django.utils import timezone
+
+from analytics.models import Hit, Session
+from analytics.synthetic import DatasetGenerator
+from core.factories import ServiceFactory, UserFactory
+
+
+class TestDatasetGenerator(TestCase):
+    def setUp(self):
+        self.service = ServiceFactory(owner=UserFactory())
+
+    def test_generate(self):
+        """
+        GIVEN: A service
+        WHEN: A few days of synthetic data are generated in small batches
+        THEN: Sessions and hits are written for each day, consistently with each other
+        """
+        generator = DatasetGenerator(self.service, seed=1, locations=100)
+
+        batches = list(generator.generate(5, 50, batch_size=100))
+
+        self.assertGreater(len(batches), 1)
+        sessions = Session.objects.filter(service=self.service)
+        hits = Hit.objects.filter(service=self.service)
+        self.assertEqual(sessions.count(), generator.stats["sessions"])
+        self.assertEqual(hits.count(), generator.stats["hits"])
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.assertTrue(sessions.filter(start_time__lt=today).exists())
+        self.assertFalse(
+            sessions.filter(start_time__lt=today - timezone.timedelta(days=5)).exists()
+        )
+        for session in sessions[:20]:
+            session_hits = session.hit_set.order_by("start_time")
+            self.assertEqual(session.is_bounce, session_hits.count() == 1)
+            self.assertEqual(
+                [hit.initial for hit in session_hits],
+                [True] + [False] * (session_hits.count() - 1),
+            )
+
+    def test_zipf_locations(self):
+        """
+        GIVEN: Many distinct locations
+        WHEN: Hits are generated
+        THEN: The most popular locations get a disproportionate share of them
+        """
+        generator = DatasetGenerator(self.service, locations=1000)
+
+        _, hits = generator.generate_day(timezone.now(), 2000)
+
+        counts = Counter(hit["location"] for hit in hits).most_common()
+        self.assertEqual(counts[0][0], "https://example.com/page/0")
+        self.assertGreater(sum(count for _, count in counts[:10]), len(hits) / 4)
+
+    def test_reproducible(self):
+        """
+        GIVEN: A service and a seed
+        WHEN: A day is generated twice
+        THEN: The same rows are generated
+        """
+        day = timezone.now()
+
+        first = DatasetGenerator(self.service, seed=3).generate_day(day, 100)
+        second = DatasetGenerator(self.service, seed=3).generate_day(day, 100)
+
+        self.assertEqual(first, second)
@@ -0,0 +1,209 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from time import sleep
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from analytics import tasks
+from analytics.models import Hit, Session
+from analytics.sketches import clear_sketches
+from analytics.tasks import ingress_request
+from analytics.utils import get_association_id
+from core.factories import ServiceFactory, UserFactory
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"
+
+
+class TestIngressRequest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(clear_sketches)
+        self.service = ServiceFactory(owner=UserFactory())
+
+    def ingress(self, payload, identifier=""):
+        ingress_request(
+            self.service.uuid,
+            "JS",
+            timezone.now(),
+            payload,
+            "203.0.113.1",
+            "https://example.com/",
+            USER_AGENT,
+            identifier=identifier,
+        )
+
+    def test_follow_up_events_do_not_read_session(self):
+        """
+        GIVEN: A visitor with an existing session
+        WHEN: The visitor sends a heartbeat and loads another page
+        THEN: The session is updated without being read from the database
+        """
+        self.ingress({"idempotency": "a"})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.ingress({"idempotency": "a"})
+            self.ingress({"idempotency": "b"}, identifier="user")
+
+        session_reads = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT") and "analytics_session" in query["sql"]
+        ]
+        self.assertEqual(session_reads, [])
+
+        session = Session.objects.get()
+        self.assertFalse(session.is_bounce)
+        self.assertEqual(session.identifier, "user")
+        self.assertEqual(Hit.objects.count(), 2)
+        self.assertEqual(Hit.objects.get(initial=True).heartbeats, 1)
+
+    def test_query_params_are_stripped(self):
+        """
+        GIVEN: A service that strips query parameters, except for `page`
+        WHEN: A visitor loads a page with parameters from a referrer with some
+        THEN: Only the kept parameter remains in the hit's location and referrer
+        """
+        self.service.strip_query_params = True
+        self.service.kept_query_params = "page"
+        self.service.save()
+
+        self.ingress(
+            {
+                "idempotency": "a",
+                "location": "https://example.com/blog?page=2&utm_source=news#top",
+                "referrer": "https://news.example.org/item?id=1",
+            }
+        )
+
+        hit = Hit.objects.get()
+        self.assertEqual(hit.location, "https://example.com/blog?page=2#top")
+        self.assertEqual(hit.referrer, "https://news.example.org/item")
+
+    def test_single_page_load_is_bounce(self):
+        """
+        GIVEN: A new visitor
+        WHEN: The visitor loads one page and sends heartbeats
+        THEN: The session is a bounce
+        """
+        self.ingress({"idempotency": "a"})
+        self.ingress({"idempotency": "a"})
+
+        self.assertTrue(Session.objects.get().is_bounce)
+        self.assertEqual(Hit.objects.count(), 1)
+
+    @override_settings(SESSION_MEMORY_TIMEOUT=2)
+    def test_session_expiry_slides(self):
+        """
+        GIVEN: A visitor whose events are each spaced just under the session timeout
+        WHEN: The events are ingested, spanning more than the timeout in total
+        THEN: They all belong to one session
+        """
+        self.ingress({"idempotency": "a"})
+        sleep(0.6)  # Too soon for the session's cache entry to be re-set
+        self.ingress({"idempotency": "a"})
+        sleep(1.6)
+        self.ingress({"idempotency": "b"})
+
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(Hit.objects.count(), 2)
+
+    def test_legacy_cache_entries_are_rewritten(self):
+        """
+        GIVEN: A visitor whose cached session and hit are legacy primary keys
+        WHEN: The visitor sends a heartbeat
+        THEN: The heartbeat is linked to the session and hit, and the cache entries
+              are rewritten as state
+        """
+        self.ingress({"idempotency": "a"})
+        session_path = "session_association_{}_{}".format(
+            self.service.pk,
+            get_association_id(self.service.pk, "203.0.113.1", USER_AGENT),
+        )
+        session, hit = Session.objects.get(), Hit.objects.get()
+        cache.set(session_path, session.pk)
+        cache.set("hit_idempotency_a", hit.pk)
+
+        self.ingress({"idempotency": "a"})
+
+        self.assertEqual(Hit.objects.get().heartbeats, 1)
+        self.assertEqual(cache.get(session_path)["pk"], str(session.pk))
+        self.assertEqual(cache.get("hit_idempotency_a"), {"pk": hit.pk})
+
+    def test_event_without_ip(self):
+        """
+        GIVEN: A service that ignores an IP range
+        WHEN: An event without an IP is ingested
+        THEN: It's ingested, without being checked against the range
+        """
+        self.service.ignored_ips = "198.51.100.0/24"
+        self.service.save()
+
+        with mock.patch.object(tasks.log, "exception") as log_exception:
+            ingress_request(
+                self.service.uuid,
+                "API",
+                timezone.now(),
+                {"idempotency": "a"},
+                None,
+                "https://example.com/",
+                USER_AGENT,
+            )
+
+        log_exception.assert_not_called()
+        self.assertEqual(Hit.objects.count(), 1)
+
+
+class TestConcurrentIngressRequest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(clear_sketches)
+        self.service = ServiceFactory(owner=UserFactory())
+
+    def test_concurrent_events_share_one_session(self):
+        """
+        GIVEN: A new visitor
+        WHEN: Many of the visitor's events are ingested at the same time
+        THEN: Exactly one session is created, and it is not a bounce
+        """
+        workers = 8
+        barrier = Barrier(workers)
+
+        def wait_for_locks(execute, *args):
+            # In-memory SQLite databases fail on locked tables instead of waiting
+            for _ in range(100):
+                try:
+                    return execute(*args)
+                except OperationalError as e:
+                    if "locked" not in str(e):
+                        raise
+                    sleep(0.01)
+            return execute(*args)
+
+        def ingress(n):
+            barrier.wait()
+            try:
+                with connection.execute_wrapper(wait_for_locks):
+                    ingress_request(
+                        self.service.uuid,
+                        "JS",
+                        timezone.now(),
+                        {"idempotency": str(n)},
+                        "203.0.113.1",
+                        "https://example.com/",
+                        USER_AGENT,
+                    )
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(ingress, range(workers)))
+
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(Hit.objects.count(), workers)
+        self.assertEqual(Hit.objects.filter(initial=True).count(), 1)
+        self.assertFalse(Session.objects.get().is_bounce)
@@ -0,0 +1,96 @@
+import logging
+from itertools import groupby
+
+from celery.result import EagerResult
+from django.conf import settings
+
+from . import streams
+from .spool import get_spool
+from .tasks import ingress_request, ingress_requests
+from .utils import TRANSIENT_ERRORS
+
+log = logging.getLogger(__name__)
+
+
+def _raise_eager_failure(result):
+    # Tasks that run eagerly (i.e., in single-instance deployments) store their
+    # exceptions instead of raising them; the database being down should still be
+    # treated as the transport failing.
+    if isinstance(result, EagerResult) and isinstance(result.result, TRANSIENT_ERRORS):
+        raise result.result
+
+
+def _send(args, kwargs, queue):
+    if settings.INGRESS_TRANSPORT == "stream":
+        streams.publish(args, kwargs, queue=queue)
+    else:
+        _raise_eager_failure(ingress_request.apply_async(args, kwargs, queue=queue))
+
+
+def send_ingress_event(args, kwargs, queue=None):
+    """Hands the arguments of an `ingress_request` call to the workers through the
+    configured transport, spooling them to disk (if enabled) when the transport is
+    unavailable."""
+    spool = get_spool()
+    try:
+        _send(args, kwargs, queue)
+    except TRANSIENT_ERRORS as e:
+        if spool is None:
+            raise
+        log.warning("Unable to send ingress event, spooling it: %s", e)
+        spool.append(args, kwargs, queue=queue)
+    else:
+        if spool is not None:
+            # The transport is back, so anything spooled so far can be replayed
+            spool.seal()
+
+
+def send_ingress_events(events, spool_on_failure=False):
+    """Hands a batch of events, given as `(args, kwargs, queue)` tuples, to the
+    workers. Events are sent in one round trip per queue. If `spool_on_failure` is
+    set, the events that weren't delivered are spooled to disk (if enabled) when the
+    transport is unavailable."""
+    spool = get_spool() if spool_on_failure else None
+    batches = _get_batches(events)
+    for n, batch in enumerate(batches):
+        try:
+            _send_batch(batch)
+        except TRANSIENT_ERRORS as e:
+            if spool is None:
+                raise
+            undelivered = [event for batch in batches[n:] for event in batch]
+            log.warning(
+                "Unable to send %d ingress events, spooling them: %s",
+                len(undelivered),
+                e,
+            )
+            for args, kwargs, queue in undelivered:
+                spool.append(args, kwargs, queue=queue)
+            return
+    if spool is not None:
+        spool.seal()
+
+
+def _get_batches(events):
+    """Splits events into the batches that are each delivered (or not) as a whole:
+    one per queue, or just one for the stream transport."""
+    if settings.INGRESS_TRANSPORT == "stream":
+        return [events] if events else []
+    return [
+        list(queue_events)
+        for _, queue_events in groupby(
+            sorted(events, key=lambda event: event[2] or ""),
+            key=lambda event: event[2],
+        )
+    ]
+
+
+def _send_batch(events):
+    if settings.INGRESS_TRANSPORT == "stream":
+        streams.publish_many(events)
+        return
+    _raise_eager_failure(
+        ingress_requests.apply_async(
+            ([(args, kwargs) for args, kwargs, _ in events],), queue=events[0][2]
+        )
+    )
@@ -0,0 +1,69 @@
+import os
+import uuid
+from hashlib import sha256
+
+import redis
+from django.conf import settings
+from django.db import InterfaceError, OperationalError
+from django.utils import timezone
+from kombu.exceptions import OperationalError as BrokerOperationalError
+
+# Errors that mean the broker, cache or database is (temporarily) unavailable
+TRANSIENT_ERRORS = (
+    BrokerOperationalError,
+    InterfaceError,
+    OperationalError,
+    redis.ConnectionError,
+    redis.TimeoutError,
+)
+
+
+def get_association_id(service_uuid, ip, user_agent, identifier=""):
+    """Returns the hash that links a visitor's events to the same session. Events
+    without an IP (which the events API allows) are linked by their identifier."""
+    association_id_hash = sha256()
+    if not ip and identifier.strip():
+        association_id_hash.update(f"identifier:{identifier.strip()}".encode("utf-8"))
+    else:
+        association_id_hash.update(str(ip).encode("utf-8"))
+    association_id_hash.update(str(user_agent).encode("utf-8"))
+    if settings.AGGRESSIVE_HASH_SALTING:
+        association_id_hash.update(str(service_uuid).encode("utf-8"))
+        association_id_hash.update(
+            str(timezone.now().date().isoformat()).encode("utf-8")
+        )
+    return association_id_hash.hexdigest()
+
+
+def is_robot(ua):
+    """Returns whether a parsed user agent belongs to a robot."""
+    return (
+        ua.is_bot
+        or (ua.browser.family or "").strip().lower() == "googlebot"
+        or (ua.device.family or ua.device.model or "").strip().lower() == "spider"
+    )
+
+
+def is_sampled(association_id, sample_rate):
+    """Returns whether a visitor is part of a service's sample. Decided by their
+    association ID, so that whole sessions are either kept or dropped."""
+    if sample_rate >= 1:
+        return True
+    return int(association_id[:8], 16) / 0xFFFFFFFF < sample_rate
+
+
+def uuid7(time=None, random_bits=None):
+    """Returns a version 7 UUID (RFC 9562): the Unix time in milliseconds followed
+    by 74 random bits. Keys generated later sort after earlier ones, so new rows
+    are added at the end of the indexes on them instead of on random pages."""
+    milliseconds = int((time or timezone.now()).timestamp() * 1000)
+    if random_bits is None:
+        random_bits = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (milliseconds & (2**48 - 1)) << 80
+        | 0x7 << 76  # Version
+        | (random_bits >> 62 & (2**12 - 1)) << 64
+        | 0b10 << 62  # Variant
+        | random_bits & (2**62 - 1)
+    )
+    return uuid.UUID(int=value)
@@ -18,9 +18,15 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 from ipware import get_client_ip
 
+from core.metrics import increment
 from core.models import Service
 
-from ..tasks import ingress_request
+from ..filtering import reject_event
+from ..overload import get_shed_reason
+from ..partitioning import get_partition_queue
+from ..ratelimit import get_rate_limit
+from ..transport import send_ingress_event
+from ..utils import get_association_id
 
 
 def ingress(request, service_uuid, identifier, tracker, payload):
@@ -33,17 +39,42 @@ def ingress(request, service_uuid, identifier, tracker, payload):
     if gpc or dnt:
         dnt = True
 
-    ingress_request.delay(
-        service_uuid,
-        tracker,
-        time,
-        payload,
-        client_ip,
-        location,
-        user_agent,
-        dnt=dnt,
-        identifier=identifier,
+    association_id = get_association_id(service_uuid, client_ip, user_agent)
+
+    # Drop events that the worker would ignore anyway before they're enqueued
+    if reject_event(service_uuid, client_ip, user_agent, dnt, association_id):
+        return "rejected"
+
+    # Shed load while ingestion is behind
+    shed_reason = get_shed_reason(tracker, payload)
+    if shed_reason is not None:
+        increment("ingress_shed", kind=shed_reason)
+        return "shed"
+
+    # Route all of a visitor's events to the same partition (if enabled)
+    queue = get_partition_queue(association_id)
+
+    send_ingress_event(
+        (service_uuid, tracker, time, payload, client_ip, location, user_agent),
+        {"dnt": dnt, "identifier": identifier},
+        queue=queue,
     )
+    return "accepted"
+
+
+def is_rate_limited(request, service_uuid):
+    client_ip, is_routable = get_client_ip(request)
+    limit = get_rate_limit(service_uuid, client_ip)
+    if limit is None:
+        return False
+    increment("ingress_rejected", reason=f"rate_limit_{limit}")
+    return True
+
+
+def rate_limited_response():
+    resp = HttpResponse(status=429)
+    resp["Retry-After"] = "1"
+    return resp
 
 
 class ValidateServiceOriginsMixin:
@@ -51,6 +82,11 @@ class ValidateServiceOriginsMixin:
         try:
             service_uuid = self.kwargs.get("service_uuid")
             origins = cache.get(f"service_origins_{service_uuid}")
+            increment(
+                "cache_requests",
+                key="origins",
+                result="miss" if origins is None else "hit",
+            )
 
             if origins is None:
                 service = Service.objects.get(uuid=service_uuid)
@@ -90,14 +126,21 @@ class PixelView(ValidateServiceOriginsMixin, View):
     # Fallback view to serve an unobtrusive 1x1 transparent tracking pixel for browsers with
     # JavaScript disabled.
     def get(self, *args, **kwargs):
-        # Extract primary data
-        ingress(
-            self.request,
-            self.kwargs.get("service_uuid"),
-            self.kwargs.get("identifier", ""),
-            "PIXEL",
-            {},
-        )
+        rate_limited = is_rate_limited(self.request, self.kwargs.get("service_uuid"))
+        if rate_limited:
+            increment("ingress_requests", view="pixel", outcome="rate_limited")
+            if settings.INGRESS_RATE_LIMIT_RESPONSE == "429":
+                return rate_limited_response()
+        else:
+            # Extract primary data
+            outcome = ingress(
+                self.request,
+                self.kwargs.get("service_uuid"),
+                self.kwargs.get("identifier", ""),
+                "PIXEL",
+                {},
+            )
+            increment("ingress_requests", view="pixel", outcome=outcome)
 
         data = base64.b64decode(
             "R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw=="
@@ -151,14 +194,46 @@ class ScriptView(ValidateServiceOriginsMixin, View):
         return response
 
     def post(self, *args, **kwargs):
-        payload = json.loads(self.request.body)
-        ingress(
+        if is_rate_limited(self.request, self.kwargs.get("service_uuid")):
+            increment("ingress_requests", view="script", outcome="rate_limited")
+            if settings.INGRESS_RATE_LIMIT_RESPONSE == "429":
+                return rate_limited_response()
+            return self.ok_response()
+
+        # Never read more of the body than we're willing to parse
+        max_size = settings.INGRESS_MAX_BODY_SIZE
+        try:
+            content_length = int(self.request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            increment("ingress_requests", view="script", outcome="invalid")
+            return HttpResponseBadRequest()
+        body = b""
+        if content_length <= max_size:
+            body = self.request.read(max_size + 1)
+        if content_length > max_size or len(body) > max_size:
+            increment("ingress_rejected", reason="body_size")
+            increment("ingress_requests", view="script", outcome="too_large")
+            return HttpResponse(status=413)
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            increment("ingress_requests", view="script", outcome="invalid")
+            return HttpResponseBadRequest()
+
+        outcome = ingress(
             self.request,
             self.kwargs.get("service_uuid"),
             self.kwargs.get("identifier", ""),
             "JS",
             payload,
         )
+        increment("ingress_requests", view="script", outcome=outcome)
+        return self.ok_response()
+
+    def ok_response(self):
         return HttpResponse(
             json.dumps({"status": "OK"}), content_type="application/json"
         )
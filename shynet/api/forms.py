@@ -0,0 +1,31 @@
+from django import forms
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class EventForm(forms.Form):
+    """Validates a single event sent to the bulk ingestion API."""
+
+    time = forms.DateTimeField(required=False)
+    location = forms.CharField(max_length=2048)
+    referrer = forms.CharField(max_length=2048, required=False)
+    user_agent = forms.CharField(max_length=1024)
+    ip = forms.GenericIPAddressField(required=False)
+    identifier = forms.CharField(max_length=256, required=False)
+    load_time = forms.FloatField(min_value=0, required=False)
+    # Events that share an idempotency key are heartbeats of the same hit
+    idempotency = forms.CharField(max_length=128, required=False)
+
+    def clean_time(self):
+        time = self.cleaned_data["time"]
+        now = timezone.now()
+        if time is None:
+            return now
+        if time > now + timezone.timedelta(minutes=1):
+            raise forms.ValidationError(_("Events can't be in the future."))
+        if time < now - timezone.timedelta(seconds=settings.SESSION_MEMORY_TIMEOUT):
+            raise forms.ValidationError(
+                _("Events must be sent within the session memory timeout.")
+            )
+        return time
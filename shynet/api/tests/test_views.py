@@ -1,10 +1,19 @@
 import json
 from http import HTTPStatus
+from unittest import mock
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase, RequestFactory
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from analytics import online
+from analytics.filtering import get_ingress_config
+from analytics.models import Hit, Session
+from analytics.online import ONLINE_WINDOW, OnlineCounter
+from analytics.sketches import clear_sketches
 from api.views import DashboardApiView
 from core.factories import UserFactory, ServiceFactory
 from core.models import Service
@@ -77,3 +86,197 @@ class TestDashboardApiView(TestCase):
         self.assertEqual(data["services"][0]["uuid"], str(self.service_1.uuid))
         self.assertEqual(data["services"][0]["name"], str(self.service_1.name))
 
+
+class TestEventIngressApiView(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.addCleanup(clear_sketches)
+        self.user: User = UserFactory()
+        self.service: Service = ServiceFactory(owner=self.user)
+        self.url = reverse(
+            "api:service_events", kwargs={"service_uuid": self.service.uuid}
+        )
+
+    def post(self, data, user=None):
+        return self.client.post(
+            self.url,
+            json.dumps(data),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {(user or self.user).api_token}",
+        )
+
+    def test_post_with_collaborator(self):
+        """
+        GIVEN: A collaborator on a service
+        WHEN: The collaborator sends events for the service
+        THEN: It should return 403
+        """
+        collaborator = UserFactory()
+        self.service.collaborators.add(collaborator)
+
+        response = self.post({"events": []}, user=collaborator)
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+
+    def test_post_events(self):
+        """
+        GIVEN: The owner of a service
+        WHEN: The owner sends a batch of events, one of them invalid
+        THEN: The valid events are ingested, and the invalid one is reported
+        """
+        event = {
+            "location": "https://example.com/",
+            "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36",
+            "ip": "203.0.113.1",
+        }
+
+        response = self.post(
+            {
+                "events": [
+                    event,
+                    dict(event, location="https://example.com/about/", load_time=120),
+                    dict(event, ip="not an ip"),
+                ]
+            }
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+        data = json.loads(response.content)
+        self.assertEqual(data["accepted"], 2)
+        self.assertEqual(data["rejected"], [])
+        self.assertEqual([error["index"] for error in data["errors"]], [2])
+        self.assertIn("ip", data["errors"][0]["errors"])
+        self.assertEqual(Hit.objects.filter(tracker="API").count(), 2)
+        self.assertEqual(Session.objects.get().is_bounce, False)
+
+    def test_post_events_without_ip(self):
+        """
+        GIVEN: The owner of a service
+        WHEN: The owner sends events without an IP for two identified visitors
+        THEN: Each visitor's events belong to their own session
+        """
+        event = {
+            "location": "https://example.com/",
+            "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36",
+        }
+
+        response = self.post(
+            [
+                dict(event, identifier="alice"),
+                dict(event, identifier="bob"),
+                dict(event, location="https://example.com/about/", identifier="bob"),
+            ]
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+        sessions = Session.objects.order_by("identifier")
+        self.assertEqual([session.identifier for session in sessions], ["alice", "bob"])
+        self.assertEqual([session.hit_set.count() for session in sessions], [1, 2])
+
+    def test_post_reads_ingress_config_once(self):
+        """
+        GIVEN: The owner of a service
+        WHEN: The owner sends a batch of events
+        THEN: The service's ingress config is read once for the whole batch
+        """
+        event = {
+            "location": "https://example.com/",
+            "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36",
+            "ip": "203.0.113.1",
+        }
+
+        with mock.patch(
+            "api.views.get_ingress_config", wraps=get_ingress_config
+        ) as get_config:
+            response = self.post([event, event, event])
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(json.loads(response.content)["accepted"], 3)
+        get_config.assert_called_once()
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_post_events_larger_than_upload_limit(self):
+        """
+        GIVEN: Django's upload limit for request bodies
+        WHEN: The owner of a service sends a batch of events larger than the limit
+        THEN: The events are ingested, since only the events API's limit applies
+        """
+        event = {
+            "location": "https://example.com/",
+            "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36",
+            "ip": "203.0.113.1",
+        }
+
+        response = self.post([event] * 20)
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(json.loads(response.content)["accepted"], 20)
+
+    def test_post_too_large(self):
+        """
+        GIVEN: The owner of a service
+        WHEN: The owner sends a request of events larger than the events API's limit
+        THEN: It should return 413
+        """
+        with mock.patch("api.views.MAX_EVENTS_SIZE", 1024):
+            response = self.post([{"location": "https://example.com/" + "a" * 1024}])
+
+        self.assertEqual(response.status_code, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+
+class TestOnlineApiView(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.addCleanup(clear_sketches)
+        patcher = mock.patch.object(online, "_counter", OnlineCounter(ONLINE_WINDOW))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user: User = UserFactory()
+        self.service: Service = ServiceFactory(owner=self.user)
+        self.url = reverse(
+            "api:service_online", kwargs={"service_uuid": self.service.uuid}
+        )
+
+    def get(self, user):
+        return self.client.get(self.url, HTTP_AUTHORIZATION=f"Token {user.api_token}")
+
+    def test_get_online(self):
+        """
+        GIVEN: A service with a visitor who just loaded two pages
+        WHEN: A collaborator requests the number of online sessions
+        THEN: The session is counted once, without querying sessions
+        """
+        event = {
+            "location": "https://example.com/",
+            "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36",
+            "ip": "203.0.113.1",
+        }
+        self.client.post(
+            reverse("api:service_events", kwargs={"service_uuid": self.service.uuid}),
+            json.dumps([event, dict(event, location="https://example.com/about/")]),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {self.user.api_token}",
+        )
+        collaborator = UserFactory()
+        self.service.collaborators.add(collaborator)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(collaborator)
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            json.loads(response.content), {"online": 1, "estimated": False}
+        )
+        self.assertFalse(
+            any(Session._meta.db_table in query["sql"] for query in queries)
+        )
+
+    def test_get_with_other_user(self):
+        """
+        GIVEN: A user who can't view a service
+        WHEN: The user requests the number of online sessions
+        THEN: It should return 403
+        """
+        response = self.get(UserFactory())
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
@@ -4,4 +4,14 @@ from . import views
 
 urlpatterns = [
     path("dashboard/", views.DashboardApiView.as_view(), name="services"),
+    path(
+        "services/<uuid:service_uuid>/events/",
+        views.EventIngressApiView.as_view(),
+        name="service_events",
+    ),
+    path(
+        "services/<uuid:service_uuid>/online/",
+        views.OnlineApiView.as_view(),
+        name="service_online",
+    ),
 ]
@@ -1,15 +1,33 @@
+import json
 from http import HTTPStatus
 
 from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
+from analytics.filtering import count_rejection, get_ingress_config, get_rejection_reason
+from analytics.partitioning import get_partition_queue
+from analytics.transport import send_ingress_events
+from analytics.utils import TRANSIENT_ERRORS, get_association_id
 from core.models import Service
 from core.utils import is_valid_uuid
 from dashboard.mixins import DateRangeMixin
+from .forms import EventForm
 from .mixins import ApiTokenRequiredMixin
 
+# How many events can be sent in one request, and how many are handed to the
+# workers at once
+MAX_EVENTS = 10000
+EVENT_BATCH_SIZE = 500
+# How large a request of events can be, in bytes. Events are parsed from the request's
+# stream, so Django's DATA_UPLOAD_MAX_MEMORY_SIZE (which caps `request.body` at 2.5 MB
+# by default, about a thousand events) doesn't apply; this leaves 2 KB per event.
+MAX_EVENTS_SIZE = MAX_EVENTS * 2048
+
 
 class DashboardApiView(ApiTokenRequiredMixin, DateRangeMixin, View):
     def get(self, request, *args, **kwargs):
@@ -31,7 +49,7 @@ class DashboardApiView(ApiTokenRequiredMixin, DateRangeMixin, View):
                 "name": service.name,
                 "uuid": service.uuid,
                 "link": service.link,
-                "stats": service.get_core_stats(start, end),
+                "stats": service.get_core_stats(start, end, exact=request.GET.get("exact") == "true"),
             }
             for service in services
         ]
@@ -50,3 +68,93 @@ class DashboardApiView(ApiTokenRequiredMixin, DateRangeMixin, View):
                     service_data["stats"]["compare"][key] = list(value)
 
         return services_data
+
+
+class OnlineApiView(ApiTokenRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        # Cheap enough to poll: the count comes from the cache, not the database
+        service = get_object_or_404(Service, uuid=self.kwargs.get("service_uuid"))
+        if not request.user.has_perm("core.view_service", service):
+            return JsonResponse(data={}, status=HTTPStatus.FORBIDDEN)
+        return JsonResponse(data={"online": service.get_currently_online(), "estimated": service.is_sampled})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class EventIngressApiView(ApiTokenRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        service = get_object_or_404(Service, uuid=self.kwargs.get("service_uuid"))
+        if not request.user.has_perm("core.change_service", service):
+            return JsonResponse(data={}, status=HTTPStatus.FORBIDDEN)
+
+        try:
+            size = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            size = 0
+        if size > MAX_EVENTS_SIZE:
+            return JsonResponse(
+                status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                data={"error": f"Requests of events can be at most {MAX_EVENTS_SIZE} bytes."},
+            )
+        try:
+            events = json.load(request)
+        except ValueError:
+            return JsonResponse(status=HTTPStatus.BAD_REQUEST, data={"error": "Invalid JSON."})
+        if isinstance(events, dict):
+            events = events.get("events")
+        if not isinstance(events, list):
+            return JsonResponse(status=HTTPStatus.BAD_REQUEST, data={"error": "Expected a list of events."})
+        if len(events) > MAX_EVENTS:
+            return JsonResponse(
+                status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                data={"error": f"At most {MAX_EVENTS} events can be sent at once."},
+            )
+
+        config = get_ingress_config(service.uuid)
+        ingress_events = []
+        rejected = []
+        errors = []
+        for index, event in enumerate(events):
+            if not isinstance(event, dict):
+                errors.append({"index": index, "errors": {"__all__": ["Expected an object."]}})
+                continue
+            form = EventForm(event)
+            if not form.is_valid():
+                errors.append({"index": index, "errors": form.errors})
+                continue
+            event = form.cleaned_data
+            ip = event["ip"] or None
+            association_id = get_association_id(service.uuid, ip, event["user_agent"], event["identifier"])
+            reason = count_rejection(get_rejection_reason(config, ip, event["user_agent"], False, association_id))
+            if reason is not None:
+                rejected.append({"index": index, "reason": reason})
+                continue
+            ingress_events.append(
+                (
+                    (str(service.uuid), "API", event["time"], self._get_payload(event), ip, event["location"], event["user_agent"]),
+                    {"dnt": False, "identifier": event["identifier"]},
+                    get_partition_queue(association_id),
+                )
+            )
+
+        accepted = 0
+        try:
+            for start in range(0, len(ingress_events), EVENT_BATCH_SIZE):
+                batch = ingress_events[start : start + EVENT_BATCH_SIZE]
+                send_ingress_events(batch, spool_on_failure=True)
+                accepted += len(batch)
+        except TRANSIENT_ERRORS:
+            # Events that were already accepted shouldn't be sent again
+            return JsonResponse(
+                status=HTTPStatus.SERVICE_UNAVAILABLE,
+                data={"error": "Events can't be ingested right now.", "accepted": accepted},
+            )
+
+        return JsonResponse(data={"accepted": accepted, "rejected": rejected, "errors": errors})
+
+    def _get_payload(self, event):
+        payload = {"location": event["location"], "referrer": event["referrer"]}
+        if event["load_time"] is not None:
+            payload["loadTime"] = event["load_time"]
+        if event["idempotency"]:
+            payload["idempotency"] = event["idempotency"]
+        return payload
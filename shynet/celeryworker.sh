@@ -2,4 +2,6 @@
 
 # Start queue worker processes
 echo Launching Shynet queue worker...
-exec celery -A shynet worker -E --loglevel=INFO --concurrency=3
\ No newline at end of file
+exec celery -A shynet worker -E --loglevel=INFO \
+    --concurrency=${CELERY_CONCURRENCY:-3} \
+    ${CELERY_QUEUES:+--queues=$CELERY_QUEUES}
\ No newline at end of file
@@ -0,0 +1,140 @@
+import json
+import platform
+import subprocess
+import threading
+from math import ceil
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .models import Service
+
+BENCHMARK_USER_EMAIL = "benchmark@shynet.invalid"
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile of a sorted list of values."""
+    if not values:
+        return None
+    index = max(0, ceil(pct / 100 * len(values)) - 1)
+    return values[index]
+
+
+def summarize_latencies(latencies):
+    """Summarizes latencies given in seconds, in milliseconds."""
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+def _get_commit():
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                cwd=settings.BASE_DIR,
+                timeout=5,
+            ).stdout.strip()
+            or None
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def get_environment():
+    """Describes what a benchmark ran against, so runs can be told apart."""
+    return {
+        "time": timezone.now().isoformat(),
+        "commit": _get_commit(),
+        "python": platform.python_version(),
+        "database": connection.vendor,
+        "cache": settings.CACHES["default"]["BACKEND"],
+        "transport": settings.INGRESS_TRANSPORT,
+        "eager": settings.CELERY_TASK_ALWAYS_EAGER,
+    }
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+
+
+def compare_results(baseline, results, keys):
+    """Yields `(name, baseline value, value, relative change)` for each of the
+    given keys of each benchmark that both runs include."""
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not isinstance(previous, dict) or not isinstance(result, dict):
+            continue
+        for key in keys:
+            before, after = previous.get(key), result.get(key)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else None
+            yield f"{name}.{key}", before, after, change
+
+
+def get_index_sizes(model):
+    """Returns the size in bytes of each of a model's indexes, including its primary
+    key's, or an empty dict if the database can't tell."""
+    table = model._meta.db_table
+    if connection.vendor == "postgresql":
+        sql = (
+            "SELECT indexrelname, pg_relation_size(indexrelid) "
+            "FROM pg_stat_user_indexes WHERE relname = %s"
+        )
+    elif connection.vendor == "sqlite":
+        # The dbstat table is only available when SQLite was compiled with it
+        sql = (
+            "SELECT name, SUM(pgsize) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s) "
+            "GROUP BY name"
+        )
+    else:
+        return {}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            return dict(cursor.fetchall())
+    except DatabaseError:
+        return {}
+
+
+def create_benchmark_service(name, **fields):
+    """Creates a service to benchmark against, owned by a dedicated user."""
+    return Service.objects.create(name=name, owner=get_benchmark_user(), **fields)
+
+
+def get_benchmark_user():
+    """Returns the user that owns benchmark services, who can't sign in."""
+    User = get_user_model()
+    user = User.objects.filter(email=BENCHMARK_USER_EMAIL).first()
+    if user is None:
+        user = User(email=BENCHMARK_USER_EMAIL)
+        user.set_unusable_password()
+        user.save()
+    return user
+
+
+class QueryCounter:
+    """Database execute wrapper that counts the queries of every thread it's
+    installed in."""
+
+    def __init__(self):
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.queries += 1
+        return execute(sql, params, many, context)
@@ -0,0 +1,266 @@
+import atexit
+import logging
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from time import monotonic, perf_counter, sleep
+
+from celery.signals import worker_process_shutdown
+from django.core.cache import cache
+
+log = logging.getLogger(__name__)
+
+# Prefix of the exported metric names
+NAMESPACE = "shynet"
+
+# Upper bounds of the histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Every metric that's exported, with its type and description
+METRICS = {
+    "ingress_requests": ("counter", "Ingress requests, by view and outcome."),
+    "ingress_rejected": (
+        "counter",
+        "Ingress events rejected before they were enqueued, by reason.",
+    ),
+    "ingress_shed": (
+        "counter",
+        "Ingress events shed while ingestion was behind, by kind.",
+    ),
+    "ingress_request_duration_seconds": (
+        "histogram",
+        "Time taken by the workers to ingest an event, by tracker.",
+    ),
+    "cache_requests": (
+        "counter",
+        "Lookups of cached session, idempotency and origins keys, by result.",
+    ),
+    "dashboard_requests": ("counter", "Dashboard requests, by view."),
+    "dashboard_db_queries": (
+        "counter",
+        "Database queries made by dashboard requests, by view.",
+    ),
+    "dashboard_db_duration_seconds": (
+        "histogram",
+        "Time dashboard requests spent in database queries, by view.",
+    ),
+    "service_stats_duration_seconds": (
+        "histogram",
+        "Time taken to compute a service's core stats, by service.",
+    ),
+}
+
+# The cache key of the set of series that have been recorded (by any process)
+SERIES_KEY = "metric_series"
+
+# How often each process writes what it recorded to the cache, in seconds
+FLUSH_INTERVAL = 1
+# How often each process makes sure its series are registered, in seconds
+REGISTER_INTERVAL = 60
+
+
+def _get_key(name, labels):
+    label_string = ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+    return f"metric_{name}{{{label_string}}}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound is None else repr(float(bound))
+
+
+def _get_bucket_key(name, labels, bound):
+    return _get_key(f"{name}_bucket", dict(labels, le=_format_bound(bound)))
+
+
+def _incr(key, amount):
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # The counter doesn't exist yet (or was evicted)
+        if not cache.add(key, amount, timeout=None):
+            cache.incr(key, amount)
+
+
+class MetricsBuffer:
+    """Process-local buffer of recorded metrics.
+
+    Metrics are shared by all processes (web and worker alike) by way of the cache,
+    whose increments are atomic. So that recording a metric never waits on the
+    cache, increments are summed locally and written by a background thread once
+    every `FLUSH_INTERVAL` seconds."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self._pending = defaultdict(int)
+        self._series = set()
+        self._registered_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, key, amount, series):
+        with self._lock:
+            self._pending[key] += amount
+            if series not in self._series:
+                self._series.add(series)
+                self._registered_at = None
+        if self._flusher is None:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="metrics-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception(e)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(int)
+                register = (
+                    self._registered_at is None
+                    or monotonic() - self._registered_at > REGISTER_INTERVAL
+                )
+                series = set(self._series)
+            for key, amount in pending.items():
+                _incr(key, amount)
+            if register and series:
+                self._register(series)
+
+    def _register(self, series):
+        # Concurrent registrations can overwrite each other (as can evictions), so
+        # every process periodically makes sure that its series are still there
+        registered = cache.get(SERIES_KEY) or set()
+        if not series <= registered:
+            cache.set(SERIES_KEY, registered | series, timeout=None)
+        with self._lock:
+            self._registered_at = monotonic()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        # Forked processes (such as web and Celery workers) start over, as their
+        # parent flushes what it recorded itself
+        if _buffer is None or _buffer.pid != os.getpid():
+            _buffer = MetricsBuffer()
+        return _buffer
+
+
+def _get_series(name, labels):
+    return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+
+def increment(name, amount=1, **labels):
+    """Increments a counter that's shared by all processes (by way of the cache)."""
+    get_buffer().add(_get_key(name, labels), amount, _get_series(name, labels))
+
+
+def observe(name, value, **labels):
+    """Records an observation of a histogram, such as a duration in seconds."""
+    index = bisect_left(DURATION_BUCKETS, value)
+    bound = DURATION_BUCKETS[index] if index < len(DURATION_BUCKETS) else None
+    buffer = get_buffer()
+    series = _get_series(name, labels)
+    buffer.add(_get_bucket_key(name, labels, bound), 1, series)
+    # Sums are kept in microseconds, as the cache can only increment integers
+    buffer.add(_get_key(f"{name}_sum", labels), round(value * 1_000_000), series)
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observes how long the block takes in the histogram `name`."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, perf_counter() - start, **labels)
+
+
+def flush():
+    if _buffer is not None and _buffer.pid == os.getpid():
+        _buffer.flush()
+
+
+def get_counter(name, **labels):
+    flush()
+    return cache.get(_get_key(name, labels), 0)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def render_metrics():
+    """Renders every process's metrics in the Prometheus text exposition format."""
+    flush()
+    series_by_name = defaultdict(list)
+    for name, labels in sorted(cache.get(SERIES_KEY) or set()):
+        if name in METRICS:
+            series_by_name[name].append(labels)
+
+    keys = []
+    for name, series in series_by_name.items():
+        for labels in series:
+            if METRICS[name][0] == "counter":
+                keys.append(_get_key(name, dict(labels)))
+                continue
+            for bound in DURATION_BUCKETS + (None,):
+                keys.append(_get_bucket_key(name, dict(labels), bound))
+            keys.append(_get_key(f"{name}_sum", dict(labels)))
+    values = cache.get_many(keys)
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        if name not in series_by_name:
+            continue
+        metric = f"{NAMESPACE}_{name}"
+        if kind == "counter":
+            metric += "_total"
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for labels in series_by_name[name]:
+            if kind == "counter":
+                value = values.get(_get_key(name, dict(labels)), 0)
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+                continue
+            count = 0
+            for bound in DURATION_BUCKETS + (None,):
+                count += values.get(_get_bucket_key(name, dict(labels), bound), 0)
+                bucket_labels = labels + (("le", _format_bound(bound)),)
+                lines.append(f"{metric}_bucket{_format_labels(bucket_labels)} {count}")
+            total = values.get(_get_key(f"{name}_sum", dict(labels)), 0) / 1_000_000
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+atexit.register(flush)
+
+
+@worker_process_shutdown.connect
+def _flush_on_shutdown(**kwargs):
+    flush()
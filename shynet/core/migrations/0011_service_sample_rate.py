@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:48
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_auto_20220624_0744"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="service",
+            name="sample_rate",
+            field=models.FloatField(
+                default=1,
+                validators=[
+                    django.core.validators.MinValueValidator(0.001),
+                    django.core.validators.MaxValueValidator(1),
+                ],
+                verbose_name="Sample rate",
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_service_sample_rate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="service",
+            name="strip_query_params",
+            field=models.BooleanField(default=False, verbose_name="Strip query params"),
+        ),
+        migrations.AddField(
+            model_name="service",
+            name="kept_query_params",
+            field=models.TextField(
+                blank=True, default="", verbose_name="Kept query params"
+            ),
+        ),
+    ]
@@ -8,18 +8,28 @@ from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import DatabaseError, models, transaction
 from django.db.models.functions import TruncDate, TruncHour
 from django.db.utils import NotSupportedError
 from django.shortcuts import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from analytics.dimensions import get_dimension_values, get_url_values, normalize_url
+from analytics.online import get_online_count
+from analytics.sketches import get_sketch, get_sketch_start
+
+from .metrics import timed
+from .tracing import span, trace
+
 # How long a session a needs to go without an update to no longer be considered 'active' (i.e., currently online)
 ACTIVE_USER_TIMEDELTA = timezone.timedelta(
     milliseconds=settings.SCRIPT_HEARTBEAT_FREQUENCY * 2
 )
 RESULTS_LIMIT = 300
+# How many locations' load time percentiles are shown
+LOAD_TIME_LOCATIONS = 50
 
 
 def _default_uuid():
@@ -103,9 +113,20 @@ class Service(models.Model):
         validators=[_validate_regex],
         verbose_name=_("Hide referrer regex"),
     )
+    strip_query_params = models.BooleanField(
+        default=False, verbose_name=_("Strip query params")
+    )
+    kept_query_params = models.TextField(
+        default="", blank=True, verbose_name=_("Kept query params")
+    )
     script_inject = models.TextField(
         default="", blank=True, verbose_name=_("Script inject")
     )
+    sample_rate = models.FloatField(
+        default=1,
+        validators=[MinValueValidator(0.001), MaxValueValidator(1)],
+        verbose_name=_("Sample rate"),
+    )
 
     class Meta:
         verbose_name = _("Service")
@@ -130,132 +151,322 @@ class Service(models.Model):
                 # data from causing all service pages to error
                 return re.compile(r".^")
 
+    def get_referrer_hits(self, hits):
+        """Returns the initial hits of sessions, whose referrers are the sessions'
+        referrers, without the ones that `hide_referrer_regex` hides. The regex is
+        matched by the database, from the start of the referrer like in Python, so
+        hidden referrers don't take up room in the top lists."""
+        hits = hits.filter(initial=True)
+        regex = self.get_ignored_referrer_regex()
+        if regex.pattern == r".^":
+            return hits
+        pattern = f"^(?:{regex.pattern})"
+        if self._database_accepts_regex(pattern):
+            hidden = models.Q(referrer_url__url__regex=pattern)
+        else:
+            # Databases like PostgreSQL don't support all of Python's syntax, so
+            # those patterns are matched against the referrers in Python instead
+            Url = apps.get_model("analytics", "Url")
+            referrers = Url.objects.filter(pk__in=hits.values("referrer_url"))
+            hidden = models.Q(
+                referrer_url__in=[
+                    pk
+                    for pk, url in referrers.values_list("pk", "url")
+                    if regex.match(url)
+                ]
+            )
+        if regex.match(""):
+            # Direct sessions have an empty referrer
+            hidden |= models.Q(referrer_url__isnull=True)
+        return hits.exclude(hidden)
+
+    def _database_accepts_regex(self, pattern):
+        """Returns whether the database can match a regex, by matching it against
+        this service's name."""
+        try:
+            with transaction.atomic():
+                Service.objects.filter(pk=self.pk, name__regex=pattern).exists()
+        except DatabaseError:
+            return False
+        return True
+
+    def get_kept_query_params(self):
+        return {param.strip() for param in self.kept_query_params.split(",")} - {""}
+
+    def normalize_url(self, url):
+        """Normalizes a hit's location or referrer as the service is configured to."""
+        return normalize_url(url, self.strip_query_params, self.get_kept_query_params())
+
+    @property
+    def is_sampled(self):
+        return self.sample_rate < 1
+
+    def scale_count(self, count):
+        """Estimates the true count from a count of sampled sessions (or their
+        hits)."""
+        if not self.is_sampled:
+            return count
+        return round(count / self.sample_rate)
+
+    def scale_counts(self, rows):
+        if not self.is_sampled:
+            return rows
+        return [dict(row, count=self.scale_count(row["count"])) for row in rows]
+
+    def get_currently_online(self):
+        """Returns how many sessions are online, as counted in the cache by the
+        ingress path."""
+        return self.scale_count(get_online_count(self.pk))
+
     def get_daily_stats(self):
         return self.get_core_stats(
             start_time=timezone.now() - timezone.timedelta(days=1)
         )
 
-    def get_core_stats(self, start_time=None, end_time=None):
+    def get_core_stats(self, start_time=None, end_time=None, exact=False):
         if start_time is None:
             start_time = timezone.now() - timezone.timedelta(days=30)
         if end_time is None:
             end_time = timezone.now()
 
-        main_data = self.get_relative_stats(start_time, end_time)
-        comparison_data = self.get_relative_stats(
-            start_time - (end_time - start_time), start_time
-        )
+        with timed("service_stats_duration_seconds", service=self.uuid):
+            with trace("get_core_stats", service=self.uuid):
+                main_data = self.get_relative_stats(start_time, end_time, exact)
+                comparison_data = self.get_relative_stats(
+                    start_time - (end_time - start_time), start_time, exact
+                )
         main_data["compare"] = comparison_data
 
         return main_data
 
-    def get_relative_stats(self, start_time, end_time):
+    def get_relative_stats(self, start_time, end_time, exact=False):
+        """Returns the service's stats over a time range. Unless they're `exact`, the
+        unique visitors and the top locations and referrers are estimated from
+        sketches where they cover the range."""
+        with trace("get_relative_stats", service=self.uuid):
+            return self._get_relative_stats(start_time, end_time, exact)
+
+    def _get_relative_stats(self, start_time, end_time, exact):
         Session = apps.get_model("analytics", "Session")
         Hit = apps.get_model("analytics", "Hit")
 
         tz_now = timezone.now()
 
-        currently_online = Session.objects.filter(
-            service=self, last_seen__gt=tz_now - ACTIVE_USER_TIMEDELTA
-        ).count()
+        with span("currently_online"):
+            currently_online = self.get_currently_online()
 
         sessions = Session.objects.filter(
             service=self, start_time__gt=start_time, start_time__lt=end_time
         ).order_by("-start_time")
-        session_count = sessions.count()
+        with span("session_count"):
+            session_count = sessions.count()
+
+        with span("unique_visitors"):
+            visitors_estimated = not exact and self._sketches_cover(
+                "visitors", sessions, start_time
+            )
+            if visitors_estimated:
+                unique_visitors = get_sketch(
+                    self.pk, "visitors", start_time, end_time
+                ).count()
+            else:
+                unique_visitors = self._count_unique_visitors(sessions)
 
         hits = Hit.objects.filter(
             service=self, start_time__lt=end_time, start_time__gt=start_time
         )
-        hit_count = hits.count()
+        with span("hit_count"):
+            hit_count = hits.count()
 
-        has_hits = Hit.objects.filter(service=self).exists()
+        with span("has_hits"):
+            has_hits = Hit.objects.filter(service=self).exists()
 
         bounces = sessions.filter(is_bounce=True)
-        bounce_count = bounces.count()
-
-        locations = (
-            hits.values("location")
-            .annotate(count=models.Count("location"))
-            .order_by("-count")[:RESULTS_LIMIT]
-        )
-
-        referrer_ignore = self.get_ignored_referrer_regex()
-        referrers = [
-            referrer
-            for referrer in (
-                hits.filter(initial=True)
-                .values("referrer")
-                .annotate(count=models.Count("referrer"))
-                .order_by("-count")[:RESULTS_LIMIT]
+        with span("bounce_count"):
+            bounce_count = bounces.count()
+
+        with span("locations"):
+            locations = None
+            if not exact:
+                locations = self._get_sketched_top_urls(
+                    "locations", "location", hits, start_time, end_time
+                )
+            top_estimated = locations is not None
+            if locations is None:
+                locations = self._get_top_values(
+                    hits, "location_url", "location", get_url_values
+                )
+
+        with span("referrers"):
+            referrers = None
+            if not exact:
+                referrers = self._get_sketched_top_urls(
+                    "referrers",
+                    "referrer",
+                    hits,
+                    start_time,
+                    end_time,
+                    hidden=self.get_ignored_referrer_regex(),
+                )
+            top_estimated = top_estimated or referrers is not None
+            if referrers is None:
+                referrers = self._get_top_values(
+                    self.get_referrer_hits(hits),
+                    "referrer_url",
+                    "referrer",
+                    get_url_values,
+                )
+
+        with span("countries"):
+            countries = self._get_top_values(
+                sessions, "country_dimension", "country", get_dimension_values
             )
-            if not referrer_ignore.match(referrer["referrer"])
-        ]
 
-        countries = (
-            sessions.values("country")
-            .annotate(count=models.Count("country"))
-            .order_by("-count")[:RESULTS_LIMIT]
-        )
+        with span("operating_systems"):
+            operating_systems = self._get_top_values(
+                sessions, "os_dimension", "os", get_dimension_values
+            )
 
-        operating_systems = (
-            sessions.values("os")
-            .annotate(count=models.Count("os"))
-            .order_by("-count")[:RESULTS_LIMIT]
-        )
+        with span("browsers"):
+            browsers = self._get_top_values(
+                sessions, "browser_dimension", "browser", get_dimension_values
+            )
 
-        browsers = (
-            sessions.values("browser")
-            .annotate(count=models.Count("browser"))
-            .order_by("-count")[:RESULTS_LIMIT]
-        )
+        with span("device_types"):
+            device_types = list(
+                sessions.values("device_type")
+                .annotate(count=models.Count("device_type"))
+                .order_by("-count")[:RESULTS_LIMIT]
+            )
 
-        device_types = (
-            sessions.values("device_type")
-            .annotate(count=models.Count("device_type"))
-            .order_by("-count")[:RESULTS_LIMIT]
-        )
+        with span("devices"):
+            devices = self._get_top_values(
+                sessions, "device_dimension", "device", get_dimension_values
+            )
 
-        devices = (
-            sessions.values("device")
-            .annotate(count=models.Count("device"))
-            .order_by("-count")[:RESULTS_LIMIT]
-        )
+        with span("avg_load_time"):
+            avg_load_time = hits.aggregate(load_time__avg=models.Avg("load_time"))[
+                "load_time__avg"
+            ]
 
-        avg_load_time = hits.aggregate(load_time__avg=models.Avg("load_time"))[
-            "load_time__avg"
-        ]
+        with span("load_time_percentiles"):
+            load_time_percentiles, by_location = self._get_load_time_percentiles(
+                hits, start_time, end_time
+            )
+            for row in locations:
+                if row["location"] in by_location:
+                    row["load_time_percentiles"] = by_location[row["location"]]
 
         avg_hits_per_session = hit_count / session_count if session_count > 0 else None
 
-        avg_session_duration = self._get_avg_session_duration(sessions, session_count)
+        with span("avg_session_duration"):
+            avg_session_duration = self._get_avg_session_duration(
+                sessions, session_count
+            )
 
-        chart_data, chart_tooltip_format, chart_granularity = self._get_chart_data(
-            sessions, hits, start_time, end_time, tz_now
-        )
+        with span("chart_data"):
+            chart_data, chart_tooltip_format, chart_granularity = self._get_chart_data(
+                sessions, hits, start_time, end_time, tz_now
+            )
 
         return {
             "currently_online": currently_online,
-            "session_count": session_count,
-            "hit_count": hit_count,
+            "session_count": self.scale_count(session_count),
+            "unique_visitors": self.scale_count(unique_visitors),
+            # Unique visitors are estimated from sketches
+            "visitors_estimated": visitors_estimated,
+            "hit_count": self.scale_count(hit_count),
             "has_hits": has_hits,
             "bounce_rate_pct": bounce_count * 100 / session_count
             if session_count > 0
             else None,
             "avg_session_duration": avg_session_duration,
             "avg_load_time": avg_load_time,
+            # Estimated from sketches, to within 2% (as are the locations')
+            "load_time_percentiles": load_time_percentiles,
             "avg_hits_per_session": avg_hits_per_session,
-            "locations": locations,
-            "referrers": referrers,
-            "countries": countries,
-            "operating_systems": operating_systems,
-            "browsers": browsers,
-            "devices": devices,
-            "device_types": device_types,
+            "locations": self.scale_counts(locations),
+            "referrers": self.scale_counts(referrers),
+            "countries": self.scale_counts(countries),
+            "operating_systems": self.scale_counts(operating_systems),
+            "browsers": self.scale_counts(browsers),
+            "devices": self.scale_counts(devices),
+            "device_types": self.scale_counts(device_types),
+            # Top locations and referrers are estimated from sketches
+            "top_estimated": top_estimated,
             "chart_data": chart_data,
             "chart_tooltip_format": chart_tooltip_format,
             "chart_granularity": chart_granularity,
             "online": True,
+            # Counts are estimated from a sample of sessions
+            "estimated": self.is_sampled,
+            "sample_rate": self.sample_rate,
+        }
+
+    def _get_top_values(self, queryset, field, key, get_values):
+        """Returns the most common values of a dimension or URL, as dicts with the
+        value under `key`. Rows are grouped by the referenced IDs, and only the top
+        values are looked up."""
+        top = queryset.values(field).annotate(count=models.Count("pk"))
+        top = list(top.order_by("-count")[:RESULTS_LIMIT])
+        values = get_values(row[field] for row in top)
+        return [{key: values.get(row[field], ""), "count": row["count"]} for row in top]
+
+    def _count_unique_visitors(self, sessions):
+        """Counts the distinct visitors of sessions exactly, by their identifier or
+        else their IP address, as the sketches built from sessions do."""
+        counts = sessions.aggregate(
+            identified=models.Count(
+                "identifier", distinct=True, filter=~models.Q(identifier="")
+            ),
+            anonymous=models.Count("ip", distinct=True, filter=models.Q(identifier="")),
+        )
+        return counts["identified"] + counts["anonymous"]
+
+    def _sketches_cover(self, kind, hits, start_time):
+        """Returns whether the service's sketches of a kind cover the hits (or
+        sessions) of a time range. Sketches are kept from when they were introduced (or as far back as
+        they were built), so they only cover ranges without hits from before then.
+        Whole hours are counted, so hits from the hours that the range starts and
+        ends in may be counted even if they're outside it."""
+        first_hour = get_sketch_start(self.pk, kind)
+        return first_hour is not None and (
+            first_hour <= start_time
+            or not hits.filter(start_time__lt=first_hour).exists()
+        )
+
+    def _get_sketched_top_urls(
+        self, kind, key, hits, start_time, end_time, hidden=None
+    ):
+        """Returns the most common URLs of a kind, like `_get_top_values`, from the
+        service's top-K sketches, or None if they don't cover the time range. URLs
+        that match `hidden` are left out."""
+        if not self._sketches_cover(kind, hits, start_time):
+            return None
+        top = get_sketch(self.pk, kind, start_time, end_time).top()
+        values = get_url_values(pk for pk, count in top if pk)
+        rows = [{key: values.get(pk, ""), "count": count} for pk, count in top]
+        if hidden is not None and hidden.pattern != r".^":
+            rows = [row for row in rows if not hidden.match(row[key])]
+        return rows[:RESULTS_LIMIT]
+
+    def _get_load_time_percentiles(self, hits, start_time, end_time):
+        """Returns the load time percentiles of a time range, and those of its most
+        loaded locations (as a dict by location), from the service's load time
+        sketches. Without sketches that cover the range, there are none."""
+        if not self._sketches_cover("load_times", hits, start_time):
+            return None, {}
+        percentiles = get_sketch(
+            self.pk, "load_times", start_time, end_time
+        ).percentiles()
+        by_location = get_sketch(
+            self.pk, "page_load_times", start_time, end_time
+        ).sketches
+        top = sorted(by_location.items(), key=lambda item: item[1].count, reverse=True)
+        top = top[:LOAD_TIME_LOCATIONS]
+        values = get_url_values(pk for pk, sketch in top if pk)
+        return percentiles, {
+            values.get(pk, ""): sketch.percentiles() for pk, sketch in top
         }
 
     def _get_avg_session_duration(self, sessions, session_count):
@@ -338,8 +549,8 @@ class Service(models.Model):
 
         chart_data = sorted(chart_data.items(), key=lambda k: k[0])
         chart_data = {
-            "sessions": [v["sessions"] for k, v in chart_data],
-            "hits": [v["hits"] for k, v in chart_data],
+            "sessions": [self.scale_count(v["sessions"]) for k, v in chart_data],
+            "hits": [self.scale_count(v["hits"]) for k, v in chart_data],
             "labels": [str(k) for k, v in chart_data],
         }
 
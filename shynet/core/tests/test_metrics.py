@@ -0,0 +1,124 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve, reverse
+
+from core import metrics
+from core.factories import ServiceFactory, UserFactory
+from dashboard.middleware import QueryMetricsMiddleware
+
+
+@mock.patch.object(metrics, "_buffer", None)
+class TestMetrics(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_render_metrics(self):
+        """
+        GIVEN: Counters and a histogram recorded by this process
+        WHEN: The metrics are rendered
+        THEN: They are exported in the Prometheus text format, with cumulative buckets
+        """
+        metrics.increment("ingress_requests", view="pixel", outcome="accepted")
+        metrics.increment("ingress_requests", 2, view="pixel", outcome="accepted")
+        metrics.observe("ingress_request_duration_seconds", 0.003, tracker="JS")
+        metrics.observe("ingress_request_duration_seconds", 0.2, tracker="JS")
+        metrics.observe("ingress_request_duration_seconds", 60, tracker="JS")
+
+        lines = metrics.render_metrics().splitlines()
+
+        self.assertIn("# TYPE shynet_ingress_requests_total counter", lines)
+        self.assertIn(
+            'shynet_ingress_requests_total{outcome="accepted",view="pixel"} 3', lines
+        )
+        self.assertIn("# TYPE shynet_ingress_request_duration_seconds histogram", lines)
+        for bound, count in (("0.005", 1), ("0.1", 1), ("0.25", 2), ("+Inf", 3)):
+            self.assertIn(
+                "shynet_ingress_request_duration_seconds_bucket"
+                f'{{tracker="JS",le="{bound}"}} {count}',
+                lines,
+            )
+        self.assertIn(
+            'shynet_ingress_request_duration_seconds_sum{tracker="JS"} 60.203', lines
+        )
+        self.assertIn(
+            'shynet_ingress_request_duration_seconds_count{tracker="JS"} 3', lines
+        )
+
+    def test_shared_between_processes(self):
+        """
+        GIVEN: A counter incremented by another process
+        WHEN: This process increments it too
+        THEN: Both increments are counted
+        """
+        metrics.increment("ingress_shed", kind="heartbeat")
+        metrics.flush()
+        with mock.patch.object(metrics, "_buffer", None):
+            with mock.patch("os.getpid", return_value=-1):
+                metrics.increment("ingress_shed", kind="heartbeat")
+                metrics.flush()
+
+        self.assertEqual(metrics.get_counter("ingress_shed", kind="heartbeat"), 2)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_view(self):
+        """
+        GIVEN: A metrics token
+        WHEN: The metrics endpoint is requested with and without the token
+        THEN: Metrics are only exported to requests that present it
+        """
+        metrics.increment("ingress_shed", kind="pixel")
+        url = reverse("core:metrics")
+
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(
+            self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 401
+        )
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'shynet_ingress_shed_total{kind="pixel"} 1', response.content.decode()
+        )
+
+    @override_settings(METRICS_TOKEN="")
+    def test_metrics_view_disabled(self):
+        """
+        GIVEN: No metrics token
+        WHEN: The metrics endpoint is requested
+        THEN: It doesn't exist
+        """
+        self.assertEqual(self.client.get(reverse("core:metrics")).status_code, 404)
+
+    def test_dashboard_queries(self):
+        """
+        GIVEN: A dashboard view that computes a service's stats
+        WHEN: It's requested
+        THEN: The view's database queries and the service's stats are measured
+        """
+        service = ServiceFactory(owner=UserFactory())
+        url = reverse("dashboard:service", kwargs={"pk": service.uuid})
+
+        def get_response(request):
+            request.resolver_match = resolve(request.path_info)
+            service.get_core_stats()
+            return HttpResponse()
+
+        QueryMetricsMiddleware(get_response)(RequestFactory().get(url))
+
+        self.assertEqual(
+            metrics.get_counter("dashboard_requests", view="dashboard:service"), 1
+        )
+        self.assertGreater(
+            metrics.get_counter("dashboard_db_queries", view="dashboard:service"), 0
+        )
+        lines = metrics.render_metrics().splitlines()
+        self.assertIn(
+            'shynet_dashboard_db_duration_seconds_count{view="dashboard:service"} 1',
+            lines,
+        )
+        self.assertIn(
+            f'shynet_service_stats_duration_seconds_count{{service="{service.uuid}"}} 1',
+            lines,
+        )
@@ -0,0 +1,157 @@
+from unittest import mock
+
+from django.db.models import Count
+from django.test import TestCase
+from django.utils import timezone
+
+from analytics.models import Hit, Session
+from core.factories import ServiceFactory, UserFactory
+from core.models import Service
+
+
+class TestSampledStats(TestCase):
+    def setUp(self):
+        self.service = ServiceFactory(owner=UserFactory(), sample_rate=0.25)
+        now = timezone.now()
+        for n in range(3):
+            session = Session.objects.create(
+                service=self.service,
+                start_time=now - timezone.timedelta(hours=1),
+                country="NL",
+            )
+            Hit.objects.create(
+                session=session,
+                service=self.service,
+                initial=True,
+                start_time=now - timezone.timedelta(hours=1),
+                last_seen=now - timezone.timedelta(hours=1),
+                location="https://example.com/",
+                tracker="JS",
+            )
+
+    def test_counts_are_scaled(self):
+        """
+        GIVEN: A service that records a quarter of its sessions
+        WHEN: Its stats are computed
+        THEN: Counts are scaled up and marked as estimates, and rates are not
+        """
+        end_time = timezone.now()
+        stats = self.service.get_relative_stats(
+            end_time - timezone.timedelta(days=1), end_time
+        )
+
+        self.assertTrue(stats["estimated"])
+        self.assertEqual(stats["session_count"], 12)
+        self.assertEqual(stats["hit_count"], 12)
+        self.assertEqual(stats["bounce_rate_pct"], 100)
+        self.assertEqual(stats["avg_hits_per_session"], 1)
+        self.assertEqual(stats["countries"][0]["count"], 12)
+        self.assertEqual(stats["locations"][0]["count"], 12)
+        self.assertEqual(sum(stats["chart_data"]["sessions"]), 12)
+
+
+class TestHiddenReferrers(TestCase):
+    def setUp(self):
+        self.service = ServiceFactory(owner=UserFactory())
+        self.start_time = timezone.now() - timezone.timedelta(hours=1)
+        for referrer in (
+            "https://example.com/",
+            "https://example.com/about/",
+            "https://www.example.com/",
+            "https://duck.com/?q=shynet",
+            "https://duck.com/",
+            "",
+        ):
+            session = Session.objects.create(
+                service=self.service, start_time=self.start_time
+            )
+            Hit.objects.create(
+                session=session,
+                service=self.service,
+                start_time=self.start_time,
+                location="https://example.com/",
+                referrer=referrer,
+                tracker="JS",
+            )
+
+    def get_referrers(self):
+        stats = self.service.get_relative_stats(
+            self.start_time - timezone.timedelta(days=1), timezone.now()
+        )
+        return {row["referrer"]: row["count"] for row in stats["referrers"]}
+
+    def test_referrers_are_hidden_by_the_database(self):
+        """
+        GIVEN: A service that hides referrers from its own site
+        WHEN: Its stats are computed
+        THEN: Referrers that match from their start are left out of the query, and
+              direct sessions are kept
+        """
+        self.service.hide_referrer_regex = r"https://example\.com"
+
+        referrers = self.get_referrers()
+
+        self.assertEqual(
+            referrers,
+            {
+                "https://www.example.com/": 1,
+                "https://duck.com/?q=shynet": 1,
+                "https://duck.com/": 1,
+                "": 1,
+            },
+        )
+
+    def test_direct_sessions_can_be_hidden(self):
+        """
+        GIVEN: A service with a regex that matches empty referrers
+        WHEN: Its stats are computed
+        THEN: Direct sessions are hidden too
+        """
+        self.service.hide_referrer_regex = r"$|https://(www\.)?example\.com"
+
+        referrers = self.get_referrers()
+
+        self.assertEqual(
+            referrers, {"https://duck.com/?q=shynet": 1, "https://duck.com/": 1}
+        )
+
+    def test_regex_unsupported_by_the_database(self):
+        """
+        GIVEN: A service with a regex that the database doesn't support
+        WHEN: Its stats are computed
+        THEN: The referrers are hidden in Python instead
+        """
+        self.service.hide_referrer_regex = r"$|https://(?P<www>www\.)?example\.com"
+
+        with mock.patch.object(Service, "_database_accepts_regex", return_value=False):
+            referrers = self.get_referrers()
+
+        self.assertEqual(
+            referrers, {"https://duck.com/?q=shynet": 1, "https://duck.com/": 1}
+        )
+
+    def test_invalid_regex_hides_nothing(self):
+        """
+        GIVEN: A service whose regex is malformed
+        WHEN: Its stats are computed
+        THEN: No referrers are hidden
+        """
+        self.service.hide_referrer_regex = "(unclosed"
+
+        self.assertEqual(len(self.get_referrers()), 6)
+
+    def test_referring_domains(self):
+        """
+        GIVEN: A service that hides its own site's referrers
+        WHEN: Its referrers are grouped by host
+        THEN: Every visible domain is counted once per session
+        """
+        self.service.hide_referrer_regex = r"https://example\.com"
+
+        hosts = (
+            self.service.get_referrer_hits(Hit.objects.filter(service=self.service))
+            .values_list("referrer_url__host")
+            .annotate(count=Count("pk"))
+        )
+
+        self.assertEqual(dict(hosts), {"www.example.com": 1, "duck.com": 2, None: 1})
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from analytics.sketches import clear_sketches
+from analytics.tasks import ingress_request
+from core.factories import ServiceFactory, UserFactory
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"
+
+
+class TestTracing(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(clear_sketches)
+        self.service = ServiceFactory(owner=UserFactory())
+
+    def ingress(self, payload):
+        ingress_request(
+            self.service.uuid,
+            "JS",
+            timezone.now(),
+            payload,
+            "203.0.113.1",
+            "https://example.com/",
+            USER_AGENT,
+        )
+
+    @override_settings(TRACING_SAMPLE_RATE=1, TRACING_FILE="")
+    def test_ingress_stages_logged(self):
+        """
+        GIVEN: Tracing of every event, exported to the log
+        WHEN: A visitor's first event is ingested
+        THEN: Each stage is logged as a span of the event's trace
+        """
+        with self.assertLogs("shynet.tracing", "INFO") as logs:
+            self.ingress({"idempotency": "a"})
+
+        spans = [json.loads(record.getMessage()) for record in logs.records]
+        by_name = {span["name"]: span for span in spans}
+        root = by_name["ingress_request"]
+        self.assertIsNone(root["parent_id"])
+        self.assertEqual(root["attributes"], {"tracker": "JS", "heartbeat": False})
+        for name in ("service", "session_association", "hit_create", "cache_write"):
+            self.assertEqual(by_name[name]["parent_id"], root["span_id"])
+        for name in ("geoip", "user_agent", "session_create"):
+            self.assertIn(name, by_name)
+        self.assertEqual({span["trace_id"] for span in spans}, {root["trace_id"]})
+
+    @override_settings(TRACING_SAMPLE_RATE=0)
+    def test_unsampled(self):
+        """
+        GIVEN: Tracing disabled
+        WHEN: An event is ingested
+        THEN: Nothing is traced
+        """
+        with self.assertNoLogs("shynet.tracing"):
+            self.ingress({"idempotency": "a"})
+
+    def test_stats_queries_written_as_otlp(self):
+        """
+        GIVEN: Tracing of every stats computation, exported to a file
+        WHEN: A service's core stats are computed
+        THEN: A single OTLP/JSON trace spans both periods and each of their queries
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traces.json")
+            with self.settings(TRACING_SAMPLE_RATE=1, TRACING_FILE=path):
+                self.service.get_core_stats()
+            with open(path) as f:
+                lines = f.readlines()
+
+        self.assertEqual(len(lines), 1)
+        spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        root = spans[0]
+        self.assertEqual(root["name"], "get_core_stats")
+        self.assertEqual(root["parentSpanId"], "")
+        self.assertEqual(
+            root["attributes"],
+            [{"key": "service", "value": {"stringValue": str(self.service.uuid)}}],
+        )
+        periods = [span for span in spans if span["name"] == "get_relative_stats"]
+        self.assertEqual(len(periods), 2)
+        self.assertEqual({span["parentSpanId"] for span in periods}, {root["spanId"]})
+        locations = [span for span in spans if span["name"] == "locations"]
+        self.assertEqual(
+            {span["parentSpanId"] for span in locations},
+            {span["spanId"] for span in periods},
+        )
+        for span in spans:
+            self.assertLessEqual(
+                int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+            )
@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import time_ns
+
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+# Spans are logged here (as JSON) unless they're written to a file
+span_log = logging.getLogger("shynet.tracing")
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "attributes",
+        "start",
+        "end",
+    )
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time_ns()
+        self.end = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+
+    def start_span(self, name, parent_id, attributes):
+        span = Span(self, name, parent_id, attributes)
+        self.spans.append(span)
+        return span
+
+
+@contextmanager
+def _record(span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        span.end = time_ns()
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Starts a trace, for a sample of `TRACING_SAMPLE_RATE` of the calls that
+    aren't already part of one (which this becomes a span of instead). The trace
+    is exported once it ends. Yields the root span, or None if it isn't sampled."""
+    parent = _current_span.get()
+    if parent is not None:
+        with _record(parent.trace.start_span(name, parent.span_id, attributes)) as s:
+            yield s
+        return
+    if random.random() >= settings.TRACING_SAMPLE_RATE:
+        yield None
+        return
+    new_trace = Trace()
+    try:
+        with _record(new_trace.start_span(name, None, attributes)) as s:
+            yield s
+    finally:
+        try:
+            export(new_trace)
+        except Exception as e:
+            log.exception(e)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Times a stage of the current trace (if there is one)."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    with _record(parent.trace.start_span(name, parent.span_id, attributes)) as s:
+        yield s
+
+
+def set_attribute(key, value):
+    """Sets an attribute of the current span (if there is one)."""
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace):
+    """Returns a trace as an OTLP/JSON `ExportTraceServiceRequest`, the format
+    that the OpenTelemetry Collector's `otlpjsonfile` receiver reads."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": "shynet"}},
+                        {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [
+                            {
+                                "traceId": trace.trace_id,
+                                "spanId": s.span_id,
+                                "parentSpanId": s.parent_id or "",
+                                "name": s.name,
+                                "kind": 1,  # Internal
+                                "startTimeUnixNano": str(s.start),
+                                "endTimeUnixNano": str(s.end),
+                                "attributes": [
+                                    {"key": key, "value": _format_value(value)}
+                                    for key, value in s.attributes.items()
+                                ],
+                            }
+                            for s in trace.spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def export(trace):
+    """Appends a trace to `TRACING_FILE` as a line of OTLP/JSON or, if no file is
+    set, logs each of its spans as JSON."""
+    if settings.TRACING_FILE:
+        line = json.dumps(to_otlp(trace), separators=(",", ":")) + "\n"
+        # A single append keeps concurrent processes from interleaving traces
+        with open(settings.TRACING_FILE, "a") as f:
+            f.write(line)
+        return
+    for s in trace.spans:
+        span_log.info(
+            json.dumps(
+                {
+                    "trace_id": trace.trace_id,
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "name": s.name,
+                    "start": s.start / 1_000_000_000,
+                    "duration_ms": (s.end - s.start) / 1_000_000,
+                    "attributes": s.attributes,
+                },
+                default=str,
+            )
+        )
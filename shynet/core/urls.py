@@ -8,4 +8,5 @@ urlpatterns = [
     path(
         "", RedirectView.as_view(url=reverse_lazy("dashboard:dashboard")), name="index"
     ),
+    path("metrics", views.MetricsView.as_view(), name="metrics"),
 ]
@@ -1,5 +1,31 @@
-from django.views.generic import TemplateView
+from hmac import compare_digest
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.generic import TemplateView, View
+
+from .metrics import render_metrics
 
 
 class IndexView(TemplateView):
     template_name = "dashboard/pages/index.html"
+
+
+class MetricsView(View):
+    """Exports metrics in the Prometheus text format to scrapers that present the
+    metrics token (as a bearer token)."""
+
+    def get(self, request, *args, **kwargs):
+        if not settings.METRICS_TOKEN:
+            raise Http404()
+        authorization = request.headers.get("Authorization", "")
+        if not compare_digest(
+            authorization.encode("utf-8"),
+            f"Bearer {settings.METRICS_TOKEN}".encode("utf-8"),
+        ):
+            response = HttpResponse(status=401)
+            response["WWW-Authenticate"] = "Bearer"
+            return response
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
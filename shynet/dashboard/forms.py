@@ -16,7 +16,10 @@ class ServiceForm(forms.ModelForm):
             "collect_ips",
             "ignored_ips",
             "ignore_robots",
+            "sample_rate",
             "hide_referrer_regex",
+            "strip_query_params",
+            "kept_query_params",
             "origins",
             "collaborators",
             "script_inject",
@@ -34,7 +37,12 @@ class ServiceForm(forms.ModelForm):
             "ignore_robots": forms.RadioSelect(
                 choices=[(True, _("Yes")), (False, _("No"))]
             ),
+            "sample_rate": forms.NumberInput(attrs={"step": "any"}),
             "hide_referrer_regex": forms.TextInput(),
+            "strip_query_params": forms.RadioSelect(
+                choices=[(True, _("Yes")), (False, _("No"))]
+            ),
+            "kept_query_params": forms.TextInput(),
             "script_inject": forms.Textarea(attrs={"class": "font-mono", "rows": 5}),
         }
         labels = {
@@ -42,7 +50,10 @@ class ServiceForm(forms.ModelForm):
             "respect_dnt": _("Respect DNT"),
             "ignored_ips": _("Ignored IP addresses"),
             "ignore_robots": _("Ignore robots"),
+            "sample_rate": _("Sample rate"),
             "hide_referrer_regex": _("Hide specific referrers"),
+            "strip_query_params": _("Strip query parameters"),
+            "kept_query_params": _("Kept query parameters"),
             "script_inject": _("Additional injected JS"),
         }
         help_texts = {
@@ -60,8 +71,17 @@ class ServiceForm(forms.ModelForm):
             "ignore_robots": _(
                 "Should sessions generated by bots be excluded from tracking?"
             ),
+            "sample_rate": _(
+                "What fraction of sessions should be recorded (e.g., '0.1' for one in ten)? Statistics are scaled up to estimate the true totals. Use '1' to record every session."
+            ),
             "hide_referrer_regex": _(
-                "Any referrers that match this <a href='https://regexr.com/'>RegEx</a> will not be listed in the referrer summary. Sessions will still be tracked normally. No effect if left blank."
+                "Any referrers that match this <a href='https://regexr.com/'>RegEx</a> will not be listed in the referrer summary or referring domains. It is matched from the start of the referrer by the database, so stick to common RegEx syntax. Sessions will still be tracked normally. No effect if left blank."
+            ),
+            "strip_query_params": _(
+                "Should query parameters (e.g., '?utm_source=...') be removed from locations and referrers? This keeps tracking and session tokens out of your data, and groups pages that only differ in their parameters."
+            ),
+            "kept_query_params": _(
+                "A comma-separated list of query parameters to keep when stripping the others (e.g., 'page, q'). No effect if query parameters aren't stripped."
             ),
             "script_inject": _(
                 "Optional additional JavaScript to inject at the end of the Shynet script. This code will be injected on every page where this service is installed."
@@ -0,0 +1,156 @@
+import json
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.benchmarking import (
+    QueryCounter,
+    compare_results,
+    get_environment,
+    save_results,
+)
+from core.models import Service
+
+RANGES = (3, 30, 90, 365)
+TARGETS = ("core_stats", "sessions", "locations", "api")
+
+# The metrics that are compared against a baseline run
+COMPARED_METRICS = ("median_ms", "min_ms", "queries")
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the dashboard's queries over a service's data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("service", type=str, help="UUID of the service")
+        parser.add_argument(
+            "--days",
+            type=int,
+            action="append",
+            help="Length of the date ranges to benchmark (may be repeated; defaults "
+            "to 3, 30, 90 and 365)",
+        )
+        parser.add_argument(
+            "--target",
+            action="append",
+            choices=TARGETS,
+            help="What to benchmark: `get_core_stats`, the session and location "
+            "lists, or the dashboard API (may be repeated; defaults to all)",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--exact",
+            action="store_true",
+            help="Count the top locations and referrers exactly, rather than "
+            "estimating them from sketches",
+        )
+        parser.add_argument("--output", type=str, help="Save the results as JSON")
+        parser.add_argument(
+            "--baseline", type=str, help="Compare with the results of an earlier run"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            service = Service.objects.get(uuid=options.get("service"))
+        except (Service.DoesNotExist, ValueError):
+            raise CommandError(f"No service {options.get('service')}")
+        self.service = service
+        self.exact = options.get("exact")
+        self.client = Client(raise_request_exception=True, HTTP_HOST=self.get_host())
+        self.client.force_login(service.owner)
+
+        results = {}
+        # Static files don't need to be collected to render the pages
+        with override_settings(
+            STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+        ):
+            for days in options.get("days") or RANGES:
+                end = timezone.now()
+                start = end - timezone.timedelta(days=days)
+                for target in options.get("target") or TARGETS:
+                    name = f"{target}_{days}d"
+                    results[name] = self.benchmark(
+                        target, start, end, options.get("repeat")
+                    )
+                    self.report(name, results[name])
+
+        output = {
+            "environment": get_environment(),
+            "config": {
+                "service": str(service.uuid),
+                "sessions": service.session_set.count(),
+                "hits": service.hit_set.count(),
+                "repeat": options.get("repeat"),
+                "exact": self.exact,
+            },
+            "results": results,
+        }
+        if options.get("baseline"):
+            with open(options.get("baseline")) as f:
+                baseline = json.load(f)
+            for name, before, after, change in compare_results(
+                baseline["results"], results, COMPARED_METRICS
+            ):
+                change = f"{change:+.1%}" if change is not None else "n/a"
+                self.stdout.write(f"{name}: {before:.2f} -> {after:.2f} ({change})")
+        if options.get("output"):
+            save_results(options.get("output"), output)
+            self.stdout.write(f"Saved results to {options.get('output')}")
+
+    def get_host(self):
+        hosts = [host for host in settings.ALLOWED_HOSTS if host not in ("", "*")]
+        return hosts[0].lstrip(".") if hosts else "localhost"
+
+    def run_target(self, target, start, end):
+        if target == "core_stats":
+            self.service.get_core_stats(start, end, exact=self.exact)
+            return
+        params = {
+            "startDate": start.strftime("%Y-%m-%d"),
+            "endDate": end.strftime("%Y-%m-%d"),
+        }
+        if self.exact:
+            params["exact"] = "true"
+        if target == "api":
+            response = self.client.get(
+                reverse("api:services"),
+                dict(params, uuid=str(self.service.uuid)),
+                HTTP_AUTHORIZATION=f"Token {self.service.owner.api_token}",
+            )
+        else:
+            response = self.client.get(
+                reverse(
+                    f"dashboard:service_{target[:-1]}_list",
+                    kwargs={"pk": self.service.uuid},
+                ),
+                params,
+            )
+        if response.status_code != 200:
+            raise CommandError(f"{target} responded with {response.status_code}")
+
+    def benchmark(self, target, start, end, repeat):
+        durations = []
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            for _ in range(repeat):
+                begin = perf_counter()
+                self.run_target(target, start, end)
+                durations.append(perf_counter() - begin)
+        return {
+            "median_ms": median(durations) * 1000,
+            "min_ms": min(durations) * 1000,
+            "max_ms": max(durations) * 1000,
+            "queries": counter.queries / repeat,
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name}: median {result['median_ms']:.1f}ms, "
+            f"min {result['min_ms']:.1f}ms, {result['queries']:.0f} queries"
+        )
@@ -0,0 +1,41 @@
+from time import perf_counter
+
+from django.db import connection
+
+from core.metrics import increment, observe
+
+
+class QueryRecorder:
+    """Database execute wrapper that counts queries and the time they take."""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.duration += perf_counter() - start
+
+
+class QueryMetricsMiddleware:
+    """Records how many database queries each dashboard view makes, and how long
+    they take (including those made while rendering the response)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        match = getattr(request, "resolver_match", None)
+        if match is not None and match.namespace == "dashboard":
+            view = match.view_name
+            increment("dashboard_requests", view=view)
+            increment("dashboard_db_queries", recorder.queries, view=view)
+            observe("dashboard_db_duration_seconds", recorder.duration, view=view)
+        return response
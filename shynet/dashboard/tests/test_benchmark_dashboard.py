@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from analytics.synthetic import DatasetGenerator
+from core.benchmarking import create_benchmark_service
+
+
+class TestBenchmarkDashboard(TestCase):
+    def test_benchmark(self):
+        """
+        GIVEN: A service with synthetic data
+        WHEN: The dashboard is benchmarked
+        THEN: Each target is timed over each date range, and the results are saved
+        """
+        service = create_benchmark_service("Benchmark")
+        list(DatasetGenerator(service).generate(10, 20))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            call_command(
+                "benchmark_dashboard",
+                str(service.uuid),
+                "--days=3",
+                "--days=30",
+                "--repeat=1",
+                f"--output={path}",
+                stdout=StringIO(),
+            )
+            with open(path) as f:
+                results = json.load(f)
+
+        self.assertEqual(results["config"]["sessions"], service.session_set.count())
+        self.assertEqual(
+            set(results["results"]),
+            {
+                f"{target}_{days}d"
+                for target in ("core_stats", "sessions", "locations", "api")
+                for days in (3, 30)
+            },
+        )
+        for result in results["results"].values():
+            self.assertGreater(result["queries"], 0)
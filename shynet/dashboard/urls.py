@@ -31,6 +31,16 @@ urlpatterns = [
         views.ServiceLocationsListView.as_view(),
         name="service_location_list",
     ),
+    path(
+        "service/<pk>/referrers/",
+        views.ServiceReferrerHostsListView.as_view(),
+        name="service_referrer_host_list",
+    ),
+    path(
+        "service/<pk>/live/",
+        views.ServiceLiveView.as_view(),
+        name="service_live",
+    ),
     path(
         "api-token-refresh/",
         views.RefreshApiTokenView.as_view(),
@@ -1,8 +1,12 @@
+import json
+from time import monotonic, sleep
+
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core.cache import cache
-from django.db.models import Q, Count
+from django.db.models import Q, Count, F
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404, reverse, redirect
 from django.views.generic import (
     CreateView,
@@ -14,6 +18,8 @@ from django.views.generic import (
 )
 from rules.contrib.views import PermissionRequiredMixin
 
+from analytics.dimensions import get_url_values, prefetch_dimensions, prefetch_urls
+from analytics.live import get_live_stats
 from analytics.models import Session, Hit
 from core.models import Service, _default_api_token, RESULTS_LIMIT
 
@@ -66,13 +72,24 @@ class ServiceView(
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
         data["script_protocol"] = "https://" if settings.SCRIPT_USE_HTTPS else "http://"
-        data["stats"] = self.object.get_core_stats(data["start_date"], data["end_date"])
+        data["stats"] = self.object.get_core_stats(
+            data["start_date"],
+            data["end_date"],
+            exact=self.request.GET.get("exact") == "true",
+        )
+        # The same page, with the top locations and referrers counted exactly
+        exact_query = self.request.GET.copy()
+        exact_query["exact"] = "true"
+        data["exact_query"] = exact_query.urlencode()
         data["RESULTS_LIMIT"] = RESULTS_LIMIT
-        data["object_list"] = Session.objects.filter(
-            service=self.get_object(),
-            start_time__lt=self.get_end_date(),
-            start_time__gt=self.get_start_date(),
-        ).order_by("-start_time")[:10]
+        data["object_list"] = list(
+            Session.objects.filter(
+                service=self.get_object(),
+                start_time__lt=self.get_end_date(),
+                start_time__gt=self.get_start_date(),
+            ).order_by("-start_time")[:10]
+        )
+        prefetch_dimensions(data["object_list"])
         return data
 
 
@@ -138,6 +155,7 @@ class ServiceSessionsListView(
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
         data["object"] = self.get_object()
+        prefetch_dimensions(data["object_list"])
         return data
 
 
@@ -161,16 +179,98 @@ class ServiceLocationsListView(
         self.hit_count = hits.count()
 
         return (
-            hits.values("location").annotate(count=Count("location")).order_by("-count")
+            hits.values("location_url").annotate(count=Count("pk")).order_by("-count")
+        )
+
+    def get_context_data(self, **kwargs):
+        data = super().get_context_data(**kwargs)
+        data["object"] = self.get_object()
+        data["hit_count"] = data["object"].scale_count(self.hit_count)
+        # Only the locations on the page are looked up
+        locations = get_url_values(row["location_url"] for row in data["object_list"])
+        data["object_list"] = data["object"].scale_counts(
+            [
+                {
+                    "location": locations.get(row["location_url"], ""),
+                    "count": row["count"],
+                }
+                for row in data["object_list"]
+            ]
+        )
+        return data
+
+
+class ServiceReferrerHostsListView(
+    LoginRequiredMixin, PermissionRequiredMixin, DateRangeMixin, ListView
+):
+    model = Hit
+    template_name = "dashboard/pages/service_referrer_host_list.html"
+    paginate_by = RESULTS_LIMIT
+    permission_required = "core.view_service"
+
+    def get_object(self):
+        return get_object_or_404(Service, pk=self.kwargs.get("pk"))
+
+    def get_queryset(self):
+        service = self.get_object()
+        self.session_count = Session.objects.filter(
+            service=service,
+            start_time__lt=self.get_end_date(),
+            start_time__gt=self.get_start_date(),
+        ).count()
+        hits = service.get_referrer_hits(
+            Hit.objects.filter(
+                service=service,
+                start_time__lt=self.get_end_date(),
+                start_time__gt=self.get_start_date(),
+            )
+        )
+
+        # Hosts are stored with the URLs, so grouping by them only needs a join
+        # with the (much smaller) URL table
+        return (
+            hits.values(host=F("referrer_url__host"))
+            .annotate(count=Count("pk"))
+            .order_by("-count")
         )
 
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
         data["object"] = self.get_object()
-        data["hit_count"] = self.hit_count
+        data["session_count"] = data["object"].scale_count(self.session_count)
+        data["object_list"] = data["object"].scale_counts(data["object_list"])
         return data
 
 
+class ServiceLiveView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+    """Streams a service's live stats as server-sent events."""
+
+    model = Service
+    permission_required = "core.view_service"
+
+    def get(self, request, *args, **kwargs):
+        service = self.get_object()
+        response = StreamingHttpResponse(
+            self.stream(service), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        # Tell nginx not to buffer the events
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def stream(self, service):
+        interval = settings.LIVE_UPDATE_INTERVAL
+        # Browsers reconnect after this many milliseconds once the stream ends
+        yield f"retry: {round(interval * 1000)}\n\n"
+        deadline = monotonic() + settings.LIVE_STREAM_DURATION
+        while True:
+            stats = json.dumps(get_live_stats(service))
+            yield f"event: stats\ndata: {stats}\n\n"
+            if monotonic() + interval > deadline:
+                return
+            sleep(interval)
+
+
 class ServiceSessionView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
     model = Session
     template_name = "dashboard/pages/service_session.html"
@@ -184,6 +284,9 @@ class ServiceSessionView(LoginRequiredMixin, PermissionRequiredMixin, DetailView
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
         data["object"] = get_object_or_404(Service, pk=self.kwargs.get("pk"))
+        prefetch_dimensions([data["session"]])
+        data["hits"] = list(data["session"].hit_set.all())
+        prefetch_urls(data["hits"])
         return data
 
 
@@ -82,6 +82,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "dashboard.middleware.QueryMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "shynet.urls"
@@ -150,6 +151,10 @@ if "DATABASE_URL" in os.environ:
     if url.scheme == "postgres":
         DATABASES["default"]["ENGINE"] = "django.db.backends.postgresql_psycopg2"
 
+# Only PostgreSQL uses the non-key columns of covering indexes; other databases
+# create the indexes without them, which is fine
+SILENCED_SYSTEM_CHECKS = ["models.W040"]
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -179,6 +184,7 @@ LOGGING = {
             "style": "{",
         },
         "simple": {"format": "{levelname} {message}", "style": "{"},
+        "message": {"format": "{message}", "style": "{"},
     },
     "filters": {"require_debug_true": {"()": "django.utils.log.RequireDebugTrue"}},
     "handlers": {
@@ -188,6 +194,11 @@ LOGGING = {
             "class": "logging.StreamHandler",
             "formatter": "simple",
         },
+        "tracing": {
+            "level": "INFO",
+            "class": "logging.StreamHandler",
+            "formatter": "message",
+        },
         "mail_admins": {
             "level": "ERROR",
             "class": "django.utils.log.AdminEmailHandler",
@@ -201,6 +212,11 @@ LOGGING = {
             "level": "ERROR",
             "propagate": True,
         },
+        "shynet.tracing": {
+            "handlers": ["tracing"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
 
@@ -355,6 +371,91 @@ SESSION_MEMORY_TIMEOUT = int(os.getenv("SESSION_MEMORY_TIMEOUT", "1800"))
 # Should the Shynet version information be displayed?
 SHOW_SHYNET_VERSION = os.getenv("SHOW_SHYNET_VERSION", "True") == "True"
 
+# How should the ingress views hand events to the workers? "celery" enqueues a
+# Celery task; "stream" appends a compact event to a Redis stream, which is read by
+# `./manage.py consume_ingress`.
+INGRESS_TRANSPORT = os.getenv("INGRESS_TRANSPORT", "celery")
+INGRESS_STREAM_URL = os.getenv("INGRESS_STREAM_URL", CELERY_BROKER_URL)
+INGRESS_STREAM_NAME = os.getenv("INGRESS_STREAM_NAME", "shynet_ingress")
+# Roughly how many events should the stream retain?
+INGRESS_STREAM_MAXLEN = int(os.getenv("INGRESS_STREAM_MAXLEN", "1000000"))
+
+# Where should ingress events be spooled when the transport (or, when tasks run
+# eagerly, the database) is unavailable? Spooled events are replayed by
+# `./manage.py replay_spool`. Leave empty to disable spooling.
+INGRESS_SPOOL_DIR = os.getenv("INGRESS_SPOOL_DIR", "")
+# How large should each spool segment file be, in bytes?
+INGRESS_SPOOL_SEGMENT_SIZE = int(
+    os.getenv("INGRESS_SPOOL_SEGMENT_SIZE", str(16 * 1024 * 1024))
+)
+
+# Over how many queues (`ingress_0`, `ingress_1`, ...) should ingestion be
+# partitioned? All of a visitor's events are routed to the same queue (or stream,
+# when using the stream transport), so each queue's worker can keep its visitors'
+# sessions in memory and write heartbeats in bulk. Every queue must be consumed by
+# exactly one worker process. 0 disables partitioning.
+INGRESS_PARTITIONS = int(os.getenv("INGRESS_PARTITIONS", "0"))
+
+# How many sessions and hits should a partition worker keep in memory?
+INGRESS_PARTITION_TABLE_SIZE = int(os.getenv("INGRESS_PARTITION_TABLE_SIZE", "100000"))
+
+# How many buffered heartbeats should a partition worker write at once, and how
+# often (in seconds) should it write them at the latest?
+INGRESS_PARTITION_FLUSH_SIZE = int(os.getenv("INGRESS_PARTITION_FLUSH_SIZE", "500"))
+INGRESS_PARTITION_FLUSH_INTERVAL = float(
+    os.getenv("INGRESS_PARTITION_FLUSH_INTERVAL", "2")
+)
+
+# How far behind can ingestion fall before the ingress views start shedding load,
+# in seconds since the oldest waiting event was received and in events waiting?
+# Past the threshold heartbeats are dropped, past twice the threshold pixel hits
+# too, and past four times the threshold only a sample of JS page loads is kept.
+# 0 disables a threshold.
+INGRESS_LAG_THRESHOLD = int(os.getenv("INGRESS_LAG_THRESHOLD", "0"))
+INGRESS_QUEUE_DEPTH_THRESHOLD = int(os.getenv("INGRESS_QUEUE_DEPTH_THRESHOLD", "0"))
+# How often should each process measure the lag, in seconds?
+INGRESS_LAG_CHECK_INTERVAL = int(os.getenv("INGRESS_LAG_CHECK_INTERVAL", "5"))
+# What fraction of JS page loads should be kept when shedding them?
+INGRESS_SHED_SAMPLE_RATE = float(os.getenv("INGRESS_SHED_SAMPLE_RATE", "0.25"))
+
+# How many events per second should a single service (or client IP) be able to send
+# on average, and how many at once? 0 disables the limit; the burst defaults to ten
+# seconds' worth of events.
+INGRESS_RATE_LIMIT_SERVICE = float(os.getenv("INGRESS_RATE_LIMIT_SERVICE", "0"))
+INGRESS_RATE_LIMIT_SERVICE_BURST = int(
+    os.getenv("INGRESS_RATE_LIMIT_SERVICE_BURST", "0")
+)
+INGRESS_RATE_LIMIT_IP = float(os.getenv("INGRESS_RATE_LIMIT_IP", "0"))
+INGRESS_RATE_LIMIT_IP_BURST = int(os.getenv("INGRESS_RATE_LIMIT_IP_BURST", "0"))
+# Should rate limited events be dropped silently (`drop`) or answered with a 429
+# (`429`)?
+INGRESS_RATE_LIMIT_RESPONSE = os.getenv("INGRESS_RATE_LIMIT_RESPONSE", "drop")
+# How large can a tracking script request body be, in bytes?
+INGRESS_MAX_BODY_SIZE = int(os.getenv("INGRESS_MAX_BODY_SIZE", "16384"))
+
+# What bearer token must Prometheus present to scrape `/metrics`? Leaving it empty
+# disables the endpoint.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# What fraction of ingress events and stats computations should be traced? Traces
+# time each stage, and are logged as JSON lines unless a file is set, in which case
+# they're appended to it as OTLP/JSON (which the OpenTelemetry Collector can read).
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0"))
+TRACING_FILE = os.getenv("TRACING_FILE", "")
+
+# How often (in seconds) should the live dashboard be updated, and for how long
+# should each live connection stay open? Every open connection occupies a
+# webserver worker (or thread), so by default each one only sends the latest
+# update, and browsers reconnect for the next. Raise the duration if your
+# webserver runs threaded or asynchronous workers.
+LIVE_UPDATE_INTERVAL = float(os.getenv("LIVE_UPDATE_INTERVAL", "5"))
+LIVE_STREAM_DURATION = float(os.getenv("LIVE_STREAM_DURATION", "0"))
+
+# How often (in seconds) should each process add the hits it has ingested to the
+# sketches (of unique visitors, top locations and referrers, and load times) in
+# the database?
+SKETCH_FLUSH_INTERVAL = float(os.getenv("SKETCH_FLUSH_INTERVAL", "10"))
+
 # Should Shynet show third-party icons in the dashboard?
 SHOW_THIRD_PARTY_ICONS = os.getenv("SHOW_THIRD_PARTY_ICONS", "True") == "True"
 